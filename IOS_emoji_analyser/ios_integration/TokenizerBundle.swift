@@ -0,0 +1,115 @@
+import Foundation
+
+/// tokenizer.emtk 的读取器（格式见 emotion_recognition/tokenizer_bundle.py，版本 1，小端）
+/// 文件以内存映射方式打开，只读取 64 字节头部；查表是在码位表上二分查找，启动时不解析任何文本
+struct TokenizerBundle {
+
+    static let magic: [UInt8] = Array("EMTK".utf8)
+    static let version: UInt16 = 1
+
+    let maxLength: Int
+    let vocabSize: Int
+    let clsId: Int
+    let sepId: Int
+    let unkId: Int
+    let padId: Int
+    let seqBuckets: [Int]
+    let labels: [String]
+
+    private let data: Data
+    private let tableOffset: Int
+    private let numEntries: Int
+
+    enum BundleError: Error {
+        case tooSmall, badMagic, unsupportedVersion(UInt16), checksumMismatch
+    }
+
+    /// 从 App Bundle 中加载（默认 tokenizer.emtk）
+    static func load(resource: String = "tokenizer", withExtension ext: String = "emtk") -> TokenizerBundle? {
+        guard let url = Bundle.main.url(forResource: resource, withExtension: ext) else { return nil }
+        return try? TokenizerBundle(url: url)
+    }
+
+    init(url: URL, verify: Bool = true) throws {
+        let bytes = try Data(contentsOf: url, options: .alwaysMapped)
+        guard bytes.count >= 64 else { throw BundleError.tooSmall }
+        guard Array(bytes[0..<4]) == TokenizerBundle.magic else { throw BundleError.badMagic }
+
+        let version = UInt16(truncatingIfNeeded: TokenizerBundle.readU32(bytes, 4) & 0xFFFF)
+        guard version == TokenizerBundle.version else { throw BundleError.unsupportedVersion(version) }
+        if verify && TokenizerBundle.crc32(bytes, from: 12) != TokenizerBundle.readU32(bytes, 8) {
+            throw BundleError.checksumMismatch
+        }
+
+        data = bytes
+        let u32 = { (offset: Int) in Int(TokenizerBundle.readU32(bytes, offset)) }
+        maxLength = u32(12)
+        vocabSize = u32(16)
+        numEntries = u32(20)
+        let numLabels = u32(24)
+        let numBuckets = u32(28)
+        clsId = u32(32)
+        sepId = u32(36)
+        unkId = u32(40)
+        padId = u32(44)
+        tableOffset = u32(48)
+        let bucketsOffset = u32(52)
+        let labelsOffset = u32(56)
+
+        seqBuckets = (0..<numBuckets).map { u32(bucketsOffset + 4 * $0) }
+        let stringsOffset = labelsOffset + 4 * (numLabels + 1)
+        labels = (0..<numLabels).map { i in
+            let start = stringsOffset + u32(labelsOffset + 4 * i)
+            let end = stringsOffset + u32(labelsOffset + 4 * (i + 1))
+            return String(decoding: bytes[start..<end], as: UTF8.self)
+        }
+    }
+
+    /// 与 vocab[String(char)] 等价：单码位字符二分查找，多码位字素簇和查不到的字符为 [UNK]
+    func tokenId(for char: Character) -> Int {
+        let scalars = char.unicodeScalars
+        guard scalars.count == 1, let scalar = scalars.first else { return unkId }
+        let codePoint = scalar.value
+        var lo = 0
+        var hi = numEntries
+        while lo < hi {
+            let mid = (lo + hi) / 2
+            if TokenizerBundle.readU32(data, tableOffset + 8 * mid) < codePoint {
+                lo = mid + 1
+            } else {
+                hi = mid
+            }
+        }
+        if lo < numEntries && TokenizerBundle.readU32(data, tableOffset + 8 * lo) == codePoint {
+            return Int(TokenizerBundle.readU32(data, tableOffset + 8 * lo + 4))
+        }
+        return unkId
+    }
+
+    // MARK: - 二进制读取
+
+    private static func readU32(_ data: Data, _ offset: Int) -> UInt32 {
+        return data.withUnsafeBytes { raw in
+            UInt32(littleEndian: raw.loadUnaligned(fromByteOffset: offset, as: UInt32.self))
+        }
+    }
+
+    private static let crcTable: [UInt32] = (0..<256).map { n -> UInt32 in
+        var c = UInt32(n)
+        for _ in 0..<8 {
+            c = (c & 1) != 0 ? 0xEDB8_8320 ^ (c >> 1) : c >> 1
+        }
+        return c
+    }
+
+    /// CRC-32（与 zlib.crc32 相同）
+    private static func crc32(_ data: Data, from start: Int) -> UInt32 {
+        var crc: UInt32 = 0xFFFF_FFFF
+        data.withUnsafeBytes { raw in
+            for byte in raw[start...] {
+                crc = crcTable[Int((crc ^ UInt32(byte)) & 0xFF)] ^ (crc >> 8)
+            }
+        }
+        return crc ^ 0xFFFF_FFFF
+    }
+}
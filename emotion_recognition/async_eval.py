@@ -0,0 +1,209 @@
+"""
+异步验证：验证在独立进程中与训练并行，训练循环不等待验证
+
+交换目录（ASYNC_EVAL_CONFIG['work_dir']）中的协议：
+    checkpoints/epoch_003/      训练进程每个 epoch 写出的检查点（先写 .tmp 目录再改名，出现即完整）
+    results/epoch_003.json      验证进程写回的 {"epoch", "loss", "accuracy", "f1"}（同样原子写入）
+    STOP                        训练结束，验证进程评估完剩余检查点后退出
+
+训练进程每个 epoch 结束时读取已有的结果：F1 更高的检查点被提升为最佳模型（model_save_path），
+按已评估的 epoch 计算早停；训练结束后才等待剩余的验证结果。
+
+用法:
+    python train.py --async-eval           # 训练时自动启动验证进程
+    python async_eval.py --watch DIR       # 手动启动验证进程（通常不需要）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from config import ASYNC_EVAL_CONFIG, PATH_CONFIG, MODEL_CONFIG
+
+
+def epoch_name(epoch):
+    return f"epoch_{epoch:03d}"
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class AsyncValidation:
+    """训练进程一侧：写检查点、收集结果、维护最佳模型和早停"""
+
+    def __init__(self, work_dir=None, device=None):
+        self.work_dir = work_dir or ASYNC_EVAL_CONFIG['work_dir']
+        self.checkpoint_dir = os.path.join(self.work_dir, "checkpoints")
+        self.result_dir = os.path.join(self.work_dir, "results")
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.checkpoint_dir)
+        os.makedirs(self.result_dir)
+
+        self.submitted = []
+        self.results = {}
+        self.best_epoch = None
+        self.best_f1 = 0
+        self.best_accuracy = 0
+        self.last_evaluated = 0
+
+        self.process = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--watch", self.work_dir,
+            "--device", device or ASYNC_EVAL_CONFIG['device'],
+        ])
+        print(f"Async validation process started (pid {self.process.pid})")
+
+    def submit(self, model, epoch):
+        """保存本 epoch 的检查点，交给验证进程"""
+        path = os.path.join(self.checkpoint_dir, epoch_name(epoch))
+        model.save_pretrained(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self.submitted.append(epoch)
+
+    def poll(self):
+        """读取新出现的验证结果（按 epoch 顺序），返回本次新得到的结果"""
+        new_results = []
+        for epoch in self.submitted:
+            if epoch in self.results:
+                continue
+            path = os.path.join(self.result_dir, epoch_name(epoch) + ".json")
+            if not os.path.exists(path):
+                break  # 验证进程按顺序评估，后面的也还没有结果
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            self.results[epoch] = result
+            self.last_evaluated = epoch
+            new_results.append(result)
+            self._handle(result)
+        return new_results
+
+    def _handle(self, result):
+        epoch = result['epoch']
+        print(f"[async eval] Epoch {epoch}: Val Loss {result['loss']:.4f}, "
+              f"Val Accuracy {result['accuracy']:.4f}, Val F1 {result['f1']:.4f}")
+        checkpoint = os.path.join(self.checkpoint_dir, epoch_name(epoch))
+        if result['f1'] > self.best_f1:
+            from train import install_model_dir
+
+            self.best_f1 = result['f1']
+            self.best_accuracy = result['accuracy']
+            # 复制后再提升，检查点本身保留到出现更好的结果
+            tmp_path = PATH_CONFIG['model_save_path'].rstrip('/') + ".promote"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            shutil.copytree(checkpoint, tmp_path)
+            install_model_dir(tmp_path, PATH_CONFIG['model_save_path'])
+            print(f"✓ New best model (epoch {epoch}) saved! F1: {result['f1']:.4f}, Acc: {result['accuracy']:.4f}")
+            if self.best_epoch is not None:
+                shutil.rmtree(os.path.join(self.checkpoint_dir, epoch_name(self.best_epoch)), ignore_errors=True)
+            self.best_epoch = epoch
+        else:
+            shutil.rmtree(checkpoint, ignore_errors=True)
+
+    def epochs_without_improvement(self):
+        """已评估的 epoch 中，距离最佳 epoch 有多少个"""
+        if self.best_epoch is None:
+            return self.last_evaluated
+        return self.last_evaluated - self.best_epoch
+
+    def finish(self):
+        """
+        训练结束：通知验证进程，等待剩余检查点的结果
+        一个检查点都没有被提升为最佳模型时（例如验证进程在出结果前就退出了）抛出 RuntimeError，
+        否则 model_save_path 可能根本不存在
+        """
+        open(os.path.join(self.work_dir, "STOP"), 'w').close()
+        pending = [e for e in self.submitted if e not in self.results]
+        if pending:
+            print(f"Waiting for validation of {len(pending)} remaining checkpoint(s)...")
+        while len(self.results) < len(self.submitted):
+            self.poll()
+            if len(self.results) < len(self.submitted):
+                if self.process.poll() is not None:
+                    missing = [e for e in self.submitted if e not in self.results]
+                    print(f"⚠️ Validation process exited with code {self.process.returncode}, "
+                          f"epoch(s) {missing} not validated")
+                    break
+                time.sleep(ASYNC_EVAL_CONFIG['poll_interval'])
+        self.process.wait()
+
+        if self.best_epoch is None:
+            raise RuntimeError(
+                f"Async validation produced no best checkpoint ({len(self.results)}/{len(self.submitted)} "
+                f"epochs validated, validation process exit code {self.process.returncode}); "
+                f"{PATH_CONFIG['model_save_path']} was not written"
+            )
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+
+
+# ---------- 验证进程 ----------
+
+def load_val_loader(batch_size):
+    """与训练时相同的方式分词验证集"""
+    from torch.utils.data import DataLoader
+    from transformers import AutoTokenizer
+    from data_processing import EmojiDataset
+    from inference_utils import load_labeled_texts
+
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_CONFIG['model_name'])
+    encodings = tokenizer(texts, padding='max_length', truncation=True, max_length=MODEL_CONFIG['max_length'])
+    return DataLoader(EmojiDataset(encodings, labels), batch_size=batch_size, shuffle=False)
+
+
+def watch(work_dir, device_name):
+    import torch
+    from transformers import AutoModelForSequenceClassification
+    from train import evaluate
+
+    if device_name == "auto":
+        device_name = "cuda" if torch.cuda.is_available() else "cpu"
+    device = torch.device(device_name)
+    checkpoint_dir = os.path.join(work_dir, "checkpoints")
+    result_dir = os.path.join(work_dir, "results")
+    val_loader = load_val_loader(ASYNC_EVAL_CONFIG['batch_size'])
+    parent = os.getppid()
+    print(f"[async eval] Watching {checkpoint_dir} on {device}")
+
+    while True:
+        names = sorted(n for n in os.listdir(checkpoint_dir) if not n.endswith(".tmp"))
+        pending = [n for n in names if not os.path.exists(os.path.join(result_dir, n + ".json"))]
+        for name in pending:
+            model = AutoModelForSequenceClassification.from_pretrained(os.path.join(checkpoint_dir, name))
+            model.to(device)
+            loss, accuracy, f1, _, _, _ = evaluate(model, val_loader, device, f"Validating {name}")
+            write_json_atomic(os.path.join(result_dir, name + ".json"), {
+                "epoch": int(name.split("_")[1]),
+                "loss": loss,
+                "accuracy": accuracy,
+                "f1": f1,
+            })
+            del model
+
+        if not pending:
+            stopped = os.path.exists(os.path.join(work_dir, "STOP"))
+            if stopped or os.getppid() != parent:
+                # 训练结束（或训练进程已退出）且没有待评估的检查点
+                return
+            time.sleep(ASYNC_EVAL_CONFIG['poll_interval'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Out-of-process checkpoint validation")
+    parser.add_argument("--watch", required=True, help="exchange directory written by the trainer")
+    parser.add_argument("--device", default=ASYNC_EVAL_CONFIG['device'])
+    args = parser.parse_args()
+    watch(args.watch, args.device)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+探测本机能放下的最大训练 batch，并选出吞吐最高的 batch 大小
+- 用当前模型、序列长度（训练时补齐到 max_length）和精度跑完整的训练步
+  （前向 + 反向 + AdamW，第一步会分配优化器状态，这是峰值所在）
+- batch 从 1 开始倍增直到放不下，再在最后一个成功和第一个失败之间二分查找上限
+- GPU 上以 CUDA OOM 判定失败；CPU 上以 RSS 超过可用内存的 memory_fraction 判定（不等系统 OOM 杀进程）
+- 可选梯度检查点：用重算换内存
+- 结果（上限、各大小的 samples/sec、选定值）写入 BATCH_PROBE_CONFIG['result_path']，
+  训练时 --auto-batch-size 读取与本机、设置匹配的结果
+
+用法:
+    python batch_size_finder.py [--gradient-checkpointing] [--max 512]
+    python train.py --auto-batch-size [--gradient-checkpointing]
+"""
+
+import os
+import gc
+import json
+import time
+import platform
+import argparse
+from config import MODEL_CONFIG, TRAINING_CONFIG, BATCH_PROBE_CONFIG
+from memory_profile import MemoryProfiler, MemoryBudgetExceeded, current_rss, MB
+
+
+def available_memory():
+    """可用内存（字节），无法获取时返回 None"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    return None
+
+
+def is_oom(error):
+    return isinstance(error, MemoryBudgetExceeded) or "out of memory" in str(error).lower()
+
+
+def probe_settings(device, gradient_checkpointing):
+    """决定 batch 上限的设置；训练时只复用这些设置都相同的结果"""
+    import torch
+
+    return {
+        "machine": platform.node(),
+        "device": torch.cuda.get_device_name(0) if device.type == 'cuda' else f"cpu x{os.cpu_count()}",
+        "model_name": MODEL_CONFIG['model_name'],
+        "seq_len": MODEL_CONFIG['max_length'],
+        "precision": "fp32",
+        "gradient_checkpointing": gradient_checkpointing,
+        "torch": torch.__version__,
+    }
+
+
+class BatchProbe:
+
+    def __init__(self, device, gradient_checkpointing=False, steps=None):
+        import torch
+        from train import load_model
+
+        self.torch = torch
+        self.device = device
+        self.steps = steps or BATCH_PROBE_CONFIG['probe_steps']
+        self.model = load_model(gradient_checkpointing).to(device)
+        self.model.train()
+
+        self.cpu_budget_mb = None
+        if device.type == 'cpu':
+            available = available_memory()
+            if available is None:
+                print("⚠️ Cannot determine available memory, CPU probe is unprotected")
+            else:
+                self.cpu_budget_mb = (current_rss() + available * BATCH_PROBE_CONFIG['memory_fraction']) / MB
+
+    def _batch(self, batch_size):
+        torch = self.torch
+        seq_len = MODEL_CONFIG['max_length']
+        return (
+            torch.randint(1000, 8000, (batch_size, seq_len), device=self.device),
+            torch.ones((batch_size, seq_len), dtype=torch.long, device=self.device),
+            torch.randint(0, MODEL_CONFIG['num_labels'], (batch_size,), device=self.device),
+        )
+
+    def _steps(self, batch_size):
+        """一步预热 + steps 步计时，返回 samples/sec"""
+        torch = self.torch
+        input_ids, attention_mask, labels = self._batch(batch_size)
+        optimizer = torch.optim.AdamW(self.model.parameters(), lr=TRAINING_CONFIG['learning_rate'])
+        try:
+            for step in range(self.steps + 1):
+                if step == 1:
+                    if self.device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                optimizer.zero_grad()
+                logits = self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+                loss = torch.nn.functional.cross_entropy(logits, labels)
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
+                optimizer.step()
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize()
+            return batch_size * self.steps / (time.perf_counter() - start)
+        finally:
+            del optimizer, input_ids, attention_mask, labels
+            self.model.zero_grad(set_to_none=True)
+
+    def try_batch(self, batch_size):
+        """成功时返回 samples/sec，放不下时返回 None"""
+        torch = self.torch
+        profiler = MemoryProfiler(budget_mb=self.cpu_budget_mb, trace_python=False) if self.cpu_budget_mb else None
+        try:
+            if profiler:
+                with profiler.stage(f"batch_{batch_size}"):
+                    throughput = self._steps(batch_size)
+            else:
+                throughput = self._steps(batch_size)
+            print(f"  batch {batch_size:>5}: ✓ {throughput:8.1f} samples/s")
+            return throughput
+        except (RuntimeError, MemoryBudgetExceeded) as e:
+            if not is_oom(e):
+                raise
+            print(f"  batch {batch_size:>5}: ✗ out of memory")
+            return None
+        finally:
+            if profiler:
+                profiler.stop_event.set()
+            gc.collect()
+            if self.device.type == 'cuda':
+                torch.cuda.empty_cache()
+
+    def search(self, max_batch_size):
+        """倍增找到上界后二分；返回 (最大可用 batch, {batch: samples/sec})"""
+        measured = {}
+        good, bad = 0, None
+        batch_size = 1
+        while batch_size <= max_batch_size:
+            throughput = self.try_batch(batch_size)
+            if throughput is None:
+                bad = batch_size
+                break
+            measured[batch_size] = throughput
+            good = batch_size
+            batch_size *= 2
+        if bad is None:
+            return good, measured
+
+        while bad - good > 1:
+            mid = (good + bad) // 2
+            throughput = self.try_batch(mid)
+            if throughput is None:
+                bad = mid
+            else:
+                measured[mid] = throughput
+                good = mid
+        return good, measured
+
+
+def find_batch_size(device, gradient_checkpointing=False, max_batch_size=None):
+    """探测并保存结果，返回结果字典"""
+    settings = probe_settings(device, gradient_checkpointing)
+    print(f"Probing batch size on {settings['device']} "
+          f"(seq_len {settings['seq_len']}, gradient checkpointing {'on' if gradient_checkpointing else 'off'})")
+
+    probe = BatchProbe(device, gradient_checkpointing)
+    max_fit, measured = probe.search(max_batch_size or BATCH_PROBE_CONFIG['max_batch_size'])
+    del probe
+    gc.collect()
+    if device.type == 'cuda':
+        import torch
+        torch.cuda.empty_cache()
+
+    if not measured:
+        raise RuntimeError("Even batch size 1 does not fit in memory")
+
+    # 吞吐差距在 2% 以内时选较小的 batch（对优化更友好，也留出内存余量）
+    best = max(measured.values())
+    chosen = min(b for b, t in measured.items() if t >= best * 0.98)
+    result = {
+        "settings": settings,
+        "max_batch_size": max_fit,
+        "chosen_batch_size": chosen,
+        "samples_per_sec": {str(b): round(t, 2) for b, t in sorted(measured.items())},
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+    os.makedirs(os.path.dirname(BATCH_PROBE_CONFIG['result_path']), exist_ok=True)
+    with open(BATCH_PROBE_CONFIG['result_path'], 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"✓ Max batch size: {max_fit}, chosen: {chosen} ({measured[chosen]:.1f} samples/s)")
+    print(f"  Saved to {BATCH_PROBE_CONFIG['result_path']}")
+    return result
+
+
+def resolve_batch_size(device):
+    """训练用的 batch 大小：复用设置匹配的探测结果，否则重新探测"""
+    gradient_checkpointing = TRAINING_CONFIG.get('gradient_checkpointing', False)
+    path = BATCH_PROBE_CONFIG['result_path']
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        if result.get('settings') == probe_settings(device, gradient_checkpointing):
+            print(f"Using probed batch size {result['chosen_batch_size']} from {path}")
+            return result['chosen_batch_size']
+        print("Probed batch size is for different settings, probing again")
+    return find_batch_size(device, gradient_checkpointing)['chosen_batch_size']
+
+
+def main():
+    from train import setup_device
+
+    parser = argparse.ArgumentParser(description="Find the throughput-optimal training batch size")
+    parser.add_argument("--gradient-checkpointing", action="store_true",
+                        default=TRAINING_CONFIG.get('gradient_checkpointing', False))
+    parser.add_argument("--max", type=int, default=BATCH_PROBE_CONFIG['max_batch_size'])
+    args = parser.parse_args()
+
+    print("="*60)
+    print("Batch size probe")
+    print("="*60)
+    find_batch_size(setup_device(), args.gradient_checkpointing, args.max)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+端到端性能基准与回归对比
+
+覆盖的热点路径：
+- 分词吞吐（HuggingFace tokenizer 与向量化字符级分词器）
+- EmojiDataset + PrefetchLoader 的 batch 组装
+- train_epoch() 的单步训练耗时
+- 各推理后端（PyTorch / ONNX fp32 / 优化后 ONNX / INT8 ONNX）的单条与批量延迟 p50/p95/p99
+- 导出流水线在冷缓存 / 热缓存下的耗时（可选，--include-export；产物写到临时目录）
+
+用法:
+    python benchmark.py run [--output out.json] [--save-baseline] [--include-export]
+    python benchmark.py compare [current.json] [--baseline benchmarks/baseline.json]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from contextlib import contextmanager
+import numpy as np
+from config import MODEL_CONFIG, TRAINING_CONFIG, PATH_CONFIG, BENCHMARK_CONFIG
+from inference_utils import (
+    create_onnx_session,
+    encode_texts,
+    load_labeled_texts,
+    measure_latency,
+    summarize_latencies,
+)
+from export_cache import package_versions
+
+
+def metric(value, unit, higher_is_better=False):
+    return {"value": float(value), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def environment_info():
+    """记录运行环境，便于判断两次结果是否可比"""
+    import torch
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "packages": package_versions(["torch", "transformers", "onnxruntime", "numpy"]),
+        "max_length": MODEL_CONFIG['max_length'],
+    }
+
+
+def bench_tokenization(tokenizer, texts):
+    """分词吞吐：整批补齐到 max_length（与训练数据处理一致）"""
+    start = time.perf_counter()
+    tokenizer(texts, padding='max_length', truncation=True, max_length=MODEL_CONFIG['max_length'])
+    seconds = time.perf_counter() - start
+
+    single = measure_latency(lambda: encode_texts(tokenizer, texts[0]), repeats=200)
+    results = {
+        "tokenize_batch_throughput": metric(len(texts) / seconds, "texts/s", higher_is_better=True),
+        "tokenize_single_p50": metric(np.percentile(single, 50), "ms"),
+    }
+
+    # 与 iOS 端一致的向量化字符级分词
+    if os.path.exists(PATH_CONFIG['vocab_path']):
+        from char_tokenizer import CharTokenizer
+
+        char_tokenizer = CharTokenizer()
+        start = time.perf_counter()
+        char_tokenizer.encode(texts)
+        seconds = time.perf_counter() - start
+        single = measure_latency(lambda: char_tokenizer.encode(texts[0]), repeats=200)
+        results["char_tokenize_batch_throughput"] = metric(len(texts) / seconds, "texts/s", higher_is_better=True)
+        results["char_tokenize_single_p50"] = metric(np.percentile(single, 50), "ms")
+
+    return results
+
+
+def bench_collation(tokenizer, texts, labels):
+    """数据加载器遍历一个 epoch 的 batch 组装速度（不含模型计算）"""
+    from data_processing import EmojiDataset, create_dataloaders
+
+    encodings = tokenizer(texts, padding='max_length', truncation=True, max_length=MODEL_CONFIG['max_length'])
+    dataset = EmojiDataset(encodings, labels)
+    train_loader, _ = create_dataloaders(dataset, dataset)
+
+    start = time.perf_counter()
+    num_samples = sum(len(batch['labels']) for batch in train_loader)
+    seconds = time.perf_counter() - start
+    return {"collate_throughput": metric(num_samples / seconds, "samples/s", higher_is_better=True)}
+
+
+def bench_train_step(tokenizer, texts, labels, device):
+    """train_epoch() 前 N 个 batch 的平均单步耗时"""
+    import torch
+    from torch.optim import AdamW
+    from transformers import AutoModelForSequenceClassification, get_linear_schedule_with_warmup
+    from data_processing import EmojiDataset, create_dataloaders
+    from train import train_epoch
+
+    num_steps = BENCHMARK_CONFIG['train_steps']
+    num_samples = min(len(texts), num_steps * TRAINING_CONFIG['batch_size'])
+    encodings = tokenizer(texts[:num_samples], padding='max_length', truncation=True,
+                          max_length=MODEL_CONFIG['max_length'])
+    dataset = EmojiDataset(encodings, labels[:num_samples])
+    train_loader, _ = create_dataloaders(dataset, dataset, device)
+
+    model = AutoModelForSequenceClassification.from_pretrained(
+        MODEL_CONFIG['model_name'], num_labels=MODEL_CONFIG['num_labels']
+    ).to(device)
+    optimizer = AdamW(model.parameters(), lr=TRAINING_CONFIG['learning_rate'])
+    scheduler = get_linear_schedule_with_warmup(optimizer, 0, len(train_loader))
+
+    # 第一个 batch 作为预热（分配 AdamW 状态等），不计入耗时
+    warmup_loader = [next(iter(train_loader))]
+    train_epoch(model, warmup_loader, optimizer, scheduler, device)
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    train_epoch(model, train_loader, optimizer, scheduler, device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start
+
+    return {
+        "train_step_time": metric(seconds / len(train_loader) * 1000, "ms"),
+        "train_throughput": metric(num_samples / seconds, "samples/s", higher_is_better=True),
+    }
+
+
+def latency_metrics(prefix, single_fn, batch_fn, batch_size):
+    """单条与批量推理延迟的 p50/p95/p99 和批量吞吐"""
+    repeats = BENCHMARK_CONFIG['latency_repeats']
+    results = {}
+    single = summarize_latencies(measure_latency(single_fn, repeats=repeats))
+    batched = summarize_latencies(measure_latency(batch_fn, repeats=max(10, repeats // 10)))
+    for p in ("p50", "p95", "p99"):
+        results[f"{prefix}_single_{p}"] = metric(single[p], "ms")
+        results[f"{prefix}_batch_{p}"] = metric(batched[p], "ms")
+    results[f"{prefix}_batch_throughput"] = metric(
+        batch_size / batched["p50"] * 1000, "texts/s", higher_is_better=True
+    )
+    return results
+
+
+def bench_inference(tokenizer, texts, device):
+    """各后端推理延迟；单条输入取实时场景的 20 字窗口"""
+    import torch
+    from transformers import AutoModelForSequenceClassification
+
+    batch_size = BENCHMARK_CONFIG['inference_batch_size']
+    single_text = texts[0][:20]
+    batch_texts = texts[:batch_size]
+    results = {}
+
+    model = AutoModelForSequenceClassification.from_pretrained(PATH_CONFIG['model_save_path']).to(device)
+    model.eval()
+
+    def torch_run(batch):
+        inputs = encode_texts(tokenizer, batch, return_tensors='pt')
+        with torch.no_grad():
+            model(input_ids=inputs['input_ids'].to(device), attention_mask=inputs['attention_mask'].to(device))
+
+    results.update(latency_metrics(
+        "pytorch", lambda: torch_run(single_text), lambda: torch_run(batch_texts), batch_size
+    ))
+
+    if device.type == 'cpu':
+        from compiled_model import CompiledEmotionModel
+        compiled = CompiledEmotionModel()
+        if compiled.active_mode != "eager":
+            results.update(latency_metrics(
+                "pytorch_compiled",
+                lambda: compiled.predict_proba(single_text),
+                lambda: compiled.predict_proba(batch_texts),
+                batch_size
+            ))
+
+    onnx_backends = {
+        "onnx_fp32": PATH_CONFIG['onnx_path'],
+        "onnx_optimized": PATH_CONFIG['onnx_optimized_path'],
+        "onnx_int8": PATH_CONFIG['onnx_int8_path'],
+    }
+    for name, onnx_path in onnx_backends.items():
+        if not os.path.exists(onnx_path):
+            print(f"  [{name}] skipped: {onnx_path} not found")
+            continue
+        session = create_onnx_session(onnx_path)
+
+        def onnx_run(batch, session=session):
+            inputs = encode_texts(tokenizer, batch, return_tensors='np')
+            session.run(None, {
+                'input_ids': inputs['input_ids'].astype(np.int64),
+                'attention_mask': inputs['attention_mask'].astype(np.int64)
+            })
+
+        results.update(latency_metrics(
+            name, lambda: onnx_run(single_text), lambda: onnx_run(batch_texts), batch_size
+        ))
+
+    return results
+
+
+# 导出流水线写出的路径；基准时改到临时目录，不覆盖 output/ 下正在使用的产物
+EXPORT_OUTPUT_KEYS = (
+    "output_dir", "vocab_path", "tokenizer_bundle_path",
+    "onnx_path", "onnx_optimized_path", "onnx_optimize_report", "onnx_int8_path", "onnx_quantize_report",
+    "coreml_fp16_path", "coreml_int8_path", "export_manifest",
+)
+
+
+@contextmanager
+def redirect_export_outputs(tmp_dir):
+    """临时把导出产物的路径指向 tmp_dir（模型目录和数据集仍使用原路径）"""
+    saved = {key: PATH_CONFIG[key] for key in EXPORT_OUTPUT_KEYS}
+    PATH_CONFIG['output_dir'] = tmp_dir
+    for key in EXPORT_OUTPUT_KEYS[1:]:
+        PATH_CONFIG[key] = os.path.join(tmp_dir, os.path.basename(saved[key]))
+    try:
+        yield
+    finally:
+        PATH_CONFIG.update(saved)
+
+
+def bench_export():
+    """
+    完整导出流水线（export_coreml.run_pipeline）的耗时，产物写到临时目录：
+    - cold: 空的缓存，所有阶段都要运行
+    - warm: 同一个 manifest 再运行一次（新的 ExportCache，相当于重新启动进程），各阶段应当命中缓存
+    """
+    import tempfile
+    from export_coreml import run_pipeline
+    from export_cache import ExportCache
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="export_bench_") as tmp_dir, redirect_export_outputs(tmp_dir):
+        for name in ("cold", "warm"):
+            cache = ExportCache()
+            start = time.perf_counter()
+            run_pipeline(cache)
+            results[f"export_pipeline_{name}_time"] = metric(time.perf_counter() - start, "s")
+    return results
+
+
+def run_benchmarks(include_export=False, skip_train=False):
+    """运行全部基准，返回 {环境, 指标}"""
+    import torch
+    from transformers import AutoTokenizer
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    texts, labels = load_labeled_texts(PATH_CONFIG['train_file'])
+
+    stages = [
+        ("tokenization", lambda: bench_tokenization(tokenizer, texts)),
+        ("collation", lambda: bench_collation(tokenizer, texts, labels)),
+        ("inference", lambda: bench_inference(tokenizer, texts, device)),
+    ]
+    if not skip_train:
+        stages.append(("train_step", lambda: bench_train_step(tokenizer, texts, labels, device)))
+    if include_export:
+        stages.append(("export", bench_export))
+
+    metrics = {}
+    for name, fn in stages:
+        print(f"\n▶ {name}")
+        stage_metrics = fn()
+        for key, value in stage_metrics.items():
+            print(f"  {key}: {value['value']:.3f} {value['unit']}")
+        metrics.update(stage_metrics)
+
+    return {"environment": environment_info(), "metrics": metrics}
+
+
+def compare_results(baseline, current, threshold):
+    """对比两次结果，返回回归项列表"""
+    regressions = []
+    print(f"\n{'metric':<36}{'baseline':>14}{'current':>14}{'change':>10}")
+    print("-" * 74)
+    for name, base in baseline['metrics'].items():
+        cur = current['metrics'].get(name)
+        if cur is None or base['value'] == 0:
+            continue
+        change = (cur['value'] - base['value']) / base['value']
+        # 统一成“正数表示变差”
+        worse = -change if base['higher_is_better'] else change
+        flag = ""
+        if worse > threshold:
+            flag = "  ✗ REGRESSION"
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = "  ✓ improved"
+        print(f"{name:<36}{base['value']:>14.3f}{cur['value']:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def latest_result():
+    """benchmark_dir 中最新的一次结果"""
+    bench_dir = PATH_CONFIG['benchmark_dir']
+    files = sorted(f for f in os.listdir(bench_dir) if f.endswith('.json')) if os.path.isdir(bench_dir) else []
+    return os.path.join(bench_dir, files[-1]) if files else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emoji model benchmark suite")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run benchmarks and write JSON results")
+    run_parser.add_argument("--output", help="result path (default: output/benchmarks/<timestamp>.json)")
+    run_parser.add_argument("--save-baseline", action="store_true", help="also store the result as baseline")
+    run_parser.add_argument("--include-export", action="store_true",
+                            help="also time the export pipeline (cold and warm cache, in a temp dir)")
+    run_parser.add_argument("--skip-train", action="store_true", help="skip the training step benchmark")
+
+    cmp_parser = sub.add_parser("compare", help="compare a result against the baseline")
+    cmp_parser.add_argument("current", nargs="?", help="result path (default: latest in output/benchmarks)")
+    cmp_parser.add_argument("--baseline", default=PATH_CONFIG['benchmark_baseline'])
+    cmp_parser.add_argument("--threshold", type=float, default=BENCHMARK_CONFIG['regression_threshold'])
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print("="*60)
+        print("Running benchmarks")
+        print("="*60)
+        result = run_benchmarks(args.include_export, args.skip_train)
+
+        output = args.output or os.path.join(
+            PATH_CONFIG['benchmark_dir'], f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        paths = [output] + ([PATH_CONFIG['benchmark_baseline']] if args.save_baseline else [])
+        for path in paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"✓ Results saved: {path}")
+        return
+
+    current_path = args.current or latest_result()
+    if current_path is None or not os.path.exists(args.baseline):
+        print("Error: need both a benchmark result and a baseline.")
+        print("Run: python benchmark.py run --save-baseline")
+        sys.exit(2)
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+
+    print(f"Baseline: {args.baseline} ({baseline['environment'].get('git_commit')})")
+    print(f"Current:  {current_path} ({current['environment'].get('git_commit')})")
+    if baseline['environment'].get('processor') != current['environment'].get('processor'):
+        print("⚠️  Results come from different machines; comparisons may be noisy")
+
+    regressions = compare_results(baseline, current, args.threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\n✓ No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+离线批量打标：为大量历史消息预测 top-k emoji
+- 流式读取 JSON / JSONL（JSON 数组在安装了 ijson 时流式解析，否则整体加载）
+- 按 chunk_size 分块，分块内按长度排序后组 batch，减少 padding
+- 分块分发到进程池：每个进程加载一份模型、固定推理线程数并绑定到各自的 CPU 核
+- 按输入顺序写出 JSONL（单个文件）或 Parquet（每个分块一个 part 文件）；
+  Parquet 需要 pandas 的写入引擎 pyarrow 或 fastparquet（不在 requirements.txt 中：pip install pyarrow）
+- 每完成一个分块记录进度，崩溃后重新运行同一命令即从最后完成的分块继续
+
+输入的每条记录可以是字符串，或包含 "text" 字段的对象（其余字段中的 "id" 会原样写出）
+
+用法:
+    python bulk_score.py messages.jsonl scores.jsonl
+    python bulk_score.py archive.json scores_parquet --format parquet --backend onnx_int8 --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+import numpy as np
+from config import BULK_CONFIG, ID_TO_EMOJI
+from inference_utils import BACKENDS, load_backend
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _record(item):
+    if isinstance(item, str):
+        return item, None
+    return item.get('text', ''), item.get('id')
+
+
+def iter_records(path):
+    """逐条产生 (文本, id)"""
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield _record(json.loads(line))
+    elif ijson is not None:
+        with open(path, 'rb') as f:
+            for item in ijson.items(f, 'item', use_float=True):
+                yield _record(item)
+    else:
+        print("⚠️ ijson not installed, loading the whole JSON array into memory")
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        for item in items:
+            yield _record(item)
+
+
+def iter_chunks(path, chunk_size, skip_chunks=0):
+    """按分块产生 (分块序号, 文本列表, id 列表)，跳过已完成的分块"""
+    records = iter_records(path)
+    if skip_chunks:
+        # 跳过的记录不需要解析成分块，直接丢弃
+        for _ in islice(records, skip_chunks * chunk_size):
+            pass
+    index = skip_chunks
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        texts, ids = zip(*chunk)
+        yield index, list(texts), list(ids)
+        index += 1
+
+
+# ---------- 工作进程 ----------
+
+_worker_model = None
+
+
+def _init_worker(backend, threads, counter, cores):
+    """每个工作进程加载一份模型，并绑定到各自的一组 CPU 核"""
+    global _worker_model
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    if cores and hasattr(os, 'sched_setaffinity'):
+        start = (slot * threads) % len(cores)
+        os.sched_setaffinity(0, cores[start:start + threads] or cores)
+    _worker_model = load_backend(backend, num_threads=threads, warmup=False)
+
+
+def _score_chunk(index, texts, batch_size, top_k):
+    """分块内按长度排序组 batch，返回与输入同序的 top-k 索引和概率"""
+    order = np.argsort([len(t) for t in texts], kind='stable')
+    top_ids = np.zeros((len(texts), top_k), dtype=np.int16)
+    top_probs = np.zeros((len(texts), top_k), dtype=np.float32)
+    for s in range(0, len(order), batch_size):
+        idx = order[s:s + batch_size]
+        probs = _worker_model.predict_proba([texts[i] for i in idx])
+        best = np.argsort(-probs, axis=1)[:, :top_k]
+        top_ids[idx] = best
+        top_probs[idx] = np.take_along_axis(probs, best, axis=1)
+    return index, top_ids, top_probs
+
+
+# ---------- 输出 ----------
+
+def build_rows(start_row, ids, top_ids, top_probs):
+    rows = []
+    for i, (item_id, best, probs) in enumerate(zip(ids, top_ids, top_probs)):
+        row = {"index": start_row + i}
+        if item_id is not None:
+            row["id"] = item_id
+        row["emojis"] = [ID_TO_EMOJI[int(k)] for k in best]
+        row["probs"] = [round(float(p), 6) for p in probs]
+        rows.append(row)
+    return rows
+
+
+class JsonlOutput:
+    """单个 JSONL 文件；进度中记录已完成部分的字节数，续跑时截断未完成的尾部"""
+
+    def __init__(self, path, resume_bytes):
+        self.path = path
+        mode = 'r+b' if resume_bytes and os.path.exists(path) else 'wb'
+        self.f = open(path, mode)
+        self.f.truncate(resume_bytes if mode == 'r+b' else 0)
+        self.f.seek(0, os.SEEK_END)
+
+    def write_chunk(self, index, rows):
+        for row in rows:
+            self.f.write((json.dumps(row, ensure_ascii=False) + "\n").encode('utf-8'))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetOutput:
+    """目录中每个分块一个 part 文件（按文件名排序即为输入顺序）"""
+
+    def __init__(self, path, resume_bytes):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write_chunk(self, index, rows):
+        import pandas as pd
+
+        part = os.path.join(self.path, f"part-{index:06d}.parquet")
+        pd.DataFrame(rows).to_parquet(part + ".tmp", index=False)
+        os.replace(part + ".tmp", part)
+        return 0
+
+    def close(self):
+        pass
+
+
+def load_progress(progress_path, input_path, chunk_size, top_k):
+    """读取进度文件；参数不一致时从头开始"""
+    if not os.path.exists(progress_path):
+        return 0, 0
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        progress = json.load(f)
+    if (progress.get('input') != os.path.abspath(input_path)
+            or progress.get('chunk_size') != chunk_size or progress.get('top_k') != top_k):
+        print("⚠️ Progress file does not match the current arguments, starting over")
+        return 0, 0
+    return progress['completed_chunks'], progress['output_bytes']
+
+
+def save_progress(progress_path, input_path, chunk_size, top_k, completed, output_bytes, rows):
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "input": os.path.abspath(input_path),
+            "chunk_size": chunk_size,
+            "top_k": top_k,
+            "completed_chunks": completed,
+            "output_bytes": output_bytes,
+            "rows": rows,
+        }, f)
+    os.replace(tmp_path, progress_path)
+
+
+def bulk_score(input_path, output_path, output_format, backend, workers, threads,
+               chunk_size, batch_size, top_k):
+    progress_path = output_path.rstrip('/') + ".progress.json"
+    completed, output_bytes = load_progress(progress_path, input_path, chunk_size, top_k)
+    if completed:
+        print(f"Resuming after chunk {completed - 1} ({completed * chunk_size} records done)")
+
+    writer = (JsonlOutput if output_format == 'jsonl' else ParquetOutput)(output_path, output_bytes)
+
+    # 子进程启动时继承这些变量，在导入 numpy / torch 之前就限定 BLAS / OpenMP 线程数
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    ctx = mp.get_context('spawn')
+    counter = ctx.Value('i', 0)
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+    start = time.perf_counter()
+    rows_done = completed * chunk_size
+    rows_this_run = 0
+    pending = {}  # 已提交未完成的 future → 分块序号
+    finished = {}  # 已完成但还没轮到写出的分块
+    chunk_ids = {}
+    next_to_write = completed
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(backend, threads, counter, cores)) as pool:
+        chunks = iter_chunks(input_path, chunk_size, skip_chunks=completed)
+        exhausted = False
+        while True:
+            # 最多 2 * workers 个分块在途，保持读取是流式的
+            while not exhausted and len(pending) + len(finished) < 2 * workers:
+                item = next(chunks, None)
+                if item is None:
+                    exhausted = True
+                    break
+                index, texts, ids = item
+                chunk_ids[index] = ids
+                pending[pool.submit(_score_chunk, index, texts, batch_size, top_k)] = index
+
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                index, top_ids, top_probs = future.result()
+                finished[index] = (top_ids, top_probs)
+
+            # 按输入顺序写出
+            while next_to_write in finished:
+                top_ids, top_probs = finished.pop(next_to_write)
+                ids = chunk_ids.pop(next_to_write)
+                output_bytes = writer.write_chunk(next_to_write, build_rows(rows_done, ids, top_ids, top_probs))
+                rows_done += len(ids)
+                rows_this_run += len(ids)
+                next_to_write += 1
+                save_progress(progress_path, input_path, chunk_size, top_k, next_to_write, output_bytes, rows_done)
+
+                elapsed = time.perf_counter() - start
+                print(f"\r  chunks {next_to_write} | rows {rows_done} | {rows_this_run / elapsed:.0f} rows/s",
+                      end="", flush=True)
+
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"\n✓ Scored {rows_this_run} records in {elapsed:.1f}s "
+          f"({rows_this_run / max(elapsed, 1e-9):.0f} rows/s, {workers} workers x {threads} threads)")
+    print(f"✓ Output: {output_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk emoji scoring for JSON/JSONL message archives")
+    parser.add_argument("input", help=".json (array) or .jsonl input")
+    parser.add_argument("output", help="output .jsonl file, or directory for --format parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--backend", choices=BACKENDS, default=BULK_CONFIG['backend'])
+    parser.add_argument("--workers", type=int, default=BULK_CONFIG['workers'])
+    parser.add_argument("--threads-per-worker", type=int, default=BULK_CONFIG['threads_per_worker'])
+    parser.add_argument("--chunk-size", type=int, default=BULK_CONFIG['chunk_size'])
+    parser.add_argument("--batch-size", type=int, default=BULK_CONFIG['batch_size'])
+    parser.add_argument("--top-k", type=int, default=BULK_CONFIG['top_k'])
+    args = parser.parse_args()
+
+    # 写入引擎在第一个分块写出时才会用到，提前检查，避免跑完一个分块才报错
+    if args.format == "parquet" and not any(importlib.util.find_spec(m) for m in ("pyarrow", "fastparquet")):
+        parser.error("--format parquet requires pyarrow or fastparquet (pip install pyarrow)")
+
+    if not os.path.exists(args.input):
+        print(f"✗ Input not found: {args.input}")
+        sys.exit(1)
+
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = args.workers or max(1, cpus // args.threads_per_worker)
+
+    print("="*60)
+    print(f"Bulk scoring {args.input} → {args.output}")
+    print(f"Backend: {args.backend}, {workers} workers x {args.threads_per_worker} threads, "
+          f"chunk {args.chunk_size}, batch {args.batch_size}, top-{args.top_k}")
+    print("="*60)
+
+    bulk_score(args.input, args.output, args.format, args.backend, workers, args.threads_per_worker,
+               args.chunk_size, args.batch_size, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
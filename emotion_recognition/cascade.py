@@ -0,0 +1,250 @@
+"""
+两级级联预测器
+- 第一级：哈希字符 n-gram + 线性模型（逻辑回归），在 train.json 上训练；
+  推理时只有稀疏特征矩阵与权重矩阵的一次乘法，开销远小于 BERT
+- 第一级置信度（最大概率）低于阈值的输入才交给 BERT
+- 阈值在训练集留出的一部分上标定：第一级直接返回的样本与 BERT 预测的一致率不低于 target_agreement
+
+用法:
+    python cascade.py                     # 训练第一级、标定阈值，并在 val.json 上报告
+    python cascade.py --report            # 加载已保存的第一级，只在 val.json 上报告
+    python cascade.py --backend onnx      # 第二级使用的推理后端（见 inference_utils.BACKENDS）
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from config import PATH_CONFIG, MODEL_CONFIG, CASCADE_CONFIG
+from inference_utils import BACKENDS, load_backend, load_labeled_texts, softmax
+
+
+def make_vectorizer(n_features=None, ngram_range=None):
+    """无状态的哈希字符 n-gram 特征（不需要保存词表）"""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(
+        analyzer='char',
+        ngram_range=tuple(ngram_range or CASCADE_CONFIG['ngram_range']),
+        n_features=n_features or CASCADE_CONFIG['n_features'],
+        alternate_sign=False,
+        norm='l2',
+        dtype=np.float32,
+    )
+
+
+class NgramClassifier:
+    """第一级分类器：稀疏特征 @ 稀疏权重，接口与其他后端一致的 predict_proba(texts)"""
+
+    def __init__(self, weights, bias, n_features=None, ngram_range=None):
+        # weights: [n_features, num_labels] 稀疏矩阵（未出现过的特征权重为 0，只存非零项）
+        self.weights = weights.tocsr()
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.n_features = n_features or weights.shape[0]
+        self.ngram_range = tuple(ngram_range or CASCADE_CONFIG['ngram_range'])
+        self.vectorizer = make_vectorizer(self.n_features, self.ngram_range)
+
+    @classmethod
+    def fit(cls, texts, labels, C=None):
+        from scipy import sparse
+        from sklearn.linear_model import LogisticRegression
+
+        vectorizer = make_vectorizer()
+        clf = LogisticRegression(C=C or CASCADE_CONFIG['C'], max_iter=1000)
+        clf.fit(vectorizer.transform(texts), labels)
+
+        # 训练集中可能缺少某些 emoji，补齐到完整的标签维度（缺失类别偏置取极小值）
+        num_labels = MODEL_CONFIG['num_labels']
+        coef = np.zeros((num_labels, vectorizer.n_features), dtype=np.float32)
+        bias = np.full(num_labels, -1e4, dtype=np.float32)
+        if len(clf.classes_) == 2:
+            # 二分类时 sklearn 只给出一行系数
+            coef[clf.classes_[1]] = clf.coef_[0]
+            bias[clf.classes_[1]] = clf.intercept_[0]
+            bias[clf.classes_[0]] = 0.0
+        else:
+            coef[clf.classes_] = clf.coef_
+            bias[clf.classes_] = clf.intercept_
+        coef[np.abs(coef) < 1e-6] = 0.0
+        return cls(sparse.csr_matrix(coef.T), bias, vectorizer.n_features, vectorizer.ngram_range)
+
+    def logits(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        features = self.vectorizer.transform(texts)
+        return (features @ self.weights).toarray() + self.bias
+
+    def predict_proba(self, texts):
+        return softmax(self.logits(texts))
+
+    def save(self, path, threshold=None):
+        """保存稀疏权重（及标定好的阈值）"""
+        weights = self.weights.tocsr()
+        extra = {} if threshold is None else {'threshold': np.float32(threshold)}
+        np.savez_compressed(
+            path,
+            data=weights.data, indices=weights.indices, indptr=weights.indptr,
+            shape=np.array(weights.shape), bias=self.bias,
+            ngram_range=np.array(self.ngram_range), **extra
+        )
+
+    @classmethod
+    def load(cls, path):
+        from scipy import sparse
+
+        f = np.load(path)
+        weights = sparse.csr_matrix((f['data'], f['indices'], f['indptr']), shape=tuple(f['shape']))
+        threshold = float(f['threshold']) if 'threshold' in f else None
+        model = cls(weights, f['bias'], int(f['shape'][0]), tuple(f['ngram_range']))
+        return model, threshold
+
+
+class CascadeModel:
+    """第一级置信度足够时直接返回，否则交给 BERT 后端；记录升级比例"""
+
+    def __init__(self, first_stage, bert_model, threshold):
+        self.first_stage = first_stage
+        self.bert_model = bert_model
+        self.threshold = threshold
+        self.total = 0
+        self.escalated = 0
+
+    def predict_proba(self, texts):
+        if isinstance(texts, str):
+            texts = [texts]
+        probs = self.first_stage.predict_proba(texts)
+        escalate = np.flatnonzero(probs.max(axis=1) < self.threshold)
+        if len(escalate):
+            probs[escalate] = self.bert_model.predict_proba([texts[i] for i in escalate])
+        self.total += len(texts)
+        self.escalated += len(escalate)
+        return probs
+
+    @property
+    def escalation_rate(self):
+        return self.escalated / self.total if self.total else 0.0
+
+
+def predict_batched(model, texts, batch_size):
+    """按长度排序后分批预测（减少 padding），返回与输入同序的概率"""
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    probs = np.zeros((len(texts), MODEL_CONFIG['num_labels']), dtype=np.float32)
+    for s in range(0, len(order), batch_size):
+        idx = order[s:s + batch_size]
+        probs[idx] = model.predict_proba([texts[i] for i in idx])
+    return probs
+
+
+def calibrate_threshold(confidence, agree, target):
+    """
+    最小的阈值，使置信度 >= 阈值的样本上第一级与 BERT 的一致率不低于 target
+    confidence: 第一级最大概率；agree: 第一级与 BERT 预测是否一致
+    """
+    order = np.argsort(-confidence)
+    rate = np.cumsum(agree[order]) / np.arange(1, len(order) + 1)
+    ok = np.flatnonzero(rate >= target)
+    if not len(ok):
+        return 1.0 + 1e-6  # 第一级从不直接返回
+    return float(confidence[order][ok[-1]])
+
+
+def train_first_stage(bert_model, batch_size):
+    """在 train.json 上训练第一级，并在留出部分上标定阈值"""
+    texts, labels = load_labeled_texts(PATH_CONFIG['train_file'])
+    labels = np.array(labels)
+
+    rng = np.random.default_rng(CASCADE_CONFIG['seed'])
+    perm = rng.permutation(len(texts))
+    n_calib = int(len(texts) * CASCADE_CONFIG['calibration_fraction'])
+    calib_idx, fit_idx = perm[:n_calib], perm[n_calib:]
+
+    start = time.perf_counter()
+    first_stage = NgramClassifier.fit([texts[i] for i in fit_idx], labels[fit_idx])
+    print(f"First stage trained on {len(fit_idx)} samples in {time.perf_counter() - start:.1f}s "
+          f"({first_stage.weights.nnz} non-zero weights)")
+
+    calib_texts = [texts[i] for i in calib_idx]
+    stage1 = first_stage.predict_proba(calib_texts)
+    bert_preds = predict_batched(bert_model, calib_texts, batch_size).argmax(axis=1)
+    threshold = calibrate_threshold(
+        stage1.max(axis=1), stage1.argmax(axis=1) == bert_preds, CASCADE_CONFIG['target_agreement']
+    )
+    print(f"Calibrated threshold on {len(calib_idx)} held-out samples: {threshold:.4f} "
+          f"(target agreement with BERT {CASCADE_CONFIG['target_agreement']})")
+    return first_stage, threshold
+
+
+def report(first_stage, bert_model, threshold, batch_size):
+    """在 val.json 上比较 BERT-only 与级联"""
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+
+    start = time.perf_counter()
+    bert_probs = predict_batched(bert_model, texts, batch_size)
+    bert_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stage1_probs = predict_batched(first_stage, texts, batch_size)
+    stage1_seconds = time.perf_counter() - start
+
+    cascade = CascadeModel(first_stage, bert_model, threshold)
+    start = time.perf_counter()
+    cascade_probs = predict_batched(cascade, texts, batch_size)
+    cascade_seconds = time.perf_counter() - start
+
+    bert_preds = bert_probs.argmax(axis=1)
+    cascade_preds = cascade_probs.argmax(axis=1)
+
+    print("\n" + "="*60)
+    print(f"Validation samples: {len(texts)}, threshold: {threshold:.4f}")
+    print("="*60)
+    print(f"Escalation rate:          {cascade.escalation_rate:.2%}")
+    print(f"Accuracy BERT-only:       {(bert_preds == labels).mean():.4f}")
+    print(f"Accuracy cascade:         {(cascade_preds == labels).mean():.4f}")
+    print(f"Accuracy first stage:     {(stage1_probs.argmax(axis=1) == labels).mean():.4f}")
+    print(f"Agreement with BERT:      {(cascade_preds == bert_preds).mean():.4f}")
+    print(f"Time BERT-only:           {bert_seconds:.2f}s ({len(texts) / bert_seconds:.1f}/s)")
+    print(f"Time first stage only:    {stage1_seconds:.3f}s ({len(texts) / stage1_seconds:.1f}/s)")
+    print(f"Time cascade:             {cascade_seconds:.2f}s ({len(texts) / cascade_seconds:.1f}/s, "
+          f"{cascade_seconds / bert_seconds:.1%} of BERT-only)")
+
+
+def load_cascade(backend="torch", path=None):
+    """加载已训练的级联模型（供实时预测/服务使用）"""
+    first_stage, threshold = NgramClassifier.load(path or PATH_CONFIG['cascade_path'])
+    return CascadeModel(first_stage, load_backend(backend), threshold)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Char n-gram → BERT cascade predictor")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="BERT backend for escalated inputs")
+    parser.add_argument("--report", action="store_true", help="load the saved first stage instead of training")
+    parser.add_argument("--batch-size", type=int, default=CASCADE_CONFIG['batch_size'])
+    args = parser.parse_args()
+
+    print("="*60)
+    print("Cascade predictor")
+    print("="*60)
+
+    bert_model = load_backend(args.backend)
+    path = PATH_CONFIG['cascade_path']
+
+    if args.report:
+        if not os.path.exists(path):
+            print(f"✗ {path} not found, run without --report first")
+            sys.exit(1)
+        first_stage, threshold = NgramClassifier.load(path)
+        if threshold is None:
+            print(f"✗ {path} has no calibrated threshold, run without --report first")
+            sys.exit(1)
+    else:
+        first_stage, threshold = train_first_stage(bert_model, args.batch_size)
+        first_stage.save(path, threshold)
+        print(f"✓ First stage saved: {path}")
+
+    report(first_stage, bert_model, threshold, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
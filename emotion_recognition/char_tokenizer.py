@@ -0,0 +1,226 @@
+"""
+与 iOS 端 EmojiPredictor.swift 完全一致的字符级分词器
+
+Swift 端的规则（tokenize()）：
+- 第一个位置 [CLS]，然后每个 Character（字素簇）用 String(char) 在 vocab.txt 中查表，
+  查不到为 [UNK]；最多 max_length - 2 个字符，随后是 [SEP]，其余位置补 0
+- vocab 中同一 token 出现多次时，后出现的行号覆盖前面的
+- 不做小写化、不做 WordPiece 切分（与 HuggingFace BertTokenizer 不同）
+
+词表优先从二进制 bundle（output/tokenizer.emtk，见 tokenizer_bundle.py）内存映射读取，不存在时解析 vocab.txt。
+实现上预先构建 “码位 → id” 查找数组，一批文本先整体转成 UTF-32 码位数组，
+再用 numpy 索引完成查表和补齐，没有逐字符的字典查找。
+包含组合字符、ZWJ、变体选择符、国旗等多码位字素簇的文本走逐字的参考实现。
+
+用法:
+    python char_tokenizer.py        # 与 Swift 规则和 HuggingFace tokenizer 做一致性检查
+"""
+
+import os
+import sys
+import unicodedata
+import numpy as np
+from config import MODEL_CONFIG, PATH_CONFIG
+from inference_utils import get_seq_buckets, select_bucket
+from tokenizer_bundle import TokenizerBundle, load_vocab
+
+
+ZWJ = 0x200D
+
+
+def is_grapheme_extend(cp):
+    """会并入前一个字符的码位：组合标记、ZWJ、变体选择符、肤色修饰符、标签字符"""
+    if cp == ZWJ or 0xFE00 <= cp <= 0xFE0F or 0xE0100 <= cp <= 0xE01EF:
+        return True
+    if 0x1F3FB <= cp <= 0x1F3FF or 0xE0020 <= cp <= 0xE007F:
+        return True
+    return unicodedata.category(chr(cp)).startswith('M')
+
+
+def is_regional_indicator(cp):
+    return 0x1F1E6 <= cp <= 0x1F1FF
+
+
+def split_graphemes(text):
+    """
+    按 Swift Character 的边界切分（覆盖本项目输入中会出现的情况）：
+    基字符 + 组合/修饰码位、ZWJ 连接的 emoji 序列、两两成对的国旗、\\r\\n
+    """
+    clusters = []
+    prev_zwj = False
+    for ch in text:
+        cp = ord(ch)
+        joins = clusters and (
+            prev_zwj
+            or is_grapheme_extend(cp)
+            or (ch == '\n' and clusters[-1] == '\r')
+            or (is_regional_indicator(cp) and len(clusters[-1]) == 1
+                and is_regional_indicator(ord(clusters[-1])))
+        )
+        if joins:
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
+        prev_zwj = cp == ZWJ
+    return clusters
+
+
+class CharTokenizer:
+    """向量化的字符级分词器（输出与 Swift 端逐位一致）"""
+
+    def __init__(self, vocab_path=None, max_length=None, buckets=None, bundle_path=None):
+        """默认使用 tokenizer.emtk（存在时）；指定 vocab_path 时解析 vocab.txt"""
+        if bundle_path is None and vocab_path is None and os.path.exists(PATH_CONFIG['tokenizer_bundle_path']):
+            bundle_path = PATH_CONFIG['tokenizer_bundle_path']
+
+        if bundle_path:
+            bundle = TokenizerBundle(bundle_path)
+            code_points, ids = bundle.table_arrays()
+            self.token_id = bundle.token_id
+            self.cls_id, self.sep_id, self.unk_id = bundle.cls_id, bundle.sep_id, bundle.unk_id
+        else:
+            vocab, _ = load_vocab(vocab_path or PATH_CONFIG['vocab_path'])
+            single = {ord(t): i for t, i in vocab.items() if len(t) == 1}
+            code_points, ids = np.array(list(single.keys())), np.array(list(single.values()))
+            self.cls_id = vocab.get('[CLS]', 101)
+            self.sep_id = vocab.get('[SEP]', 102)
+            self.unk_id = vocab.get('[UNK]', 100)
+            self.token_id = lambda char: vocab.get(char, self.unk_id)
+        self.max_length = max_length or MODEL_CONFIG['max_length']
+        self.buckets = buckets or get_seq_buckets(self.max_length)
+
+        # 码位 → id 查找数组；最后一个位置兜底，所有超出范围的码位都映射到 [UNK]
+        size = int(code_points.max()) + 2
+        self.lookup = np.full(size, self.unk_id, dtype=np.int64)
+        self.lookup[code_points] = ids
+
+        # 可能属于多码位字素簇的码位（需要走参考实现）
+        self.complex = np.zeros(size, dtype=bool)
+        for cp in range(size - 1):
+            if cp == 0x0D or is_grapheme_extend(cp) or is_regional_indicator(cp):
+                self.complex[cp] = True
+
+    def _complex_above_table(self, cps):
+        """查找表之外的码位中，是否有可能组成多码位字素簇的"""
+        high = cps[cps >= len(self.lookup) - 1]
+        return any(is_grapheme_extend(int(cp)) or is_regional_indicator(int(cp)) for cp in np.unique(high))
+
+    def reference_ids(self, text):
+        """逐字符参考实现，逐行对应 Swift 的 tokenize()（不含补齐）"""
+        ids = [self.cls_id]
+        for char in split_graphemes(text):
+            if len(ids) >= self.max_length - 1:
+                break
+            ids.append(self.token_id(char))
+        ids.append(self.sep_id)
+        return ids
+
+    def encode(self, texts):
+        """分词一批文本，补齐到能容纳最长文本的最小分桶"""
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            # 空 batch：返回 (0, 最小分桶) 的空数组，而不是在下面的 concatenate / 广播中报错
+            empty = np.zeros((0, select_bucket(2, self.buckets)), dtype=np.int64)
+            return {'input_ids': empty, 'attention_mask': empty.copy()}
+
+        codepoints = [np.frombuffer(t.encode('utf-32-le'), dtype=np.uint32) for t in texts]
+        lengths = np.array([len(c) for c in codepoints], dtype=np.int64)
+        flat = np.concatenate(codepoints)
+        clipped = np.minimum(flat, len(self.lookup) - 1)
+
+        # 含多码位字素簇的文本单独处理
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        complex_texts = set()
+        if self.complex[clipped].any() or (flat >= len(self.lookup) - 1).any():
+            for i, (start, length) in enumerate(zip(starts, lengths)):
+                cps = flat[start:start + length]
+                if self.complex[np.minimum(cps, len(self.lookup) - 1)].any() or self._complex_above_table(cps):
+                    complex_texts.add(i)
+
+        # 每条文本保留的字符数（不含 [CLS]/[SEP]）
+        counts = np.minimum(lengths, self.max_length - 2)
+        references = {i: self.reference_ids(texts[i]) for i in complex_texts}
+        for i, ids in references.items():
+            counts[i] = len(ids) - 2
+
+        seq_len = select_bucket(int(counts.max()) + 2, self.buckets)
+        input_ids = np.zeros((len(texts), seq_len), dtype=np.int64)
+        input_ids[:, 0] = self.cls_id
+
+        # 向量化查表 + 散射到补齐后的矩阵
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        positions = np.arange(len(flat)) - np.repeat(starts, lengths)
+        keep = positions < np.repeat(counts, lengths)
+        if complex_texts:
+            keep &= ~np.isin(rows, list(complex_texts))
+        input_ids[rows[keep], positions[keep] + 1] = self.lookup[clipped[keep]]
+        input_ids[np.arange(len(texts)), counts + 1] = self.sep_id
+
+        for i, ids in references.items():
+            input_ids[i, :len(ids)] = ids
+
+        attention_mask = (np.arange(seq_len)[None, :] < (counts + 2)[:, None]).astype(np.int64)
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+
+def is_cjk_only(text):
+    """只包含汉字和中文标点的文本（这类文本上 HF tokenizer 与字符级分词应当一致）"""
+    for ch in text:
+        cp = ord(ch)
+        if not (0x4E00 <= cp <= 0x9FFF or 0x3000 <= cp <= 0x303F or 0xFF00 <= cp <= 0xFFEF):
+            return False
+    return True
+
+
+def verify_char_tokenizer():
+    """与 Swift 规则（参考实现）逐位比对，并统计与 HuggingFace tokenizer 的一致率"""
+    from transformers import AutoTokenizer
+    from inference_utils import load_labeled_texts
+
+    print("="*60)
+    print("Verifying CharTokenizer")
+    print("="*60)
+
+    tokenizer = CharTokenizer()
+    texts = load_labeled_texts(PATH_CONFIG['train_file'])[0] + load_labeled_texts(PATH_CONFIG['val_file'])[0]
+    # 额外覆盖边界情况：空白、英文大小写、emoji 组合序列、国旗、超长文本
+    texts += ["Hello World", "哈哈 哈", "👍🏻好的", "👨‍👩‍👧一家人", "🇨🇳加油", "é", "笑" * 200]
+
+    ok = True
+    empty = tokenizer.encode([])
+    print(f"{'✓' if empty['input_ids'].shape == (0, tokenizer.buckets[0]) else '✗'} "
+          f"Empty batch -> {empty['input_ids'].shape}")
+    ok &= empty['input_ids'].shape == (0, tokenizer.buckets[0])
+
+    encoded = tokenizer.encode(texts)
+    swift_mismatch = 0
+    for i, text in enumerate(texts):
+        ids = tokenizer.reference_ids(text)
+        row = encoded['input_ids'][i]
+        if list(row[:len(ids)]) != ids or row[len(ids):].any() or encoded['attention_mask'][i].sum() != len(ids):
+            swift_mismatch += 1
+    print(f"Swift rules: {len(texts) - swift_mismatch}/{len(texts)} identical")
+    ok &= swift_mismatch == 0
+
+    hf = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    hf_ids = hf(texts, truncation=True, max_length=tokenizer.max_length)['input_ids']
+    agree = cjk_total = cjk_mismatch = 0
+    for i, text in enumerate(texts):
+        same = list(encoded['input_ids'][i][:len(hf_ids[i])]) == hf_ids[i] \
+            and encoded['attention_mask'][i].sum() == len(hf_ids[i])
+        agree += same
+        if is_cjk_only(text):
+            cjk_total += 1
+            cjk_mismatch += not same
+    print(f"HuggingFace: {agree}/{len(texts)} identical "
+          f"(differences come from lower-casing / WordPiece on non-CJK text)")
+    print(f"HuggingFace on CJK-only texts: {cjk_total - cjk_mismatch}/{cjk_total} identical")
+    ok &= cjk_mismatch == 0
+
+    print("✓ CharTokenizer verified" if ok else "✗ CharTokenizer mismatch")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_char_tokenizer() else 1)
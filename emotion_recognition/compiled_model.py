@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+编译推理图（减少 eager 模式下每层的 Python 调度开销，主要降低短文本单条延迟）
+- trace:   对每个分桶长度 TorchScript trace 并 freeze / optimize_for_inference；
+           同一个 trace 在其他分桶（及 batch 大小）上结果与 eager 一致时直接复用，不重复保存权重
+- compile: torch.compile（inductor），在每个分桶上预先编译，inductor 缓存写到磁盘
+编译产物缓存在 COMPILE_CONFIG['cache_dir']/<模型哈希>-torch<版本>/ 下，重启时直接加载。
+任何一步失败都会回退到 eager 模式（FastEmotionModel）。
+
+用法:
+    python compiled_model.py                  # 比较 eager 与编译后的单条延迟
+    python compiled_model.py --mode compile
+"""
+
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from config import COMPILE_CONFIG
+from fast_predictor import FastEmotionModel
+from safetensors_mmap import find_weights_file
+
+
+class CompiledEmotionModel(FastEmotionModel):
+    """接口与 FastEmotionModel 相同：encode(texts) / forward(inputs) / predict_proba(texts)"""
+
+    def __init__(self, model_path=None, num_threads=None, mode=None, cache_dir=None):
+        super().__init__(model_path, num_threads=num_threads, warmup=False)
+        self.mode = mode or COMPILE_CONFIG['mode']
+        self.cache_dir = cache_dir or COMPILE_CONFIG['cache_dir']
+        # 分桶长度 → (编译后的模块, 是否支持任意 batch 大小)
+        self.compiled = {}
+        self.active_mode = "eager"
+
+        try:
+            # 与 forward 相同的 inference_mode 下 trace / 编译（torch.compile 的 guard 包含梯度模式）
+            with self.timer.phase(f"compile ({self.mode})"), self.torch.inference_mode():
+                if self.mode == "trace":
+                    self._load_or_trace()
+                elif self.mode == "compile":
+                    self._torch_compile()
+                else:
+                    raise ValueError(f"Unknown compile mode: {self.mode}")
+            self.active_mode = self.mode
+        except Exception as e:
+            print(f"⚠️ {self.mode} failed, falling back to eager mode: {e}")
+            self.compiled = {}
+
+    def _cache_key(self):
+        """模型哈希（权重 + config.json + 分桶长度）+ torch 版本"""
+        from export_cache import ExportCache
+
+        weights = find_weights_file(self.model_path) or os.path.join(self.model_path, "pytorch_model.bin")
+        hashes = ExportCache(os.path.join(self.cache_dir, "file_hashes.json"))
+        digest = hashlib.sha256()
+        for path in (weights, os.path.join(self.model_path, "config.json")):
+            digest.update(hashes.file_hash(path).encode('utf-8'))
+        # 分桶（最后一个即 max_length）决定 trace 的形状，改了配置不能复用旧的产物
+        digest.update(json.dumps(self.buckets).encode('utf-8'))
+        hashes.save()
+        return f"{digest.hexdigest()[:16]}-torch{self.torch.__version__}"
+
+    def _logits_module(self):
+        torch = self.torch
+
+        class LogitsOnly(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask):
+                return self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+        return LogitsOnly(self.model).eval()
+
+    def _example(self, bucket, batch_size=1):
+        # 随机 token 并在末尾留出 padding，避免常量输入掩盖形状相关的问题
+        rng = np.random.default_rng(bucket * 100 + batch_size)
+        input_ids = rng.integers(100, 8000, size=(batch_size, bucket), dtype=np.int64)
+        attention_mask = np.ones((batch_size, bucket), dtype=np.int64)
+        attention_mask[:, max(bucket * 3 // 4, 1):] = 0
+        return self.torch.from_numpy(input_ids), self.torch.from_numpy(attention_mask)
+
+    def _matches_eager(self, module, bucket, batch_size):
+        example = self._example(bucket, batch_size)
+        expected = self._logits_module()(*example)
+        return self.torch.allclose(module(*example), expected, atol=1e-4)
+
+    def _load_or_trace(self):
+        torch = self.torch
+        cache_path = os.path.join(self.cache_dir, self._cache_key())
+        manifest_path = os.path.join(cache_path, "manifest.json")
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            modules = {}
+            for bucket, entry in manifest["buckets"].items():
+                if entry["file"] not in modules:
+                    modules[entry["file"]] = torch.jit.load(os.path.join(cache_path, entry["file"]), map_location='cpu')
+                self.compiled[int(bucket)] = (modules[entry["file"]], entry["any_batch"])
+            print(f"✓ Loaded traced graphs from {cache_path}")
+            return
+
+        manifest = {"torch": torch.__version__, "buckets": {}}
+        traced = []  # [(文件名, 模块)]
+        for bucket in self.buckets:
+            # 先尝试复用已有的 trace
+            reused = next((
+                (name, module) for name, module in traced
+                if self._matches_eager(module, bucket, 1)
+            ), None)
+            if reused is None:
+                module = torch.jit.trace(self._logits_module(), self._example(bucket), check_trace=False)
+                module = torch.jit.optimize_for_inference(torch.jit.freeze(module))
+                if not self._matches_eager(module, bucket, 1):
+                    print(f"⚠️ Traced graph differs from eager at length {bucket}, using eager for it")
+                    continue
+                reused = (f"traced_{bucket}.pt", module)
+                traced.append(reused)
+            name, module = reused
+            any_batch = self._matches_eager(module, bucket, 3)
+            self.compiled[bucket] = (module, any_batch)
+            manifest["buckets"][str(bucket)] = {"file": name, "any_batch": any_batch}
+
+        os.makedirs(cache_path, exist_ok=True)
+        for name, module in traced:
+            torch.jit.save(module, os.path.join(cache_path, name))
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        print(f"✓ Traced {len(traced)} graph(s) for buckets {sorted(self.compiled)}, cached in {cache_path}")
+
+    def _torch_compile(self):
+        torch = self.torch
+        # inductor 的 FX 图缓存写到按模型区分的目录，重启时跳过重新编译
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(self.cache_dir, "inductor", self._cache_key())
+        import torch._dynamo
+        import torch._inductor.config
+        torch._inductor.config.fx_graph_cache = True
+
+        # dynamic=None 下重新编译时会自动把变化过的维度改为动态，
+        # 所以序列维显式标记为静态：每个分桶一份按固定长度特化的图，batch 维为动态
+        module = torch.compile(self._logits_module(), dynamic=None)
+        for bucket in self.buckets:
+            input_ids, attention_mask = self._example(bucket, 2)
+            for tensor in (input_ids, attention_mask):
+                torch._dynamo.mark_dynamic(tensor, 0)
+                torch._dynamo.mark_static(tensor, 1)
+            module(input_ids, attention_mask)
+            if not self._matches_eager(module, bucket, 1):
+                raise RuntimeError(f"Compiled graph differs from eager at length {bucket}")
+            self.compiled[bucket] = (module, True)
+
+    def forward(self, inputs):
+        entry = self.compiled.get(inputs['input_ids'].shape[1])
+        if entry is None or not (entry[1] or inputs['input_ids'].shape[0] == 1):
+            return super().forward(inputs)
+        with self.torch.inference_mode():
+            return entry[0](
+                self.torch.from_numpy(inputs['input_ids']),
+                self.torch.from_numpy(inputs['attention_mask'])
+            ).numpy()
+
+
+def main():
+    from inference_utils import measure_latency, summarize_latencies
+
+    parser = argparse.ArgumentParser(description="Compiled vs eager single-request latency")
+    parser.add_argument("--mode", choices=["trace", "compile"], default=COMPILE_CONFIG['mode'])
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    print("="*60)
+    print(f"Compiled inference ({args.mode})")
+    print("="*60)
+
+    model = CompiledEmotionModel(mode=args.mode)
+    model.startup_report(wait_warmup=False)
+    if model.active_mode == "eager":
+        print("✗ Compilation unavailable, nothing to compare")
+        return
+
+    texts = ["好", "今天真的太开心了", "这也太离谱了吧我真的服了你们这些人"]
+    print(f"\n{'text length':<14}{'eager p50':>12}{'compiled p50':>15}{'speedup':>10}")
+    for text in texts:
+        inputs = model.encode(text)
+        eager = summarize_latencies(measure_latency(lambda: FastEmotionModel.forward(model, inputs), args.repeats))
+        compiled = summarize_latencies(measure_latency(lambda: model.forward(inputs), args.repeats))
+        diff = np.abs(model.forward(inputs) - FastEmotionModel.forward(model, inputs)).max()
+        print(f"{len(text):<14}{eager['p50']:>10.2f}ms{compiled['p50']:>13.2f}ms"
+              f"{eager['p50'] / compiled['p50']:>9.2f}x   (max logit diff {diff:.1e})")
+
+
+if __name__ == "__main__":
+    main()
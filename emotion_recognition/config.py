@@ -17,6 +17,8 @@ MODEL_CONFIG = {
     "model_name": "bert-base-chinese",  # 量化后约100MB，iOS流畅运行
     "max_length": 128,
     "num_labels": len(EMOJI_LIST),  # 17个emoji
+    # 推理时的序列长度分桶：选择能容纳输入的最小桶，ONNX 使用动态序列轴，CoreML 使用枚举形状
+    "seq_buckets": [16, 32, 64, 128],
 }
 
 # 训练配置 - 全参数微调
@@ -30,6 +32,11 @@ TRAINING_CONFIG = {
     "eval_steps": 100,
     "logging_steps": 50,
     "use_class_weights": True,
+    "async_eval": False,  # 验证放到独立进程中与训练并行（见 async_eval.py），也可用 --async-eval 开启
+    "auto_batch_size": False,  # 使用 batch_size_finder.py 在本机测得的吞吐最优 batch 大小（也可用 --auto-batch-size 开启）
+    "gradient_checkpointing": False,  # 用重算换显存/内存，可以放下更大的 batch
+    "prefetch_batches": 2,  # 后台线程提前准备的 batch 数（见 data_processing.PrefetchLoader）
+    "dynamic_padding": True,  # 每个 batch 只补齐到 batch 内最长的文本（按 8 对齐），而不是 max_length
 }
 
 # 路径配置
@@ -39,4 +46,179 @@ PATH_CONFIG = {
     "output_dir": "./output",
     "model_save_path": "./output/emoji_model",
     "onnx_path": "./output/emoji_model.onnx",
+    "vocab_path": "./output/vocab.txt",
+    "tokenizer_bundle_path": "./output/tokenizer.emtk",  # 二进制分词器 / 标签 bundle（见 tokenizer_bundle.py）
+    "onnx_optimized_path": "./output/emoji_model_opt.onnx",
+    "onnx_optimize_report": "./output/onnx_optimize_report.json",
+    "onnx_int8_path": "./output/emoji_model_int8.onnx",
+    "onnx_quantize_report": "./output/onnx_quantize_report.json",
+    "coreml_fp16_path": "./output/emoji_model_fp16.mlpackage",
+    "coreml_int8_path": "./output/emoji_model_int8.mlpackage",
+    "export_manifest": "./output/export_manifest.json",
+    "benchmark_dir": "./output/benchmarks",
+    "benchmark_baseline": "./benchmarks/baseline.json",
+    "cascade_path": "./output/cascade_stage1.npz",
+}
+
+# 导出配置
+EXPORT_CONFIG = {
+    "optimize_onnx": True,  # 导出后融合 Attention/LayerNorm/GELU/BiasAdd
+    "onnx_fp16": "auto",  # "auto": 仅在有 CUDA 时转换为 fp16（CPU 上 fp16 反而更慢）
+    "max_workers": 4,  # 导出流水线中并行执行的阶段数，1 为完全串行
+}
+
+# ONNX 静态 INT8 量化配置
+QUANT_CONFIG = {
+    "calibration_samples": 256,  # 从训练集中抽样的校准条数
+    "calibration_batch_size": 16,
+    "calibration_method": "MinMax",  # MinMax / Entropy / Percentile
+    "per_channel": True,
+    "seed": 42,
+    # 量化预处理是否跳过符号形状推断；None 为自动：推断失败时跳过重试（实际取值记录在报告中）
+    "skip_symbolic_shape": None,
+}
+
+# PyTorch 与各 ONNX 后端的数值一致性阈值（超过则 parity_check.py 以非零状态退出）
+PARITY_CONFIG = {
+    "batch_size": 64,
+    "tolerances": {
+        "onnx_fp32": {"max_logit_error": 1e-3, "min_top1_agreement": 1.0, "max_accuracy_drop": 0.0},
+        "onnx_optimized": {"max_logit_error": 5e-2, "min_top1_agreement": 0.99, "max_accuracy_drop": 0.01},
+        "onnx_int8": {"max_logit_error": 1.0, "min_top1_agreement": 0.95, "max_accuracy_drop": 0.02},
+    },
+}
+
+# 性能基准配置
+BENCHMARK_CONFIG = {
+    "latency_repeats": 100,  # 单条/批量推理延迟的重复次数
+    "inference_batch_size": 32,
+    "train_steps": 10,  # 训练步耗时只跑前 N 个 batch
+    "regression_threshold": 0.10,  # 比基线差 10% 以上视为回归
+}
+
+# 级联预测配置：字符 n-gram 线性模型先判，置信度不足时再交给 BERT
+CASCADE_CONFIG = {
+    "n_features": 2 ** 18,  # 哈希特征维数
+    "ngram_range": (1, 3),  # 字符 n-gram 范围
+    "C": 4.0,  # 逻辑回归正则化强度的倒数
+    "calibration_fraction": 0.2,  # 从训练集中留出用于标定阈值的比例
+    "target_agreement": 0.97,  # 第一级直接返回的样本上与 BERT 预测的最低一致率
+    "batch_size": 64,
+    "seed": 42,
+}
+
+# 运行时指标（Prometheus 文本格式，只监听本机）
+METRICS_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 9464,
+    # 直方图桶上界（秒）
+    "latency_buckets": [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+}
+
+# 本地预测服务（按行分隔的 JSON，见 predict_server.py）
+SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8765,
+    "backend": "torch",  # 见 inference_utils.BACKENDS
+    "workers": 0,  # prefork 推理进程数，0 为单进程（见 prefork.py）
+    "threads_per_worker": 1,
+}
+
+# 按键流压测配置（见 loadgen.py）
+LOADGEN_CONFIG = {
+    "users": 8,  # 并发用户数
+    "chars_per_second": 6.0,  # 每个用户的平均打字速度（按泊松过程生成按键间隔）
+    "message_pause": 1.5,  # 两条消息之间的平均停顿（秒）
+    "duration": 30,  # 压测时长（秒）
+    "timeout": 5.0,  # 单次请求超时（秒），超时计为丢弃
+    "seed": 42,
+}
+
+# 模型热更新配置（见 hot_reload.py）
+RELOAD_CONFIG = {
+    "watch_interval": 5.0,  # 轮询模型目录的间隔（秒）；文件连续两次不变才加载，避免读到写了一半的模型
+    "warmup_batch_sizes": [1, 8],  # 切换前在每个分桶长度上预热的 batch 大小
+    "drain_timeout": 30.0,  # 等待旧模型上进行中请求结束的最长时间（秒）
+}
+
+# 编译推理配置（见 compiled_model.py）
+COMPILE_CONFIG = {
+    "mode": "trace",  # "trace": TorchScript trace + freeze；"compile": torch.compile（inductor）
+    "cache_dir": "./output/compiled",  # 按模型哈希和 torch 版本分目录缓存编译产物
+}
+
+# 内存剖析配置（python train.py --memory-profile，或设置环境变量 EMOJI_MEMORY_PROFILE=1）
+MEMORY_CONFIG = {
+    "budget_mb": None,  # 进程 RSS 上限（MB），超过即中止；环境变量 EMOJI_MEMORY_BUDGET_MB 可覆盖
+    "stage_budgets_mb": {},  # 单个阶段的 RSS 上限，例如 {"coreml_int8": 6000}
+    "sample_interval": 0.01,  # 采样间隔（秒）
+    "tracemalloc": True,  # 同时记录 Python 堆分配峰值（开销较大，只在剖析模式下启用）
+    "report_path": "./output/memory_report.json",
+}
+
+# 离线批量打标配置（见 bulk_score.py）
+BULK_CONFIG = {
+    "backend": "onnx",  # 见 inference_utils.BACKENDS
+    "chunk_size": 4096,  # 每个分块的条数（断点续跑的粒度）
+    "batch_size": 64,  # 分块内按长度排序后的推理 batch 大小
+    "top_k": 3,
+    "workers": None,  # 进程数，默认 CPU 核数 / threads_per_worker
+    "threads_per_worker": 1,  # 每个进程的推理线程数（并绑定到对应的 CPU 核上）
+}
+
+# max_length 选择配置（见 max_length_tuner.py）
+MAXLEN_CONFIG = {
+    "coverage_percentile": 99.5,  # 推荐的 max_length 至少覆盖训练集中这个百分位的文本（不被截断）
+    "round_to": 8,  # 向上取整到 8 的倍数（对齐硬件向量宽度）
+}
+
+# 异步验证配置（见 async_eval.py）
+ASYNC_EVAL_CONFIG = {
+    "work_dir": "./output/async_eval",  # 检查点与验证结果的交换目录
+    # 验证进程使用的设备："cpu" / "cuda" / "auto"（有 GPU 时用 GPU）
+    # 默认 cpu：与训练共用一块 GPU 时，两者争抢显存和算力，训练会变慢甚至 OOM
+    "device": "cpu",
+    "poll_interval": 2.0,  # 验证进程轮询新检查点的间隔（秒）
+    "batch_size": 64,
+}
+
+# batch 大小探测配置（见 batch_size_finder.py）
+BATCH_PROBE_CONFIG = {
+    "max_batch_size": 512,
+    "probe_steps": 3,  # 每个候选大小计时的训练步数（另有一步预热，用于分配优化器状态）
+    "memory_fraction": 0.85,  # CPU 训练时最多使用可用内存的比例
+    "result_path": "./output/batch_size.json",
+}
+
+# 数据去重配置（见 data_processing.deduplicate）
+DEDUP_CONFIG = {
+    "enabled": True,
+    "shingle_size": 3,  # MinHash 的字符 n-gram 长度
+    "num_perm": 128,  # MinHash 签名长度
+    "bands": 32,  # LSH 分段数（每段 num_perm / bands 行）
+    "threshold": 0.7,  # 估计的 Jaccard 相似度不低于此值视为近似重复
+    "min_chars": 4,  # 规范化后短于此长度的文本只做精确去重
+    "seed": 42,
+    "report_path": "./output/dedup_report.json",
+}
+
+# ONNX 算子级剖析配置（见 onnx_profile.py）
+PROFILE_CONFIG = {
+    "batch_sizes": [1, 8, 32],
+    "warmup": 3,  # 每种输入形状先跑几次（不计入统计）
+    "repeats": 20,  # 每种输入形状计入统计的次数
+    "output_dir": "./output/onnx_profile",
+}
+
+# 增量微调配置（见 incremental_train.py）
+INCREMENTAL_CONFIG = {
+    "work_dir": "./output/incremental",  # 已消费数据和历次运行记录
+    "epochs": 2,
+    "learning_rate": 2e-5,  # 比全量训练小，从已收敛的模型继续
+    "replay_ratio": 2.0,  # 每条新样本配多少条旧数据回放
+    "min_replay_per_class": 8,  # 回放数据中每个 emoji 至少的条数
+    "max_accuracy_drop": 0.005,  # 验证集整体准确率最多下降
+    "max_class_drop": 0.05,  # 单个 emoji 的验证准确率最多下降
+    "min_class_support": 10,  # 验证样本少于此数的 emoji 不做单独检查（波动太大）
+    "seed": 42,
 }
@@ -144,4 +144,4 @@ if __name__ == "__main__":
         print("="*60)
         print(f"\nYou can now use the model in your iOS app.")
         print("Import the .mlmodel or .mlpackage file into your Xcode project.")
-        print("\nIn iOS, use sigmoid on logits and take argmax to get the emoji index.")
+        print("\nIn iOS, use softmax on logits and take argmax to get the emoji index.")
@@ -3,30 +3,127 @@
 加载自定义JSON格式的中文情绪数据集
 """
 
+import os
+import re
 import json
+import time
+import zlib
+import queue
+import hashlib
+import threading
+import unicodedata
 import torch
 import numpy as np
 from collections import Counter
 from transformers import AutoTokenizer
-from torch.utils.data import DataLoader, Dataset
-from config import MODEL_CONFIG, TRAINING_CONFIG, EMOJI_TO_ID, EMOJI_LIST, PATH_CONFIG
+from torch.utils.data import Dataset
+from config import MODEL_CONFIG, TRAINING_CONFIG, EMOJI_TO_ID, EMOJI_LIST, PATH_CONFIG, DEDUP_CONFIG
+from memory_profile import memory_stage
+
+
+def to_padded_array(rows):
+    """分词结果转为 int64 矩阵；未补齐的（长度不一）补 0 到最长"""
+    lengths = {len(r) for r in rows}
+    if len(lengths) <= 1:
+        return np.asarray(rows, dtype=np.int64).reshape(len(rows), -1)
+    array = np.zeros((len(rows), max(lengths)), dtype=np.int64)
+    for i, row in enumerate(rows):
+        array[i, :len(row)] = row
+    return array
 
 
 class EmojiDataset(Dataset):
     """中文emoji单标签数据集类"""
     
     def __init__(self, encodings, labels):
-        self.encodings = encodings
-        self.labels = labels
+        # 整体转成 numpy 矩阵，组 batch 时按索引整块切片
+        self.arrays = {key: to_padded_array(val) for key, val in encodings.items()}
+        self.labels = np.asarray(labels, dtype=np.int64)
     
     def __len__(self):
         return len(self.labels)
     
     def __getitem__(self, idx):
-        item = {key: torch.tensor(val[idx]) for key, val in self.encodings.items()}
+        item = {key: torch.from_numpy(val[idx]) for key, val in self.arrays.items()}
         # 单标签分类：使用long tensor
         item['labels'] = torch.tensor(self.labels[idx], dtype=torch.long)
         return item
+    
+    def get_batch(self, indices, dynamic_padding=True):
+        """一次切出整个 batch；dynamic_padding 时截掉 batch 内所有样本都是补齐的列（按 8 对齐）"""
+        batch = {key: val[indices] for key, val in self.arrays.items()}
+        if dynamic_padding and 'attention_mask' in batch:
+            width = batch['attention_mask'].shape[1]
+            length = int(batch['attention_mask'].sum(axis=1).max()) if len(indices) else width
+            length = min(width, -(-length // 8) * 8)
+            batch = {key: val[:, :length] for key, val in batch.items()}
+        batch = {key: torch.from_numpy(np.ascontiguousarray(val)) for key, val in batch.items()}
+        batch['labels'] = torch.from_numpy(self.labels[indices])
+        return batch
+
+
+class PrefetchLoader:
+    """
+    代替 DataLoader：后台线程提前准备 prefetch 个 batch（整批切片 + 动态补齐 + pin_memory），
+    训练线程只从队列中取出准备好的 batch，数据准备与前向/反向重叠。
+    wait_seconds 为最近一轮迭代中训练线程等待数据的总时间。
+    """
+    
+    def __init__(self, dataset, batch_size, shuffle=False, prefetch=2, pin_memory=False, dynamic_padding=True):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.prefetch = max(1, prefetch)
+        self.pin_memory = pin_memory
+        self.dynamic_padding = dynamic_padding
+        self.wait_seconds = 0.0
+    
+    def __len__(self):
+        return (len(self.dataset) + self.batch_size - 1) // self.batch_size
+    
+    def __iter__(self):
+        order = np.random.permutation(len(self.dataset)) if self.shuffle else np.arange(len(self.dataset))
+        batches = [order[s:s + self.batch_size] for s in range(0, len(order), self.batch_size)]
+        slots = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        
+        def put(item):
+            # 消费方提前退出（break / 异常）时不要永远阻塞在 put 上
+            while not stop.is_set():
+                try:
+                    slots.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def produce():
+            try:
+                for indices in batches:
+                    batch = self.dataset.get_batch(indices, self.dynamic_padding)
+                    if self.pin_memory:
+                        batch = {key: val.pin_memory() for key, val in batch.items()}
+                    if not put(batch):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+        
+        self.wait_seconds = 0.0
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                batch = slots.get()
+                self.wait_seconds += time.perf_counter() - start
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
 
 
 def load_json_data(file_path):
@@ -61,6 +158,151 @@ def convert_data_to_single_label(data):
     return converted
 
 
+# ---------- 去重 ----------
+
+_REPEAT_RE = re.compile(r'(.)\1{2,}')
+_PRIME = (1 << 31) - 1
+
+
+def normalize_text(text):
+    """去重用的规范化：NFKC、小写、去掉空白和标点，连续重复的字符压缩为两个（"哈哈哈哈" → "哈哈"）"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ''.join(c for c in text if unicodedata.category(c)[0] not in 'PZC')
+    return _REPEAT_RE.sub(r'\1\1', text)
+
+
+class MinHasher:
+    """字符 n-gram 集合的 MinHash 签名（a * x + b mod p 的一组随机哈希）"""
+
+    def __init__(self, num_perm, shingle_size, seed):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, _PRIME, num_perm).astype(np.uint64)
+        self.b = rng.randint(0, _PRIME, num_perm).astype(np.uint64)
+        self.shingle_size = shingle_size
+
+    def signature(self, text):
+        k = self.shingle_size
+        shingles = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) % _PRIME for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # a、x 都小于 2^31，乘积不会溢出 uint64
+        return ((np.outer(self.a, hashes) + self.b[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class LSHIndex:
+    """按段分桶的 LSH 索引：只和至少一段签名完全相同的条目比较，避免两两比较"""
+
+    def __init__(self, num_perm, bands):
+        self.rows = num_perm // bands
+        self.tables = [{} for _ in range(bands)]
+        self.signatures = []
+        self.owners = []
+
+    def _keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self.tables))]
+
+    def query(self, signature, threshold):
+        """返回估计相似度最高且不低于阈值的条目的 owner，没有则返回 None"""
+        best, best_sim = None, threshold
+        seen = set()
+        for table, key in zip(self.tables, self._keys(signature)):
+            for j in table.get(key, ()):
+                if j in seen:
+                    continue
+                seen.add(j)
+                sim = float((self.signatures[j] == signature).mean())
+                if sim >= best_sim:
+                    best, best_sim = j, sim
+        return None if best is None else self.owners[best]
+
+    def insert(self, signature, owner):
+        j = len(self.signatures)
+        self.signatures.append(signature)
+        self.owners.append(owner)
+        for table, key in zip(self.tables, self._keys(signature)):
+            table.setdefault(key, []).append(j)
+
+
+def deduplicate(train_data, val_data, max_examples=20):
+    """
+    精确去重（规范化文本的哈希）+ MinHash/LSH 近似去重，每组重复只保留第一条。
+    先处理验证集，训练集中与验证集重复的条目作为泄漏从训练集中删除。
+    返回 (train_data, val_data, report)
+    """
+    config = DEDUP_CONFIG
+    hasher = MinHasher(config['num_perm'], config['shingle_size'], config['seed'])
+    index = LSHIndex(config['num_perm'], config['bands'])
+    exact = {}  # 规范化文本的哈希 → (split, 序号)
+    kept = {'train': [], 'val': []}
+    report = {
+        split: {"input": len(data), "exact": 0, "near": 0, "leak_exact": 0, "leak_near": 0, "label_conflicts": 0}
+        for split, data in (('val', val_data), ('train', train_data))
+    }
+    report['examples'] = []
+    sources = {'val': val_data, 'train': train_data}
+
+    for split in ('val', 'train'):
+        for i, item in enumerate(sources[split]):
+            norm = normalize_text(item['text'])
+            key = hashlib.blake2b(norm.encode('utf-8'), digest_size=8).digest()
+            match, kind, signature = exact.get(key), 'exact', None
+            if match is None and len(norm) >= config['min_chars']:
+                signature = hasher.signature(norm)
+                match, kind = index.query(signature, config['threshold']), 'near'
+
+            if match is None:
+                exact[key] = (split, i)
+                if signature is not None:
+                    index.insert(signature, (split, i))
+                kept[split].append(item)
+                continue
+
+            match_split, j = match
+            original = sources[match_split][j]
+            stats = report[split]
+            stats[kind if match_split == split else f"leak_{kind}"] += 1
+            if original['label'] != item['label']:
+                stats['label_conflicts'] += 1
+            if len(report['examples']) < max_examples:
+                report['examples'].append({
+                    "kind": kind if match_split == split else f"leak_{kind}",
+                    "kept": f"{match_split}[{j}] {original['text']}",
+                    "removed": f"{split}[{i}] {item['text']}",
+                })
+
+    for split in ('val', 'train'):
+        report[split]['output'] = len(kept[split])
+    return kept['train'], kept['val'], report
+
+
+def print_dedup_report(report):
+    print("\nDeduplication:")
+    for split in ('train', 'val'):
+        s = report[split]
+        print(f"  {split:<5} {s['input']} -> {s['output']} "
+              f"(exact {s['exact']}, near {s['near']}, label conflicts {s['label_conflicts']})")
+    leaks = report['train']['leak_exact'] + report['train']['leak_near']
+    mark = "⚠️" if leaks else "✓"
+    print(f"  {mark} Train/val leaks removed from train: {leaks} "
+          f"(exact {report['train']['leak_exact']}, near {report['train']['leak_near']})")
+    for example in report['examples'][:5]:
+        print(f"    [{example['kind']}] {example['removed']}  ≈  {example['kept']}")
+
+
+def load_split(file_path):
+    """
+    加载一个数据文件并转换为单标签；开启去重时与 load_and_process_data 的结果一致
+    （训练集同时去掉与验证集重复的条目）
+    """
+    data = convert_data_to_single_label(load_json_data(file_path))
+    if not DEDUP_CONFIG['enabled']:
+        return data
+    if os.path.abspath(file_path) == os.path.abspath(PATH_CONFIG['train_file']):
+        val_data = convert_data_to_single_label(load_json_data(PATH_CONFIG['val_file']))
+        return deduplicate(data, val_data)[0]
+    return deduplicate([], data)[1]
+
+
 def compute_class_weights(labels):
     """计算类别权重来处理不平衡问题"""
     label_counts = Counter(labels)
@@ -89,24 +331,36 @@ def load_and_process_data():
     sys.stdout.flush()
     
     # 加载训练和验证数据
-    print(f"[DEBUG] Loading train file: {PATH_CONFIG['train_file']}")
-    sys.stdout.flush()
-    train_data_raw = load_json_data(PATH_CONFIG['train_file'])
-    print(f"[DEBUG] Loading val file: {PATH_CONFIG['val_file']}")
-    sys.stdout.flush()
-    val_data_raw = load_json_data(PATH_CONFIG['val_file'])
+    with memory_stage("load_json"):
+        print(f"[DEBUG] Loading train file: {PATH_CONFIG['train_file']}")
+        sys.stdout.flush()
+        train_data_raw = load_json_data(PATH_CONFIG['train_file'])
+        print(f"[DEBUG] Loading val file: {PATH_CONFIG['val_file']}")
+        sys.stdout.flush()
+        val_data_raw = load_json_data(PATH_CONFIG['val_file'])
     
     # 转换为单标签（只取第一个emoji）
     print("[DEBUG] Converting to single-label (using first emoji only)...")
     sys.stdout.flush()
-    train_data = convert_data_to_single_label(train_data_raw)
-    val_data = convert_data_to_single_label(val_data_raw)
+    with memory_stage("convert_labels"):
+        train_data = convert_data_to_single_label(train_data_raw)
+        val_data = convert_data_to_single_label(val_data_raw)
     
     print(f"Dataset converted (first emoji only):")
     print(f"  Train samples: {len(train_data_raw)} -> {len(train_data)}")
     print(f"  Validation samples: {len(val_data_raw)} -> {len(val_data)}")
     sys.stdout.flush()
     
+    # 去重，并从训练集中去掉与验证集重复的条目
+    if DEDUP_CONFIG['enabled']:
+        with memory_stage("dedup"):
+            train_data, val_data, dedup_report = deduplicate(train_data, val_data)
+        print_dedup_report(dedup_report)
+        os.makedirs(os.path.dirname(DEDUP_CONFIG['report_path']), exist_ok=True)
+        with open(DEDUP_CONFIG['report_path'], 'w', encoding='utf-8') as f:
+            json.dump(dedup_report, f, ensure_ascii=False, indent=2)
+        sys.stdout.flush()
+    
     # 提取文本和标签
     train_texts = [item['text'] for item in train_data]
     train_labels = [item['label'] for item in train_data]
@@ -140,12 +394,14 @@ def load_and_process_data():
     
     print("\nTokenizing datasets...")
     sys.stdout.flush()
-    tokenized_train = tokenize_texts(train_texts)
-    tokenized_val = tokenize_texts(val_texts)
+    with memory_stage("tokenize"):
+        tokenized_train = tokenize_texts(train_texts)
+        tokenized_val = tokenize_texts(val_texts)
     
     # 创建 PyTorch Dataset
-    train_dataset = EmojiDataset(tokenized_train, train_labels)
-    val_dataset = EmojiDataset(tokenized_val, val_labels)
+    with memory_stage("build_datasets"):
+        train_dataset = EmojiDataset(tokenized_train, train_labels)
+        val_dataset = EmojiDataset(tokenized_val, val_labels)
     
     print(f"\nDatasets created:")
     print(f"  Train: {len(train_dataset)} samples")
@@ -163,31 +419,26 @@ def load_and_process_data():
     return train_dataset, val_dataset, class_weights, tokenizer
 
 
-def create_dataloaders(train_dataset, val_dataset):
-    """创建数据加载器"""
+def create_dataloaders(train_dataset, val_dataset, device=None):
+    """创建数据加载器（后台预取；pin_memory 只在 GPU 训练时有意义）"""
     
     batch_size = TRAINING_CONFIG['batch_size']
+    pin_memory = (device.type == 'cuda') if device is not None else torch.cuda.is_available()
+    options = {
+        "prefetch": TRAINING_CONFIG.get('prefetch_batches', 2),
+        "pin_memory": pin_memory,
+        "dynamic_padding": TRAINING_CONFIG.get('dynamic_padding', True),
+    }
     
-    train_loader = DataLoader(
-        train_dataset, 
-        batch_size=batch_size, 
-        shuffle=True,
-        num_workers=0,  # 避免tokenizer警告
-        pin_memory=True
-    )
-    
-    val_loader = DataLoader(
-        val_dataset, 
-        batch_size=batch_size, 
-        shuffle=False,
-        num_workers=0,
-        pin_memory=True
-    )
+    train_loader = PrefetchLoader(train_dataset, batch_size, shuffle=True, **options)
+    val_loader = PrefetchLoader(val_dataset, batch_size, shuffle=False, **options)
     
     return train_loader, val_loader
 
 
 if __name__ == "__main__":
+    from memory_profile import maybe_enable_memory_profile
+    maybe_enable_memory_profile()
     # 测试数据加载
     train_dataset, val_dataset, class_weights, tokenizer = load_and_process_data()
     train_loader, val_loader = create_dataloaders(train_dataset, val_dataset)
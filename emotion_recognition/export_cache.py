@@ -0,0 +1,155 @@
+"""
+导出流水线的内容寻址缓存
+每个阶段以其输入（权重文件、配置项、转换器版本、选项）的哈希作为 key，
+key 未变化且输出文件完好时直接复用上次的产物。
+manifest JSON 记录每个产物的 sha256、大小和来源（阶段、输入、版本）。
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from importlib import metadata
+from config import PATH_CONFIG
+from memory_profile import check_memory_budget, memory_stage
+
+
+def package_versions(packages):
+    """获取转换器等依赖包的版本（未安装时为 None）"""
+    versions = {}
+    for name in packages:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def iter_files(path):
+    """列出路径下的所有文件（文件本身或目录中的全部文件，按相对路径排序）"""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            files.append(os.path.join(dirpath, f))
+    return sorted(files)
+
+
+class ExportCache:
+    """按阶段缓存导出产物，并维护 manifest"""
+
+    def __init__(self, manifest_path=None):
+        self.manifest_path = manifest_path or PATH_CONFIG['export_manifest']
+        self.lock = threading.Lock()
+        self.manifest = {"stages": {}, "file_hashes": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+    def file_hash(self, path):
+        """文件 sha256；大小和修改时间未变时复用 manifest 中记录的值，避免重复读取大文件"""
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        with self.lock:
+            cached = self.manifest["file_hashes"].get(abs_path)
+        if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+            return cached["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+
+        with self.lock:
+            self.manifest["file_hashes"][abs_path] = {
+                "size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha
+            }
+        return sha
+
+    def path_hash(self, path):
+        """文件或目录的内容哈希（目录按相对路径 + 文件哈希组合）"""
+        if not os.path.exists(path):
+            return None
+        digest = hashlib.sha256()
+        for f in iter_files(path):
+            digest.update(os.path.relpath(f, path).encode('utf-8'))
+            digest.update(self.file_hash(f).encode('utf-8'))
+        return digest.hexdigest()
+
+    def path_size(self, path):
+        return sum(os.path.getsize(f) for f in iter_files(path))
+
+    def stage_key(self, name, inputs, options, versions):
+        """阶段 key = 阶段名 + 输入内容哈希 + 选项 + 版本"""
+        payload = {
+            "stage": name,
+            "inputs": {p: self.path_hash(p) for p in inputs},
+            "options": options,
+            "versions": versions,
+        }
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest(), payload
+
+    def is_fresh(self, name, key):
+        """key 相同且所有输出都存在、内容未被改动"""
+        with self.lock:
+            entry = self.manifest["stages"].get(name)
+        if not entry or entry["key"] != key:
+            return False
+        for path, info in entry["outputs"].items():
+            if info["sha256"] is None or self.path_hash(path) != info["sha256"]:
+                return False
+        return True
+
+    def run_stage(self, name, fn, inputs=(), outputs=(), options=None, packages=()):
+        """
+        运行一个阶段；命中缓存时跳过 fn 并返回 None
+        fn 需要把产物写到 outputs 中声明的路径
+        """
+        versions = package_versions(packages)
+        key, provenance = self.stage_key(name, list(inputs), options or {}, versions)
+
+        if self.is_fresh(name, key):
+            print(f"⏭  [{name}] cached ({key[:12]})")
+            return None
+
+        # 其他阶段（可能在另一个线程中）已经超出内存预算时不再开始新阶段
+        check_memory_budget()
+        print(f"▶  [{name}] running ({key[:12]})")
+        start = time.time()
+        with memory_stage(name):
+            result = fn()
+        duration = time.time() - start
+
+        entry = {
+            "key": key,
+            "inputs": provenance["inputs"],
+            "options": provenance["options"],
+            "versions": versions,
+            "outputs": {
+                path: {
+                    "sha256": self.path_hash(path),
+                    "size": self.path_size(path) if os.path.exists(path) else None,
+                }
+                for path in outputs
+            },
+            "duration_s": round(duration, 3),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self.lock:
+            self.manifest["stages"][name] = entry
+        self.save()
+
+        print(f"✓  [{name}] done in {duration:.1f}s")
+        return result
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.manifest_path)
@@ -8,7 +8,11 @@ import json
 import torch
 import numpy as np
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from config import MODEL_CONFIG, PATH_CONFIG, EMOJI_LIST, ID_TO_EMOJI
+from config import MODEL_CONFIG, PATH_CONFIG, EXPORT_CONFIG, EMOJI_LIST, ID_TO_EMOJI
+from inference_utils import encode_texts, get_seq_buckets
+from export_cache import ExportCache
+from memory_profile import maybe_enable_memory_profile, memory_limited
+from tokenizer_bundle import write_bundle
 
 
 def export_to_onnx():
@@ -51,8 +55,8 @@ def export_to_onnx():
             input_names=['input_ids', 'attention_mask'],
             output_names=['logits'],
             dynamic_axes={
-                'input_ids': {0: 'batch_size'},
-                'attention_mask': {0: 'batch_size'},
+                'input_ids': {0: 'batch_size', 1: 'sequence_length'},
+                'attention_mask': {0: 'batch_size', 1: 'sequence_length'},
                 'logits': {0: 'batch_size'}
             }
         )
@@ -66,6 +70,16 @@ def export_to_onnx():
 def convert_to_coreml(onnx_path, quantize=True):
     """Step 2: 转换为 CoreML 格式并量化"""
     
+    fp16_path = convert_to_coreml_fp16(onnx_path)
+    if fp16_path is None or not quantize:
+        return fp16_path
+    
+    return quantize_coreml_int8(fp16_path) or fp16_path
+
+
+def convert_to_coreml_fp16(onnx_path):
+    """Step 2: 转换为 CoreML FP16 格式"""
+    
     try:
         import coremltools as ct
     except ImportError:
@@ -79,11 +93,23 @@ def convert_to_coreml(onnx_path, quantize=True):
     
     print(f"\nLoading ONNX model: {onnx_path}")
     
+    # 序列长度使用枚举形状（固定分桶），设备端按输入长度选择最小的桶
+    buckets = get_seq_buckets()
+    seq_shapes = ct.EnumeratedShapes(
+        shapes=[[1, b] for b in buckets],
+        default=[1, buckets[-1]]
+    )
+    print(f"Sequence buckets: {buckets}")
+    
     # 转换为 CoreML ML Program 格式 (iOS 15+)
     model = ct.convert(
         onnx_path,
         source='onnx',
         convert_to='mlprogram',
+        inputs=[
+            ct.TensorType(name='input_ids', shape=seq_shapes, dtype=np.int32),
+            ct.TensorType(name='attention_mask', shape=seq_shapes, dtype=np.int32),
+        ],
         minimum_deployment_target=ct.target.iOS15,
         compute_precision=ct.precision.FLOAT16,  # FP16 精度
     )
@@ -94,53 +120,51 @@ def convert_to_coreml(onnx_path, quantize=True):
     model.version = "1.0"
     
     # FP16 模型路径
-    fp16_path = "./output/emoji_model_fp16.mlpackage"
+    fp16_path = PATH_CONFIG['coreml_fp16_path']
     model.save(fp16_path)
     
     fp16_size = get_folder_size(fp16_path) / 1e6
     print(f"✓ FP16 model saved: {fp16_path}")
     print(f"  Size: {fp16_size:.2f} MB")
     
-    if quantize:
-        print("\n" + "="*60)
-        print("Step 3: Quantizing to INT8")
-        print("="*60)
-        
-        try:
-            # 使用 INT8 量化进一步压缩
-            from coremltools.models.neural_network import quantization_utils
-            
-            # 对于 mlprogram，使用 ct.compression
-            try:
-                # 新版 coremltools 6.0+ 的量化方式
-                op_config = ct.optimize.coreml.OpLinearQuantizerConfig(
-                    mode="linear_symmetric",
-                    weight_threshold=512,
-                )
-                config = ct.optimize.coreml.OptimizationConfig(global_config=op_config)
-                quantized_model = ct.optimize.coreml.linear_quantize_weights(model, config=config)
-                
-                int8_path = "./output/emoji_model_int8.mlpackage"
-                quantized_model.save(int8_path)
-                
-                int8_size = get_folder_size(int8_path) / 1e6
-                print(f"✓ INT8 model saved: {int8_path}")
-                print(f"  Size: {int8_size:.2f} MB")
-                print(f"  Compression ratio: {fp16_size/int8_size:.1f}x")
-                
-                return int8_path
-            except Exception as e:
-                print(f"INT8 quantization failed: {e}")
-                print("Using FP16 model instead.")
-                return fp16_path
-                
-        except Exception as e:
-            print(f"Quantization error: {e}")
-            return fp16_path
-    
     return fp16_path
 
 
+def quantize_coreml_int8(fp16_path):
+    """Step 3: 将 FP16 CoreML 模型的权重量化为 INT8"""
+    
+    import coremltools as ct
+    
+    print("\n" + "="*60)
+    print("Step 3: Quantizing to INT8")
+    print("="*60)
+    
+    try:
+        # 新版 coremltools 6.0+ 的量化方式
+        model = ct.models.MLModel(fp16_path)
+        op_config = ct.optimize.coreml.OpLinearQuantizerConfig(
+            mode="linear_symmetric",
+            weight_threshold=512,
+        )
+        config = ct.optimize.coreml.OptimizationConfig(global_config=op_config)
+        quantized_model = ct.optimize.coreml.linear_quantize_weights(model, config=config)
+        
+        int8_path = PATH_CONFIG['coreml_int8_path']
+        quantized_model.save(int8_path)
+        
+        fp16_size = get_folder_size(fp16_path) / 1e6
+        int8_size = get_folder_size(int8_path) / 1e6
+        print(f"✓ INT8 model saved: {int8_path}")
+        print(f"  Size: {int8_size:.2f} MB")
+        print(f"  Compression ratio: {fp16_size/int8_size:.1f}x")
+        
+        return int8_path
+    except Exception as e:
+        print(f"INT8 quantization failed: {e}")
+        print("Using FP16 model instead.")
+        return None
+
+
 def get_folder_size(path):
     """获取文件夹大小"""
     total_size = 0
@@ -179,6 +203,7 @@ def save_tokenizer_config(tokenizer, output_dir="./output"):
     config = {
         "model_name": MODEL_CONFIG['model_name'],
         "max_length": MODEL_CONFIG['max_length'],
+        "seq_buckets": get_seq_buckets(),
         "num_labels": MODEL_CONFIG['num_labels'],
         "emoji_list": EMOJI_LIST,
     }
@@ -186,6 +211,11 @@ def save_tokenizer_config(tokenizer, output_dir="./output"):
     with open(config_path, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=2)
     print(f"✓ Config saved: {config_path}")
+    
+    # 二进制 bundle：以上三个文件中设备端需要的部分，可直接内存映射（格式见 tokenizer_bundle.py）
+    bundle_path = os.path.join(output_dir, "tokenizer.emtk")
+    size = write_bundle(bundle_path, vocab_path)
+    print(f"✓ Tokenizer bundle saved: {bundle_path} ({size / 1024:.1f} KB)")
 
 
 def test_onnx_model(onnx_path):
@@ -214,13 +244,8 @@ def test_onnx_model(onnx_path):
     
     print("\nTest predictions:")
     for text in test_texts:
-        inputs = tokenizer(
-            text,
-            padding='max_length',
-            truncation=True,
-            max_length=MODEL_CONFIG['max_length'],
-            return_tensors='np'
-        )
+        # 按分桶长度补齐（动态序列轴）
+        inputs = encode_texts(tokenizer, text, return_tensors='np')
         
         outputs = session.run(
             None,
@@ -237,8 +262,99 @@ def test_onnx_model(onnx_path):
         print(f"  {text} → {pred_emoji}")
 
 
+def run_pipeline(cache):
+    """
+    按依赖关系运行各导出阶段，每个阶段都经过缓存
+    
+    tokenizer_config ─────────────────────────────┐
+    onnx_export ─┬─ onnx_test                     ├─ 完成
+                 ├─ onnx_optimize                 │
+                 └─ coreml_fp16 ─── coreml_int8 ──┘
+    
+    并行度由 EXPORT_CONFIG['max_workers'] 控制；内存剖析/预算模式下 CoreML 链
+    （内存峰值最高）在其他阶段完成后串行执行，避免峰值叠加、各阶段的 RSS 互相干扰
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    
+    model_path = PATH_CONFIG['model_save_path']
+    onnx_path = PATH_CONFIG['onnx_path']
+    output_dir = PATH_CONFIG['output_dir']
+    serial_coreml = memory_limited()
+    
+    tokenizer_outputs = [
+        os.path.join(output_dir, name) for name in ("vocab.txt", "emoji_map.json", "model_config.json", "tokenizer.emtk")
+    ]
+    
+    def coreml_chain():
+        cache.run_stage(
+            "coreml_fp16", lambda: convert_to_coreml_fp16(onnx_path),
+            inputs=[onnx_path], outputs=[PATH_CONFIG['coreml_fp16_path']],
+            options={"seq_buckets": get_seq_buckets(), "target": "iOS15"},
+            packages=["coremltools"],
+        )
+        if not os.path.exists(PATH_CONFIG['coreml_fp16_path']):
+            return
+        cache.run_stage(
+            "coreml_int8", lambda: quantize_coreml_int8(PATH_CONFIG['coreml_fp16_path']),
+            inputs=[PATH_CONFIG['coreml_fp16_path']], outputs=[PATH_CONFIG['coreml_int8_path']],
+            options={"mode": "linear_symmetric", "weight_threshold": 512},
+            packages=["coremltools"],
+        )
+    
+    with ThreadPoolExecutor(max_workers=EXPORT_CONFIG['max_workers']) as pool:
+        # tokenizer 配置只依赖模型目录中的 tokenizer 文件和 config，与 ONNX 导出并行
+        tokenizer_future = pool.submit(
+            cache.run_stage,
+            "tokenizer_config",
+            lambda: save_tokenizer_config(AutoTokenizer.from_pretrained(model_path), output_dir),
+            inputs=[os.path.join(model_path, f) for f in ("vocab.txt", "tokenizer_config.json")],
+            outputs=tokenizer_outputs,
+            options={
+                "model_name": MODEL_CONFIG['model_name'],
+                "max_length": MODEL_CONFIG['max_length'],
+                "seq_buckets": get_seq_buckets(),
+                "emoji_list": EMOJI_LIST,
+            },
+        )
+        
+        cache.run_stage(
+            "onnx_export", export_to_onnx,
+            inputs=[model_path], outputs=[onnx_path],
+            options={"max_length": MODEL_CONFIG['max_length'], "opset": 14},
+            packages=["torch", "transformers"],
+        )
+        
+        # 以下阶段都只依赖导出的 ONNX，互不依赖，并行执行
+        futures = [
+            pool.submit(
+                cache.run_stage, "onnx_test", lambda: test_onnx_model(onnx_path),
+                inputs=[onnx_path, model_path], packages=["onnxruntime"],
+            ),
+        ]
+        if not serial_coreml:
+            futures.append(pool.submit(coreml_chain))
+        if EXPORT_CONFIG['optimize_onnx']:
+            from onnx_optimize import optimize_and_report, resolve_fp16
+            # 按实际生效的取值作为缓存键，"auto" 在有无 CUDA 的机器上结果不同
+            fp16 = resolve_fp16(EXPORT_CONFIG['onnx_fp16'])
+            futures.append(pool.submit(
+                cache.run_stage, "onnx_optimize", lambda: optimize_and_report(onnx_path),
+                inputs=[onnx_path, PATH_CONFIG['val_file']],
+                outputs=[PATH_CONFIG['onnx_optimized_path'], PATH_CONFIG['onnx_optimize_report']],
+                options={"fp16": fp16},
+                packages=["onnxruntime", "onnx"],
+            ))
+        
+        for future in [tokenizer_future] + futures:
+            future.result()
+    
+    if serial_coreml:
+        coreml_chain()
+
+
 def main():
     """主函数"""
+    maybe_enable_memory_profile()
     
     print("\n" + "="*60)
     print("🚀 Emotion Model Export Pipeline for iOS")
@@ -247,29 +363,26 @@ def main():
     print(f"Labels: {len(EMOJI_LIST)} emojis")
     print(f"Emojis: {''.join(EMOJI_LIST)}")
     
-    # Step 1: 导出 ONNX
-    onnx_path, tokenizer = export_to_onnx()
-    
-    # 测试 ONNX
-    test_onnx_model(onnx_path)
-    
-    # Step 2: 转换为 CoreML（量化）
-    coreml_path = convert_to_coreml(onnx_path, quantize=True)
-    
-    # 保存 tokenizer 配置
-    save_tokenizer_config(tokenizer)
+    # 各阶段按输入哈希缓存，未变化的阶段直接复用上次的产物
+    cache = ExportCache()
+    run_pipeline(cache)
     
     # 总结
     print("\n" + "="*60)
     print("✅ Export Complete!")
     print("="*60)
     print("\nOutput files:")
-    print(f"  ONNX:    {onnx_path}")
-    if coreml_path:
-        print(f"  CoreML:  {coreml_path}")
+    print(f"  ONNX:    {PATH_CONFIG['onnx_path']}")
+    if os.path.exists(PATH_CONFIG['onnx_optimized_path']):
+        print(f"  ONNX (optimized): {PATH_CONFIG['onnx_optimized_path']}")
+    for coreml_path in (PATH_CONFIG['coreml_int8_path'], PATH_CONFIG['coreml_fp16_path']):
+        if os.path.exists(coreml_path):
+            print(f"  CoreML:  {coreml_path}")
+            break
     print(f"  Config:  ./output/model_config.json")
     print(f"  Vocab:   ./output/vocab.txt")
     print(f"  Emoji:   ./output/emoji_map.json")
+    print(f"  Manifest: {cache.manifest_path}")
     print("\n📱 iOS Integration:")
     print("  1. 将 .mlpackage 拖入 Xcode 项目")
     print("  2. 使用 BertTokenizer 对输入文本进行分词")
@@ -7,7 +7,8 @@ import os
 import torch
 import numpy as np
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
-from config import MODEL_CONFIG, PATH_CONFIG, EMOJI_LIST, ID_TO_EMOJI
+from config import MODEL_CONFIG, PATH_CONFIG, EXPORT_CONFIG, EMOJI_LIST, ID_TO_EMOJI
+from inference_utils import encode_texts, softmax
 
 
 def export_to_onnx():
@@ -54,8 +55,8 @@ def export_to_onnx():
             input_names=['input_ids', 'attention_mask'],
             output_names=['logits'],
             dynamic_axes={
-                'input_ids': {0: 'batch_size'},
-                'attention_mask': {0: 'batch_size'},
+                'input_ids': {0: 'batch_size', 1: 'sequence_length'},
+                'attention_mask': {0: 'batch_size', 1: 'sequence_length'},
                 'logits': {0: 'batch_size'}
             }
         )
@@ -100,13 +101,8 @@ def verify_onnx(onnx_path):
     
     print("\nTest inference:")
     for text in test_texts:
-        inputs = tokenizer(
-            text,
-            padding='max_length',
-            truncation=True,
-            max_length=MODEL_CONFIG['max_length'],
-            return_tensors='np'
-        )
+        # 按分桶长度补齐（动态序列轴）
+        inputs = encode_texts(tokenizer, text, return_tensors='np')
         
         outputs = session.run(
             None,
@@ -117,8 +113,8 @@ def verify_onnx(onnx_path):
         )
         
         logits = outputs[0]
-        # 使用sigmoid获取概率
-        probs = 1 / (1 + np.exp(-logits))
+        # 模型以交叉熵（softmax）训练，使用softmax获取概率
+        probs = softmax(logits)
         pred_class = np.argmax(probs, axis=1)[0]
         confidence = probs[0][pred_class]
         
@@ -129,5 +125,14 @@ def verify_onnx(onnx_path):
     print("\n✓ ONNX model inference verified!")
 
 
+def main():
+    """导出 ONNX 并生成融合优化后的模型"""
+    onnx_path = export_to_onnx()
+    
+    if EXPORT_CONFIG['optimize_onnx']:
+        from onnx_optimize import optimize_and_report
+        optimize_and_report(onnx_path)
+
+
 if __name__ == "__main__":
-    export_to_onnx()
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+快速冷启动预测器
+- 延迟导入：torch / transformers 只在真正需要时导入，且只导入 BERT 分类模型本身
+- 权重零拷贝：从 model.safetensors 内存映射加载（见 safetensors_mmap.py），跳过随机初始化
+- 分词使用 tokenizers（Rust）直接读取 tokenizer.json，不经过 AutoTokenizer
+- 后台预热：模型加载后在后台线程对每个分桶长度跑一次推理
+- 打印各启动阶段耗时
+
+用法:
+    python fast_predictor.py              # 启动实时预测（与 test_realtime.py 相同的交互）
+    python fast_predictor.py --startup    # 只测量启动耗时并退出
+"""
+
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from config import PATH_CONFIG
+from inference_utils import BucketedTokenizer, get_seq_buckets, softmax
+
+# 权重文件中允许缺失的键：非持久缓冲区，加载后按固定规则重建
+NON_PERSISTENT_BUFFERS = ("embeddings.position_ids", "embeddings.token_type_ids")
+
+class StartupTimer:
+    """记录启动各阶段耗时"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, (time.perf_counter() - start) * 1000))
+
+    def report(self):
+        print("Startup breakdown:")
+        for name, ms in self.phases:
+            print(f"  {name:<22}{ms:>9.1f} ms")
+        print(f"  {'total':<22}{(time.perf_counter() - self.origin) * 1000:>9.1f} ms")
+
+
+class FastEmotionModel:
+    """
+    启动优化的推理模型
+    与其他推理后端一致的接口：encode(texts) / forward(inputs) / predict_proba(texts)
+    """
+
+    def __init__(self, model_path=None, num_threads=None, warmup=True):
+        self.model_path = model_path or PATH_CONFIG['model_save_path']
+        self.buckets = get_seq_buckets()
+        self.timer = StartupTimer()
+        self.ready = threading.Event()
+
+        with self.timer.phase("import torch"):
+            import torch
+            self.torch = torch
+            if num_threads:
+                torch.set_num_threads(num_threads)
+
+        with self.timer.phase("load tokenizer"):
+            self.tokenizer = self._load_tokenizer()
+
+        self.model = self._load_model()
+
+        if warmup:
+            threading.Thread(target=self._warmup, daemon=True).start()
+        else:
+            self.ready.set()
+
+    def _load_tokenizer(self):
+        """直接用 tokenizers 读取 tokenizer.json，不经过 transformers"""
+        return BucketedTokenizer(self.model_path, self.buckets)
+
+    def _load_model(self):
+        """跳过随机初始化构建模型，再把内存映射的权重直接挂上去"""
+        from safetensors_mmap import find_weights_file, load_torch_mmap
+
+        with self.timer.phase("import transformers"):
+            from transformers import BertConfig
+            from transformers.models.bert.modeling_bert import BertForSequenceClassification
+
+        weights_file = find_weights_file(self.model_path)
+        if weights_file is None:
+            # 旧格式 (pytorch_model.bin) 无法内存映射，走常规加载
+            print("⚠️ model.safetensors not found, falling back to from_pretrained")
+            with self.timer.phase("from_pretrained"):
+                model = BertForSequenceClassification.from_pretrained(self.model_path)
+                model.eval()
+            return model
+
+        with self.timer.phase("build model"):
+            config = BertConfig.from_pretrained(self.model_path)
+            # 在 meta 设备上构建：不分配内存也不做随机初始化，不依赖各版本 transformers 的内部接口
+            with self.torch.device("meta"):
+                model = BertForSequenceClassification(config)
+
+        with self.timer.phase("mmap weights"):
+            state_dict = load_torch_mmap(weights_file)
+
+        with self.timer.phase("assign weights"):
+            # assign=True 直接使用映射的张量作为参数，不复制
+            result = model.load_state_dict(state_dict, strict=False, assign=True)
+            model.eval()
+        missing = [k for k in result.missing_keys if not k.endswith(NON_PERSISTENT_BUFFERS)]
+        if missing:
+            raise RuntimeError(f"Missing weights in {weights_file}: {missing}")
+        self._materialize_buffers(model, config)
+
+        return model
+
+    def _materialize_buffers(self, model, config):
+        """不在权重文件中的缓冲区（position_ids 等）仍在 meta 上，按 transformers 的初始化方式重建"""
+        torch = self.torch
+        position_ids = torch.arange(config.max_position_embeddings).expand((1, -1))
+        for name, buffer in list(model.named_buffers()):
+            if not buffer.is_meta:
+                continue
+            if name.endswith("position_ids"):
+                value = position_ids
+            elif name.endswith("token_type_ids"):
+                value = torch.zeros(position_ids.size(), dtype=torch.long)
+            else:
+                raise RuntimeError(f"Cannot materialize buffer on meta device: {name}")
+            module_name, _, buffer_name = name.rpartition(".")
+            module = model.get_submodule(module_name)
+            module.register_buffer(buffer_name, value, persistent=buffer_name in module.state_dict())
+
+    def _warmup(self):
+        """对每个分桶长度跑一次推理，触发权重分页加载和算子初始化"""
+        start = time.perf_counter()
+        try:
+            for bucket in self.buckets:
+                self.forward({
+                    'input_ids': np.full((1, bucket), 100, dtype=np.int64),
+                    'attention_mask': np.ones((1, bucket), dtype=np.int64),
+                })
+        except Exception as e:
+            print(f"⚠️ Background warmup failed: {e}")
+        finally:
+            # 预热失败也要放行等待者，真正的错误会在下一次预测时抛出
+            self.warmup_ms = (time.perf_counter() - start) * 1000
+            self.ready.set()
+
+    def encode(self, texts):
+        """分词并补齐到能容纳最长文本的最小分桶"""
+        return self.tokenizer.encode(texts)
+
+    def forward(self, inputs):
+        """返回 logits (numpy)；inference_mode 只作用于当前调用，任何线程调用都不构建计算图"""
+        with self.torch.inference_mode():
+            outputs = self.model(
+                input_ids=self.torch.from_numpy(inputs['input_ids']),
+                attention_mask=self.torch.from_numpy(inputs['attention_mask'])
+            )
+            return outputs.logits.numpy()
+
+    def predict_proba(self, texts):
+        return softmax(self.forward(self.encode(texts)))
+
+    def startup_report(self, wait_warmup=True):
+        """打印启动耗时；wait_warmup 时等待后台预热结束并一并报告"""
+        self.timer.report()
+        if wait_warmup:
+            self.ready.wait()
+            print(f"  {'warmup (background)':<22}{self.warmup_ms:>9.1f} ms")
+
+
+def main():
+    timer_start = time.perf_counter()
+    model = FastEmotionModel()
+
+    # 首次预测（不等后台预热结束）
+    start = time.perf_counter()
+    model.predict_proba("今天真的太开心了")
+    first_ms = (time.perf_counter() - start) * 1000
+
+    print("="*50)
+    model.startup_report(wait_warmup="--startup" in sys.argv)
+    print(f"  {'first prediction':<22}{first_ms:>9.1f} ms")
+    print(f"  {'launch → first pred':<22}{(time.perf_counter() - timer_start) * 1000:>9.1f} ms")
+    print("="*50)
+
+    if "--startup" in sys.argv:
+        return
+
+    from test_realtime import RealtimeEmotionPredictor
+    RealtimeEmotionPredictor(model=model).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+模型热更新
+ReloadableModel 包装任意推理后端（encode / forward / predict_proba），可以在不重启预测器的情况下换模型：
+1. 检查新模型与当前 emoji 映射一致（标签数、模型目录中的 emoji_map.json、位置编码长度）
+2. 后台加载新模型，在每个分桶长度、每个预热 batch 大小上各跑一次推理，并检查输出形状和数值
+3. 原子地切换引用，新请求立即使用新模型
+4. 等待旧模型上进行中的请求结束后再释放旧模型
+
+触发方式：ModelWatcher 轮询模型目录，或调用 reload() / reload_async()
+（test_realtime.py 中输入 reload，predict_server.py 中发送 {"op": "reload"}）
+
+用法:
+    python hot_reload.py                  # 在非主线程上热更新默认后端，并检查期间的请求不出错
+    python hot_reload.py --backend numpy
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from config import RELOAD_CONFIG, SERVER_CONFIG
+from inference_utils import get_seq_buckets
+
+
+EMOJI_MAP_PATH = "./output/emoji_map.json"
+
+
+def load_emoji_map(path=EMOJI_MAP_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def check_model_consistency(model_path, emoji_map):
+    """切换前的一致性检查，不通过时抛出 ValueError"""
+    if not os.path.exists(model_path):
+        raise ValueError(f"Model path not found: {model_path}")
+    if not os.path.isdir(model_path):
+        # ONNX 等单文件模型没有 config.json，只在预热时检查输出形状
+        return
+
+    config_path = os.path.join(model_path, "config.json")
+    if not os.path.exists(config_path):
+        raise ValueError(f"config.json not found in {model_path}")
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    num_labels = len(config['id2label']) if 'id2label' in config else config.get('num_labels')
+    if num_labels != len(emoji_map):
+        raise ValueError(f"Model has {num_labels} labels but emoji map has {len(emoji_map)}")
+
+    model_map_path = os.path.join(model_path, "emoji_map.json")
+    if os.path.exists(model_map_path) and load_emoji_map(model_map_path) != emoji_map:
+        raise ValueError(f"{model_map_path} differs from the emoji map in use")
+
+    max_positions = config.get('max_position_embeddings')
+    if max_positions and max_positions < get_seq_buckets()[-1]:
+        raise ValueError(f"max_position_embeddings {max_positions} < largest bucket {get_seq_buckets()[-1]}")
+
+
+def warmup_model(model, num_labels, batch_sizes=None):
+    """在每个分桶长度上预热，并检查输出；返回耗时（毫秒）"""
+    start = time.perf_counter()
+    for bucket in get_seq_buckets():
+        # 中文按字切分，bucket - 2 个字加上 [CLS]/[SEP] 正好填满该分桶
+        text = "好" * (bucket - 2)
+        for batch_size in batch_sizes or RELOAD_CONFIG['warmup_batch_sizes']:
+            probs = np.asarray(model.predict_proba([text] * batch_size))
+            if probs.shape != (batch_size, num_labels):
+                raise ValueError(f"Unexpected output shape {probs.shape}, expected {(batch_size, num_labels)}")
+            if not np.isfinite(probs).all():
+                raise ValueError(f"Non-finite output at sequence length {bucket}")
+    return (time.perf_counter() - start) * 1000
+
+
+class ModelHandle:
+    """一个已加载的模型及其进行中的请求数"""
+
+    def __init__(self, model, model_path, generation):
+        self.model = model
+        self.model_path = model_path
+        self.generation = generation
+        self.inflight = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def use(self):
+        with self.cond:
+            self.inflight += 1
+        try:
+            yield self.model
+        finally:
+            with self.cond:
+                self.inflight -= 1
+                if self.inflight == 0:
+                    self.cond.notify_all()
+
+    def drain(self, timeout):
+        """等待进行中的请求结束，返回是否在超时前排空"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.inflight == 0, timeout)
+
+
+class ReloadableModel:
+    """可热更新的推理后端，接口与被包装的后端相同"""
+
+    def __init__(self, loader, model_path, emoji_map=None):
+        """loader: loader(model_path) -> 推理后端"""
+        self.loader = loader
+        self.emoji_map = emoji_map or load_emoji_map()
+        self._reload_lock = threading.Lock()
+        self.last_reload = None
+
+        check_model_consistency(model_path, self.emoji_map)
+        self.current = ModelHandle(loader(model_path), model_path, generation=1)
+
+    @property
+    def model_path(self):
+        return self.current.model_path
+
+    @property
+    def generation(self):
+        """每次切换加一（调用方据此失效自己的结果缓存）"""
+        return self.current.generation
+
+    def encode(self, texts):
+        # 记下分词用的模型，forward 时使用同一个（切换发生在两步之间时不会混用）
+        handle = self.current
+        inputs = dict(handle.model.encode(texts))
+        inputs['_handle'] = handle
+        return inputs
+
+    def forward(self, inputs):
+        handle = inputs.pop('_handle', None) or self.current
+        with handle.use() as model:
+            return model.forward(inputs)
+
+    def predict_proba(self, texts):
+        with self.current.use() as model:
+            return model.predict_proba(texts)
+
+    def reload(self, model_path=None):
+        """加载、预热并切换到新模型；失败时保留当前模型并抛出异常。返回切换报告"""
+        with self._reload_lock:
+            model_path = model_path or self.current.model_path
+            check_model_consistency(model_path, self.emoji_map)
+
+            start = time.perf_counter()
+            model = self.loader(model_path)
+            load_ms = (time.perf_counter() - start) * 1000
+            warmup_ms = warmup_model(model, len(self.emoji_map))
+
+            old = self.current
+            self.current = ModelHandle(model, model_path, old.generation + 1)
+
+            start = time.perf_counter()
+            drained = old.drain(RELOAD_CONFIG['drain_timeout'])
+            self.last_reload = {
+                "generation": self.current.generation,
+                "model_path": model_path,
+                "load_ms": load_ms,
+                "warmup_ms": warmup_ms,
+                "drain_ms": (time.perf_counter() - start) * 1000,
+                "drained": drained,
+            }
+            return self.last_reload
+
+    def reload_async(self, model_path=None, callback=None):
+        """后台线程中 reload；callback(report, error) 在结束时调用"""
+        def run():
+            try:
+                report, error = self.reload(model_path), None
+            except Exception as e:
+                report, error = None, e
+            if callback:
+                callback(report, error)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval=None, callback=None):
+        watcher = ModelWatcher(self, interval, callback)
+        watcher.start()
+        return watcher
+
+
+def path_signature(path):
+    """模型目录（或文件）的内容签名：文件名、大小、修改时间"""
+    if not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return ((os.path.basename(path), stat.st_size, stat.st_mtime_ns),)
+    entries = []
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            stat = os.stat(full)
+            entries.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(entries)
+
+
+class ModelWatcher:
+    """轮询当前模型路径，内容变化且连续两次轮询不变（写入完成）后触发热更新"""
+
+    def __init__(self, reloadable, interval=None, callback=None):
+        self.reloadable = reloadable
+        self.interval = interval or RELOAD_CONFIG['watch_interval']
+        self.callback = callback
+        self.stop_event = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self):
+        loaded = path_signature(self.reloadable.model_path)
+        pending = None
+        while not self.stop_event.wait(self.interval):
+            signature = path_signature(self.reloadable.model_path)
+            if signature is None or signature == loaded:
+                pending = None
+                continue
+            if signature != pending:
+                # 刚发生变化，等下一次轮询确认写入已完成
+                pending = signature
+                continue
+            try:
+                report, error = self.reloadable.reload(), None
+            except Exception as e:
+                report, error = None, e
+            # 失败时也记录签名，避免对同一份坏模型反复重试
+            loaded, pending = signature, None
+            if self.callback:
+                self.callback(report, error)
+
+
+def verify_hot_reload(backend=None):
+    """
+    与服务端相同的调用方式：reload_async（相当于处理 {"op": "reload"} 的线程）和 ModelWatcher
+    各触发一次热更新，同时另一个线程持续预测，检查两次切换都成功且期间没有请求出错
+    """
+    from inference_utils import backend_model_path, load_backend
+
+    backend = backend or SERVER_CONFIG['backend']
+    model_path = backend_model_path(backend)
+    print("="*60)
+    print(f"Verifying hot reload ({backend}, {model_path})")
+    print("="*60)
+
+    model = ReloadableModel(lambda path: load_backend(backend, model_path=path, warmup=False), model_path)
+    stop = threading.Event()
+    client = {"requests": 0, "errors": []}
+
+    def predict_loop():
+        while not stop.is_set():
+            try:
+                model.predict_proba(["今天真的太开心了", "好"])
+                client["requests"] += 1
+            except Exception as e:
+                client["errors"].append(f"{type(e).__name__}: {e}")
+
+    client_thread = threading.Thread(target=predict_loop, daemon=True)
+    client_thread.start()
+    ok = True
+
+    def wait_for(name, trigger):
+        nonlocal ok
+        done = threading.Event()
+        outcome = {}
+
+        def callback(report, error):
+            outcome.update(report=report, error=error)
+            done.set()
+
+        generation = model.generation
+        trigger(callback)
+        if not done.wait(120):
+            outcome["error"] = "timed out"
+        error = outcome.get("error")
+        passed = error is None and model.generation == generation + 1
+        ok &= passed
+        if passed:
+            report = outcome["report"]
+            print(f"✓ {name}: generation {report['generation']}, load {report['load_ms']:.0f} ms, "
+                  f"warmup {report['warmup_ms']:.0f} ms, drained {report['drained']}")
+        else:
+            print(f"✗ {name}: {error}")
+
+    wait_for("reload_async", lambda callback: model.reload_async(callback=callback))
+
+    watchers = []
+
+    def touch_model(callback):
+        watchers.append(model.watch(interval=0.2, callback=callback))
+        time.sleep(0.5)
+        os.utime(os.path.join(model_path, "config.json") if os.path.isdir(model_path) else model_path)
+
+    wait_for("ModelWatcher", touch_model)
+    for watcher in watchers:
+        watcher.stop()
+    stop.set()
+    client_thread.join()
+
+    ok &= not client["errors"]
+    if client["errors"]:
+        print(f"✗ {len(client['errors'])} of {client['requests'] + len(client['errors'])} concurrent requests failed "
+              f"(first: {client['errors'][0]})")
+    else:
+        print(f"✓ {client['requests']} concurrent requests during reloads, no errors")
+
+    print("✓ Hot reload verified" if ok else "✗ Hot reload failed")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+    from inference_utils import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Hot reload self-check")
+    parser.add_argument("--backend", choices=BACKENDS, default=SERVER_CONFIG['backend'])
+    sys.exit(0 if verify_hot_reload(parser.parse_args().backend) else 1)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+增量微调：新标注的数据到来时，从当前的 output/emoji_model 继续训练，而不是从预训练模型重跑全量
+- 新数据先去重：与验证集重复的（泄漏）、新数据内部重复的、以及已经训练过的（规范化文本相同）都跳过
+- 训练集 = 新数据 + 从旧数据（train.json 和之前消费过的增量数据）中按类别抽样的回放数据
+- 防遗忘：训练前后在验证集上按 emoji 统计准确率，整体或任一 emoji 的准确率下降超过阈值时不更新模型
+- 只有被接受的更新才会把新数据记为已消费（consumed.jsonl），被拒绝的数据下次可以重试
+- 模型以原子替换的方式保存，运行中的服务可以直接热更新（见 hot_reload.py）
+
+新数据文件的格式与 train.json 相同：[{"text": "...", "emojis": ["😂"]}, ...]
+
+用法:
+    python incremental_train.py dataset/new_messages.json [more.json ...]
+    python incremental_train.py new.json --epochs 3 --replay-ratio 3
+    python incremental_train.py new.json --force          # 忽略防遗忘检查
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+from config import MODEL_CONFIG, TRAINING_CONFIG, PATH_CONFIG, INCREMENTAL_CONFIG, ID_TO_EMOJI, EMOJI_LIST
+from data_processing import load_json_data, convert_data_to_single_label, load_split, deduplicate, normalize_text
+
+
+def text_key(text):
+    """已消费数据的 key：规范化文本的哈希（与去重使用相同的规范化）"""
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=8).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Ledger:
+    """
+    已消费数据的记录（work_dir 中）：
+        consumed.jsonl  每条已训练过的增量样本 {"key", "text", "label", "run"}（也作为之后的回放数据）
+        history.json    每次运行的记录（输入文件、样本数、耗时、验证结果、是否接受）
+    """
+
+    def __init__(self, work_dir=None):
+        self.work_dir = work_dir or INCREMENTAL_CONFIG['work_dir']
+        self.consumed_path = os.path.join(self.work_dir, "consumed.jsonl")
+        self.history_path = os.path.join(self.work_dir, "history.json")
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        self.consumed = []
+        if os.path.exists(self.consumed_path):
+            with open(self.consumed_path, 'r', encoding='utf-8') as f:
+                self.consumed = [json.loads(line) for line in f if line.strip()]
+        self.keys = {item['key'] for item in self.consumed}
+
+        self.history = []
+        if os.path.exists(self.history_path):
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                self.history = json.load(f)
+
+    def record(self, run, samples):
+        """追加一次运行；samples 非空时记为已消费"""
+        with open(self.consumed_path, 'a', encoding='utf-8') as f:
+            for item in samples:
+                entry = {"key": text_key(item['text']), "text": item['text'], "label": item['label'], "run": run['id']}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self.keys.add(entry['key'])
+        self.history.append(run)
+        tmp_path = self.history_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.history, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.history_path)
+
+
+def select_new_samples(paths, val_data, ledger, base_keys):
+    """读取新数据并过滤，返回 (新样本, 统计)"""
+    raw = []
+    for path in paths:
+        raw.extend(convert_data_to_single_label(load_json_data(path)))
+
+    # 新数据内部去重，并去掉与验证集重复的（否则验证结果不可信）
+    new_data, _, report = deduplicate(raw, val_data)
+    seen = ledger.keys | base_keys
+    fresh = [item for item in new_data if text_key(item['text']) not in seen]
+    stats = {
+        "input": len(raw),
+        "duplicates": report['train']['exact'] + report['train']['near'],
+        "val_leaks": report['train']['leak_exact'] + report['train']['leak_near'],
+        "already_consumed": len(new_data) - len(fresh),
+        "new": len(fresh),
+    }
+    return fresh, stats
+
+
+def sample_replay(old_data, size, min_per_class, rng):
+    """从旧数据中抽样回放：每个 emoji 至少 min_per_class 条（不足时全取），其余按原分布随机抽取"""
+    by_label = {}
+    for i, item in enumerate(old_data):
+        by_label.setdefault(item['label'], []).append(i)
+
+    chosen = set()
+    for indices in by_label.values():
+        take = min(len(indices), min_per_class)
+        chosen.update(rng.choice(indices, take, replace=False).tolist())
+    remaining = np.array([i for i in range(len(old_data)) if i not in chosen])
+    extra = max(0, min(size - len(chosen), len(remaining)))
+    if extra:
+        chosen.update(rng.choice(remaining, extra, replace=False).tolist())
+    return [old_data[i] for i in sorted(chosen)]
+
+
+def per_class_accuracy(preds, labels):
+    preds, labels = np.asarray(preds), np.asarray(labels)
+    result = {}
+    for label in np.unique(labels):
+        mask = labels == label
+        result[int(label)] = {"accuracy": float((preds[mask] == label).mean()), "support": int(mask.sum())}
+    return result
+
+
+def forgetting_check(before, after, config):
+    """返回违反的项（为空则通过）"""
+    problems = []
+    drop = before['accuracy'] - after['accuracy']
+    if drop > config['max_accuracy_drop']:
+        problems.append(f"overall accuracy {before['accuracy']:.4f} -> {after['accuracy']:.4f}")
+    for label, stats in before['per_class'].items():
+        if stats['support'] < config['min_class_support']:
+            continue
+        now = after['per_class'][label]['accuracy']
+        if stats['accuracy'] - now > config['max_class_drop']:
+            problems.append(f"{ID_TO_EMOJI[label]} accuracy {stats['accuracy']:.3f} -> {now:.3f} "
+                            f"(support {stats['support']})")
+    return problems
+
+
+def validate(model, val_loader, device, desc):
+    from train import evaluate
+
+    loss, accuracy, f1, preds, labels, _ = evaluate(model, val_loader, device, desc)
+    return {"loss": loss, "accuracy": accuracy, "f1": f1, "per_class": per_class_accuracy(preds, labels)}
+
+
+def print_class_table(before, after):
+    print(f"{'emoji':<7}{'support':>8}{'before':>9}{'after':>9}{'Δ':>8}")
+    for label, stats in sorted(before['per_class'].items()):
+        now = after['per_class'][label]['accuracy']
+        print(f"{EMOJI_LIST[label]:<7}{stats['support']:>8}{stats['accuracy']:>9.3f}{now:>9.3f}"
+              f"{now - stats['accuracy']:>+8.3f}")
+
+
+def incremental_train(paths, epochs, learning_rate, replay_ratio, force=False):
+    from torch.optim import AdamW
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, get_linear_schedule_with_warmup
+    from data_processing import EmojiDataset, create_dataloaders
+    from train import setup_device, train_epoch, save_model
+
+    config = INCREMENTAL_CONFIG
+    rng = np.random.RandomState(config['seed'])
+    model_path = PATH_CONFIG['model_save_path']
+    if not os.path.exists(model_path):
+        print(f"✗ No trained model at {model_path}, run train.py first")
+        return False
+
+    start = time.perf_counter()
+    ledger = Ledger()
+    val_data = load_split(PATH_CONFIG['val_file'])
+    base_data = load_split(PATH_CONFIG['train_file'])
+    base_keys = {text_key(item['text']) for item in base_data}
+
+    new_data, stats = select_new_samples(paths, val_data, ledger, base_keys)
+    print(f"New data: {stats['input']} samples -> {stats['new']} to train on "
+          f"(duplicates {stats['duplicates']}, val leaks {stats['val_leaks']}, "
+          f"already consumed {stats['already_consumed']})")
+    if not new_data:
+        print("✓ Nothing new to train on")
+        return True
+
+    old_data = base_data + [{"text": c['text'], "label": c['label']} for c in ledger.consumed]
+    replay = sample_replay(old_data, int(len(new_data) * replay_ratio), config['min_replay_per_class'], rng)
+    train_data = new_data + replay
+    print(f"Training set: {len(new_data)} new + {len(replay)} replay (from {len(old_data)} old samples)")
+
+    device = setup_device()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+    def dataset(items):
+        encodings = tokenizer([item['text'] for item in items], padding='max_length', truncation=True,
+                              max_length=MODEL_CONFIG['max_length'])
+        return EmojiDataset(encodings, [item['label'] for item in items])
+
+    train_loader, val_loader = create_dataloaders(dataset(train_data), dataset(val_data), device)
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_path).to(device)
+    before = validate(model, val_loader, device, "Validating current model")
+    print(f"Current model: Val Accuracy {before['accuracy']:.4f}, Val F1 {before['f1']:.4f}")
+
+    optimizer = AdamW(model.parameters(), lr=learning_rate, weight_decay=TRAINING_CONFIG['weight_decay'])
+    total_steps = len(train_loader) * epochs
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer, int(total_steps * TRAINING_CONFIG['warmup_ratio']), total_steps
+    )
+
+    best, best_state = None, None
+    for epoch in range(epochs):
+        print(f"\n--- Incremental epoch {epoch + 1}/{epochs} ---")
+        train_loss, train_acc = train_epoch(model, train_loader, optimizer, scheduler, device)
+        result = validate(model, val_loader, device, "Validating")
+        print(f"Train Loss: {train_loss:.4f}, Val Accuracy: {result['accuracy']:.4f}, Val F1: {result['f1']:.4f}")
+        if best is None or result['f1'] > best['f1']:
+            best = result
+            best_state = {k: v.detach().to('cpu', copy=True) for k, v in model.state_dict().items()}
+
+    print(f"\n{'='*60}")
+    print("Per-emoji validation accuracy")
+    print(f"{'='*60}")
+    print_class_table(before, best)
+    problems = forgetting_check(before, best, config)
+    accepted = not problems or force
+    for problem in problems:
+        print(f"⚠️ Forgetting: {problem}")
+
+    full_steps = (len(base_data) + len(ledger.consumed) + len(new_data)) / TRAINING_CONFIG['batch_size'] \
+        * TRAINING_CONFIG['num_epochs']
+    seconds = time.perf_counter() - start
+    run = {
+        "id": len(ledger.history) + 1,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "inputs": [{"path": os.path.abspath(p), "sha256": file_sha256(p)} for p in paths],
+        "samples": stats,
+        "replay": len(replay),
+        "epochs": epochs,
+        "learning_rate": learning_rate,
+        "steps": total_steps,
+        "full_run_steps": int(full_steps),
+        "seconds": round(seconds, 1),
+        "before": {k: before[k] for k in ("accuracy", "f1")},
+        "after": {k: best[k] for k in ("accuracy", "f1")},
+        "forgetting": problems,
+        "accepted": accepted,
+    }
+
+    if accepted:
+        model.load_state_dict(best_state)
+        save_model(model, model_path)
+        print(f"✓ Model updated{' (forced)' if problems else ''}: "
+              f"F1 {before['f1']:.4f} -> {best['f1']:.4f}, Acc {before['accuracy']:.4f} -> {best['accuracy']:.4f}")
+    else:
+        print("✗ Update rejected, keeping the current model (new data not marked as consumed)")
+    ledger.record(run, new_data if accepted else [])
+
+    print(f"Cost: {total_steps} steps in {seconds:.0f}s "
+          f"({total_steps / full_steps:.1%} of the ~{int(full_steps)} steps of a full retrain)")
+    return accepted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental fine-tuning on new labeled data with replay")
+    parser.add_argument("inputs", nargs="+", help="JSON files in train.json format")
+    parser.add_argument("--epochs", type=int, default=INCREMENTAL_CONFIG['epochs'])
+    parser.add_argument("--learning-rate", type=float, default=INCREMENTAL_CONFIG['learning_rate'])
+    parser.add_argument("--replay-ratio", type=float, default=INCREMENTAL_CONFIG['replay_ratio'],
+                        help="replayed old samples per new sample")
+    parser.add_argument("--force", action="store_true", help="save even if the forgetting check fails")
+    args = parser.parse_args()
+
+    missing = [p for p in args.inputs if not os.path.exists(p)]
+    if missing:
+        print(f"✗ Input not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    print("="*60)
+    print("Incremental fine-tuning")
+    print("="*60)
+    ok = incremental_train(args.inputs, args.epochs, args.learning_rate, args.replay_ratio, args.force)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
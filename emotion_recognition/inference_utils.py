@@ -0,0 +1,256 @@
+"""
+推理公共工具
+- 序列长度分桶：实时场景的输入最多只有20个字，按 128 补齐会浪费大量计算，
+  这里根据实际 token 数选择最小的可用桶长度再补齐
+- ONNX Runtime 批量推理、验证集加载、延迟测量
+"""
+
+import os
+import time
+import numpy as np
+from config import MODEL_CONFIG, PATH_CONFIG
+
+
+def get_seq_buckets(max_length=None):
+    """返回不超过 max_length 的分桶列表（升序，最后一个桶一定是 max_length）"""
+    max_length = max_length or MODEL_CONFIG['max_length']
+    buckets = sorted(b for b in MODEL_CONFIG.get('seq_buckets', []) if b < max_length)
+    buckets.append(max_length)
+    return buckets
+
+
+def select_bucket(num_tokens, buckets=None):
+    """选择能容纳 num_tokens 的最小桶长度，超过最大桶时返回最大桶（会被截断）"""
+    buckets = buckets or get_seq_buckets()
+    for bucket in buckets:
+        if num_tokens <= bucket:
+            return bucket
+    return buckets[-1]
+
+
+def encode_texts(tokenizer, texts, return_tensors='np', buckets=None):
+    """
+    按分桶长度对一批文本分词
+    整个 batch 补齐到能容纳其中最长文本的最小桶
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    buckets = buckets or get_seq_buckets()
+
+    # 先不补齐地分词，得到每条文本的真实长度（含 [CLS]/[SEP]）
+    encodings = tokenizer(texts, truncation=True, max_length=buckets[-1])
+    seq_len = select_bucket(max(len(ids) for ids in encodings['input_ids']), buckets)
+
+    return tokenizer.pad(
+        encodings,
+        padding='max_length',
+        max_length=seq_len,
+        return_tensors=return_tensors
+    )
+
+
+class BucketedTokenizer:
+    """
+    轻量分词器：直接用 tokenizers（Rust）读取模型目录中的 tokenizer.json，
+    不依赖 transformers / torch，输出按分桶补齐的 numpy 数组
+    """
+
+    def __init__(self, model_path=None, buckets=None):
+        from tokenizers import Tokenizer
+
+        model_path = model_path or PATH_CONFIG['model_save_path']
+        self.buckets = buckets or get_seq_buckets()
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(self.buckets[-1])
+
+    def encode(self, texts):
+        """分词并补齐到能容纳最长文本的最小分桶"""
+        if isinstance(texts, str):
+            texts = [texts]
+        encodings = self.tokenizer.encode_batch(texts)
+        seq_len = select_bucket(max(len(e.ids) for e in encodings), self.buckets)
+
+        input_ids = np.zeros((len(texts), seq_len), dtype=np.int64)
+        attention_mask = np.zeros((len(texts), seq_len), dtype=np.int64)
+        for i, encoding in enumerate(encodings):
+            ids = encoding.ids[:seq_len]
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+
+class OnnxEmotionModel:
+    """ONNX Runtime 推理后端：encode(texts) / forward(inputs) / predict_proba(texts)"""
+
+    def __init__(self, onnx_path=None, tokenizer=None, num_threads=None):
+        self.session = create_onnx_session(onnx_path or PATH_CONFIG['onnx_path'], num_threads=num_threads)
+        self.tokenizer = tokenizer or BucketedTokenizer()
+
+    def encode(self, texts):
+        return self.tokenizer.encode(texts)
+
+    def forward(self, inputs):
+        return self.session.run(None, {
+            'input_ids': inputs['input_ids'].astype(np.int64),
+            'attention_mask': inputs['attention_mask'].astype(np.int64)
+        })[0]
+
+    def predict_proba(self, texts):
+        return softmax(self.forward(self.encode(texts)))
+
+
+BACKENDS = ("torch", "torch_compiled", "numpy", "onnx", "onnx_optimized", "onnx_int8")
+
+
+def backend_model_path(name):
+    """后端默认加载的模型路径（torch / numpy 为模型目录，ONNX 为模型文件）"""
+    paths = {
+        "torch": PATH_CONFIG['model_save_path'],
+        "torch_compiled": PATH_CONFIG['model_save_path'],
+        "numpy": PATH_CONFIG['model_save_path'],
+        "onnx": PATH_CONFIG['onnx_path'],
+        "onnx_optimized": PATH_CONFIG['onnx_optimized_path'],
+        "onnx_int8": PATH_CONFIG['onnx_int8_path'],
+    }
+    if name not in paths:
+        raise ValueError(f"Unknown backend: {name} (choose from {', '.join(BACKENDS)})")
+    return paths[name]
+
+
+def load_backend(name, num_threads=None, model_path=None, warmup=True):
+    """按名称创建推理后端（都提供 encode / forward / predict_proba）"""
+    model_path = model_path or backend_model_path(name)
+    if name == "torch":
+        from fast_predictor import FastEmotionModel
+        return FastEmotionModel(model_path, num_threads=num_threads, warmup=warmup)
+    if name == "torch_compiled":
+        from compiled_model import CompiledEmotionModel
+        return CompiledEmotionModel(model_path, num_threads=num_threads)
+    if name == "numpy":
+        from numpy_bert import NumpyBertModel
+        return NumpyBertModel(model_path)
+    return OnnxEmotionModel(model_path, num_threads=num_threads)
+
+
+def load_labeled_texts(file_path=None):
+    """加载带标签的文本（单标签，只取第一个emoji，与训练时一样去重），默认加载验证集"""
+    from data_processing import load_split
+
+    data = load_split(file_path or PATH_CONFIG['val_file'])
+    texts = [item['text'] for item in data]
+    labels = [item['label'] for item in data]
+    return texts, labels
+
+
+def softmax(logits):
+    """数值稳定的 softmax（最后一维）"""
+    logits = np.asarray(logits, dtype=np.float32)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def create_onnx_session(onnx_path, providers=None, num_threads=None, profile_prefix=None):
+    """创建 ONNX Runtime 推理会话；profile_prefix 时开启算子级剖析（session.end_profiling() 写出 trace）"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    if profile_prefix:
+        options.enable_profiling = True
+        options.profile_file_prefix = profile_prefix
+    return ort.InferenceSession(
+        onnx_path,
+        sess_options=options,
+        providers=providers or ort.get_available_providers()
+    )
+
+
+def run_onnx_batched(session, tokenizer, texts, batch_size=64):
+    """
+    批量运行 ONNX 模型，返回与 texts 顺序一致的 logits [N, num_labels]
+    先按长度排序再切 batch，使每个 batch 都落在尽量小的分桶里
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    logits = np.zeros((len(texts), MODEL_CONFIG['num_labels']), dtype=np.float32)
+
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        inputs = encode_texts(tokenizer, [texts[i] for i in idx], return_tensors='np')
+        outputs = session.run(
+            None,
+            {
+                'input_ids': inputs['input_ids'].astype(np.int64),
+                'attention_mask': inputs['attention_mask'].astype(np.int64)
+            }
+        )
+        logits[idx] = outputs[0]
+
+    return logits
+
+
+def run_torch_batched(model, tokenizer, texts, batch_size=64, device='cpu'):
+    """批量运行 PyTorch 模型，返回与 texts 顺序一致的 logits [N, num_labels]"""
+    import torch
+
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    logits = np.zeros((len(texts), MODEL_CONFIG['num_labels']), dtype=np.float32)
+
+    model.eval()
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            inputs = encode_texts(tokenizer, [texts[i] for i in idx], return_tensors='pt')
+            outputs = model(
+                input_ids=inputs['input_ids'].to(device),
+                attention_mask=inputs['attention_mask'].to(device)
+            )
+            logits[idx] = outputs.logits.float().cpu().numpy()
+
+    return logits
+
+
+def measure_latency(fn, repeats=50, warmup=5):
+    """多次调用 fn，返回每次耗时（毫秒）"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize_latencies(timings):
+    """延迟统计：均值与 p50/p95/p99（毫秒）"""
+    timings = np.asarray(timings, dtype=np.float64)
+    if timings.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(timings.size),
+        "mean": float(timings.mean()),
+        "p50": float(np.percentile(timings, 50)),
+        "p95": float(np.percentile(timings, 95)),
+        "p99": float(np.percentile(timings, 99)),
+    }
+
+
+def process_stats():
+    """当前进程的 CPU 时间（秒）、当前 RSS 和峰值 RSS（MB）"""
+    import resource
+    import sys
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss 在 Linux 上是 KB，在 macOS 上是字节
+    peak = usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+    rss = peak
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    return {
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+    }
@@ -15,10 +15,15 @@ class EmojiPredictor: ObservableObject {
     private let maxChars = 20
     private let cacheTimeout: TimeInterval = 10.0
     private let predictionInterval: TimeInterval = 0.5
+    /// 序列长度分桶，按输入长度选择最小的桶；加载 tokenizer.emtk 后以 bundle 头部记录的为准
+    private var seqBuckets = [16, 32, 64, 128]
+    /// 最大序列长度（含 [CLS]/[SEP]），同样以 bundle 为准
+    private var maxLength = 128
     
     // MARK: - Private Properties
     private var model: EmojiPredictor_int8?
     private var vocab: [String: Int] = [:]
+    private var tokenizerBundle: TokenizerBundle?
     private var emojiMap: [Int: String] = [:]
     private var charBuffer: [(char: Character, timestamp: Date)] = []
     private var predictionTimer: Timer?
@@ -46,11 +51,22 @@ class EmojiPredictor: ObservableObject {
             config.computeUnits = .cpuAndNeuralEngine  // 使用 Neural Engine 加速
             model = try EmojiPredictor_int8(configuration: config)
             
-            // 加载词表
-            loadVocab()
-            
-            // 加载 emoji 映射
-            loadEmojiMap()
+            // 优先使用二进制 bundle（内存映射，无需解析），没有时回退到 vocab.txt / emoji_map.json
+            if let bundle = TokenizerBundle.load() {
+                tokenizerBundle = bundle
+                if !bundle.seqBuckets.isEmpty {
+                    seqBuckets = bundle.seqBuckets
+                }
+                maxLength = bundle.maxLength
+                emojiMap = Dictionary(uniqueKeysWithValues: bundle.labels.enumerated().map { ($0.offset, $0.element) })
+                print("📚 分词 bundle 加载完成，共 \(bundle.labels.count) 个标签")
+            } else {
+                // 加载词表
+                loadVocab()
+                
+                // 加载 emoji 映射
+                loadEmojiMap()
+            }
             
             isReady = true
             print("✅ 模型加载完成")
@@ -138,15 +154,16 @@ class EmojiPredictor: ObservableObject {
         
         guard cachedText.count >= 2, let model = model else { return }
         
-        // 分词
+        // 分词（补齐到最小可用分桶长度）
         let (inputIds, attentionMask) = tokenize(cachedText)
+        let seqLen = inputIds.count
         
         do {
             // 创建输入
-            let inputIdsArray = try MLMultiArray(shape: [1, 128], dataType: .int32)
-            let attentionMaskArray = try MLMultiArray(shape: [1, 128], dataType: .int32)
+            let inputIdsArray = try MLMultiArray(shape: [1, NSNumber(value: seqLen)], dataType: .int32)
+            let attentionMaskArray = try MLMultiArray(shape: [1, NSNumber(value: seqLen)], dataType: .int32)
             
-            for i in 0..<128 {
+            for i in 0..<seqLen {
                 inputIdsArray[i] = NSNumber(value: inputIds[i])
                 attentionMaskArray[i] = NSNumber(value: attentionMask[i])
             }
@@ -184,30 +201,39 @@ class EmojiPredictor: ObservableObject {
     }
     
     // MARK: - Tokenization
+    private func selectBucket(_ tokenCount: Int) -> Int {
+        return seqBuckets.first { tokenCount <= $0 } ?? seqBuckets[seqBuckets.count - 1]
+    }
+    
+    private func tokenId(_ char: Character) -> Int {
+        if let bundle = tokenizerBundle {
+            return bundle.tokenId(for: char)
+        }
+        return vocab[String(char)] ?? vocab["[UNK]"] ?? 100  // Unknown token
+    }
+    
     private func tokenize(_ text: String) -> ([Int32], [Int32]) {
-        var inputIds = [Int32](repeating: 0, count: 128)
-        var attentionMask = [Int32](repeating: 0, count: 128)
+        // [CLS] + 文本 + [SEP]，超过最大桶时截断
+        let maxLength = min(self.maxLength, seqBuckets[seqBuckets.count - 1])
+        let seqLen = selectBucket(text.count + 2)
+        var inputIds = [Int32](repeating: 0, count: seqLen)
+        var attentionMask = [Int32](repeating: 0, count: seqLen)
         
         // [CLS] token
-        inputIds[0] = Int32(vocab["[CLS]"] ?? 101)
+        inputIds[0] = Int32(tokenizerBundle?.clsId ?? vocab["[CLS]"] ?? 101)
         attentionMask[0] = 1
         
         var idx = 1
         for char in text {
-            guard idx < 127 else { break }
+            guard idx < maxLength - 1 else { break }
             
-            let token = String(char)
-            if let tokenId = vocab[token] {
-                inputIds[idx] = Int32(tokenId)
-            } else {
-                inputIds[idx] = Int32(vocab["[UNK]"] ?? 100)  // Unknown token
-            }
+            inputIds[idx] = Int32(tokenId(char))
             attentionMask[idx] = 1
             idx += 1
         }
         
         // [SEP] token
-        inputIds[idx] = Int32(vocab["[SEP]"] ?? 102)
+        inputIds[idx] = Int32(tokenizerBundle?.sepId ?? vocab["[SEP]"] ?? 102)
         attentionMask[idx] = 1
         
         return (inputIds, attentionMask)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+按键流压测
+用 train.json / val.json 中的文本构造逼真的按键流：每个用户逐字输入，
+按键间隔服从泊松过程（平均 chars_per_second），消息之间有停顿。
+每次按键后请求一次预测（与 test_realtime.py 中输入后立即预测相同），目标可以是：
+- inprocess: 本进程内共享模型、每个用户一个 RealtimeEmotionPredictor 会话
+- socket:    predict_server.py 启动的本地服务
+
+按键时间是预先排好的（开环），请求慢于打字速度时：
+- 丢弃：还没来得及单独预测、被合并进下一次请求的按键
+- 过期：结果返回时用户已经按下了下一个键
+延迟从按键时刻算起（包含排队等待），避免压测端被服务端拖慢而低估延迟。
+
+用法:
+    python loadgen.py --target inprocess --users 8 --cps 6 --duration 30
+    python loadgen.py --target socket --port 8765 --report output/loadgen.json
+"""
+
+import json
+import time
+import socket
+import random
+import argparse
+import threading
+import numpy as np
+from config import PATH_CONFIG, SERVER_CONFIG, LOADGEN_CONFIG
+from inference_utils import BACKENDS, load_backend, load_labeled_texts, process_stats, summarize_latencies
+
+
+def load_messages():
+    """压测用的消息文本（训练集 + 验证集）"""
+    texts = load_labeled_texts(PATH_CONFIG['train_file'])[0] + load_labeled_texts(PATH_CONFIG['val_file'])[0]
+    return [t for t in texts if t.strip()]
+
+
+def keystroke_schedule(messages, rng, cps, pause, duration):
+    """生成一个用户的按键序列 [(时刻, 字符)]，时刻相对压测开始（秒）"""
+    schedule = []
+    t = rng.expovariate(1.0 / pause)
+    while t < duration:
+        for char in rng.choice(messages):
+            if not char.strip():
+                continue
+            t += rng.expovariate(cps)
+            schedule.append((t, char))
+        t += rng.expovariate(1.0 / pause)
+    return [(t, c) for t, c in schedule if t < duration]
+
+
+class InProcessTarget:
+    """本进程内：共享模型，每个用户一个会话"""
+
+    def __init__(self, backend):
+        from metrics import PredictorMetrics
+        from test_realtime import RealtimeEmotionPredictor
+
+        self.model = load_backend(backend)
+        self.metrics = PredictorMetrics()
+        self.session_cls = RealtimeEmotionPredictor
+
+    def connect(self):
+        session = self.session_cls(model=self.model, metrics=self.metrics, verbose=False)
+
+        def type_text(text):
+            session.add_text(text)
+            return session.predict(session.get_cached_text())[0]
+        return type_text, lambda: None
+
+    def stats(self):
+        return process_stats()
+
+
+class SocketTarget:
+    """predict_server.py 服务：每个用户一个连接"""
+
+    def __init__(self, host, port, timeout):
+        self.address = (host, port)
+        self.timeout = timeout
+
+    def _request(self, conn, reader, payload):
+        conn.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8'))
+        reply = json.loads(reader.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    def connect(self):
+        conn = socket.create_connection(self.address, timeout=self.timeout)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = conn.makefile('r', encoding='utf-8')
+        seq = [0]
+
+        def type_text(text):
+            seq[0] += 1
+            return self._request(conn, reader, {"op": "type", "text": text, "seq": seq[0]})['emoji']
+
+        def close():
+            reader.close()
+            conn.close()
+        return type_text, close
+
+    def stats(self):
+        """服务进程的资源占用"""
+        conn = socket.create_connection(self.address, timeout=self.timeout)
+        reader = conn.makefile('r', encoding='utf-8')
+        try:
+            reply = self._request(conn, reader, {"op": "stats"})
+        finally:
+            reader.close()
+            conn.close()
+        return {k: reply[k] for k in ("cpu_seconds", "rss_mb", "peak_rss_mb")}
+
+
+class UserResult:
+    def __init__(self):
+        self.latencies = []  # 毫秒
+        self.keystrokes = 0
+        self.requests = 0
+        self.skipped = 0  # 文本太短，未预测
+        self.dropped = 0
+        self.stale = 0
+        self.errors = 0
+        self.first_error = None  # 第一条错误信息，便于定位（否则只能看到错误数）
+
+    def record_error(self, e):
+        self.errors += 1
+        self.first_error = self.first_error or f"{type(e).__name__}: {e}"
+
+
+def run_user(target, schedule, origin, timeout):
+    """按预定时刻回放一个用户的按键"""
+    result = UserResult()
+    result.keystrokes = len(schedule)
+    try:
+        type_text, close = target.connect()
+    except Exception as e:
+        result.record_error(e)
+        result.dropped = len(schedule)
+        return result
+
+    try:
+        i = 0
+        while i < len(schedule):
+            delay = origin + schedule[i][0] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # 已经到时刻的按键一起发送，除最后一个外都没有单独的预测
+            now = time.perf_counter() - origin
+            j = i + 1
+            while j < len(schedule) and schedule[j][0] <= now:
+                j += 1
+            result.dropped += j - i - 1
+
+            try:
+                emoji = type_text(''.join(c for _, c in schedule[i:j]))
+            except Exception as e:
+                # 任何失败都只算这一次请求出错（回复格式不对时可能是 KeyError 等）；
+                # 连接可能处于不一致状态（例如超时后迟到的回复），重新连接
+                result.record_error(e)
+                result.dropped += 1
+                i = j
+                close()
+                try:
+                    type_text, close = target.connect()
+                except Exception:
+                    result.dropped += len(schedule) - i
+                    close = lambda: None
+                    break
+                continue
+
+            done = time.perf_counter() - origin
+            latency = done - schedule[j - 1][0]
+            result.requests += 1
+            if emoji is None:
+                result.skipped += 1
+            elif latency > timeout:
+                result.dropped += 1
+            else:
+                result.latencies.append(latency * 1000)
+                if j < len(schedule) and done > schedule[j][0]:
+                    result.stale += 1
+            i = j
+    finally:
+        close()
+    return result
+
+
+def run_load(target, messages, users, cps, pause, duration, timeout, seed):
+    rng = random.Random(seed)
+    schedules = [keystroke_schedule(messages, random.Random(rng.random()), cps, pause, duration)
+                 for _ in range(users)]
+
+    results = [None] * users
+    stats_before = target.stats()
+    origin = time.perf_counter() + 0.5  # 留出创建连接的时间
+
+    def worker(k):
+        try:
+            results[k] = run_user(target, schedules[k], origin, timeout)
+        except Exception as e:
+            # run_user 自身出错（如关闭连接失败）：记为错误，这个用户的按键全部算作丢弃
+            result = UserResult()
+            result.keystrokes = result.dropped = len(schedules[k])
+            result.record_error(e)
+            results[k] = result
+
+    threads = [threading.Thread(target=worker, args=(k,), daemon=True) for k in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - origin
+    stats_after = target.stats()
+
+    latencies = [ms for r in results for ms in r.latencies]
+    keystrokes = sum(r.keystrokes for r in results)
+    requests = sum(r.requests for r in results)
+    summary = summarize_latencies(latencies)
+    if latencies:
+        summary["p90"] = float(np.percentile(latencies, 90))
+        summary["max"] = float(np.max(latencies))
+
+    return {
+        "users": users,
+        "chars_per_second": cps,
+        "duration": elapsed,
+        "keystrokes": keystrokes,
+        "requests": requests,
+        "throughput": requests / elapsed,
+        "predictions": len(latencies),
+        "latency_ms": summary,
+        "skipped": sum(r.skipped for r in results),
+        "dropped": sum(r.dropped for r in results),
+        "dropped_rate": sum(r.dropped for r in results) / max(keystrokes, 1),
+        "stale": sum(r.stale for r in results),
+        "stale_rate": sum(r.stale for r in results) / max(len(latencies), 1),
+        "errors": sum(r.errors for r in results),
+        "first_error": next((r.first_error for r in results if r.first_error), None),
+        "cpu_utilization": (stats_after['cpu_seconds'] - stats_before['cpu_seconds']) / elapsed,
+        "rss_mb": stats_after['rss_mb'],
+        "peak_rss_mb": stats_after['peak_rss_mb'],
+    }
+
+
+def print_report(report):
+    lat = report['latency_ms']
+    print("\n" + "="*60)
+    print(f"Users: {report['users']}, typing rate: {report['chars_per_second']} chars/s per user, "
+          f"duration: {report['duration']:.1f}s")
+    print("="*60)
+    print(f"Keystrokes:       {report['keystrokes']}")
+    print(f"Throughput:       {report['throughput']:.1f} requests/s")
+    if lat['count']:
+        print(f"Latency (ms):     p50 {lat['p50']:.1f} | p90 {lat['p90']:.1f} | p95 {lat['p95']:.1f} | "
+              f"p99 {lat['p99']:.1f} | max {lat['max']:.1f}")
+    print(f"Dropped:          {report['dropped']} ({report['dropped_rate']:.2%} of keystrokes)")
+    print(f"Stale:            {report['stale']} ({report['stale_rate']:.2%} of predictions)")
+    print(f"Skipped (short):  {report['skipped']}")
+    print(f"Errors:           {report['errors']}" + (f" (first: {report['first_error']})" if report['errors'] else ""))
+    print(f"CPU:              {report['cpu_utilization']:.2f} cores")
+    print(f"Memory:           {report['rss_mb']:.0f} MB RSS (peak {report['peak_rss_mb']:.0f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keystroke-stream load generator")
+    parser.add_argument("--target", choices=["inprocess", "socket"], default="inprocess")
+    parser.add_argument("--backend", choices=BACKENDS, default=SERVER_CONFIG['backend'],
+                        help="model backend for --target inprocess")
+    parser.add_argument("--host", default=SERVER_CONFIG['host'])
+    parser.add_argument("--port", type=int, default=SERVER_CONFIG['port'])
+    parser.add_argument("--users", type=int, default=LOADGEN_CONFIG['users'])
+    parser.add_argument("--cps", type=float, default=LOADGEN_CONFIG['chars_per_second'])
+    parser.add_argument("--pause", type=float, default=LOADGEN_CONFIG['message_pause'])
+    parser.add_argument("--duration", type=float, default=LOADGEN_CONFIG['duration'])
+    parser.add_argument("--timeout", type=float, default=LOADGEN_CONFIG['timeout'])
+    parser.add_argument("--seed", type=int, default=LOADGEN_CONFIG['seed'])
+    parser.add_argument("--report", help="save the report as JSON")
+    args = parser.parse_args()
+
+    print("="*60)
+    print(f"Keystroke load test ({args.target})")
+    print("="*60)
+
+    messages = load_messages()
+    if args.target == "inprocess":
+        target = InProcessTarget(args.backend)
+    else:
+        target = SocketTarget(args.host, args.port, args.timeout)
+
+    report = run_load(target, messages, args.users, args.cps, args.pause,
+                      args.duration, args.timeout, args.seed)
+    report['target'] = args.target
+    print_report(report)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport saved: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+根据语料选择 max_length
+- analyze: 统计训练集的 token 长度分布（HF tokenizer，以及 iOS 端按字符计数的长度），
+           推荐能覆盖 coverage_percentile 的最小 max_length，并在 val.json 上比较
+           各候选长度的准确率、被截断的比例和推理吞吐（按训练时的固定长度补齐）
+- apply:   把选定的值写入所有下游：config.py（训练数据处理 / ONNX / CoreML 导出都从这里读取）、
+           output/model_config.json、tokenizer.emtk 和 iOS 端 EmojiPredictor.swift 中的分桶
+
+用法:
+    python max_length_tuner.py analyze [--percentile 99.5] [--candidates 32 48 64]
+    python max_length_tuner.py apply 48
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from config import MODEL_CONFIG, PATH_CONFIG, MAXLEN_CONFIG
+from inference_utils import get_seq_buckets, load_labeled_texts
+from tokenizer_bundle import write_bundle
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(ROOT, "config.py")
+# 仓库中所有 iOS 端副本
+SWIFT_FILES = [
+    os.path.join(ROOT, "ios_integration", "EmojiPredictor.swift"),
+    os.path.join(ROOT, "..", "IOS_emoji_analyser", "ios_integration", "EmojiPredictor.swift"),
+]
+MODEL_CONFIG_FILES = [
+    os.path.join(PATH_CONFIG['output_dir'], "model_config.json"),
+    os.path.join(ROOT, "..", "IOS_emoji_analyser", "output", "model_config.json"),
+]
+
+
+def load_tokenizer():
+    from transformers import AutoTokenizer
+
+    model_path = PATH_CONFIG['model_save_path']
+    return AutoTokenizer.from_pretrained(model_path if os.path.exists(model_path) else MODEL_CONFIG['model_name'])
+
+
+def token_lengths(tokenizer, texts):
+    """HF tokenizer 的长度，以及 iOS 端按字符计数的长度（均含 [CLS]/[SEP]）"""
+    hf = np.array([len(ids) for ids in tokenizer(texts, truncation=False)['input_ids']])
+    chars = np.array([len(t) + 2 for t in texts])
+    return hf, chars
+
+
+def recommend(lengths, percentile, round_to, limit):
+    needed = int(np.ceil(np.percentile(lengths, percentile)))
+    return min(int(np.ceil(needed / round_to) * round_to), limit)
+
+
+def evaluate_candidates(tokenizer, candidates, batch_size=64):
+    """在 val.json 上按每个候选长度截断并固定补齐，比较准确率和吞吐"""
+    import torch
+    from transformers import AutoModelForSequenceClassification
+
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+    model = AutoModelForSequenceClassification.from_pretrained(PATH_CONFIG['model_save_path'])
+    model.eval()
+    full = np.array([len(ids) for ids in tokenizer(texts, truncation=False)['input_ids']])
+
+    results = []
+    for length in candidates:
+        encodings = tokenizer(texts, padding='max_length', truncation=True, max_length=length, return_tensors='pt')
+        preds = []
+        start = time.perf_counter()
+        with torch.no_grad():
+            for s in range(0, len(texts), batch_size):
+                logits = model(
+                    input_ids=encodings['input_ids'][s:s + batch_size],
+                    attention_mask=encodings['attention_mask'][s:s + batch_size]
+                ).logits
+                preds.append(logits.argmax(dim=1).numpy())
+        seconds = time.perf_counter() - start
+        results.append({
+            "max_length": length,
+            "accuracy": float((np.concatenate(preds) == labels).mean()),
+            "truncated": float((full > length).mean()),
+            "throughput": len(texts) / seconds,
+        })
+    return results
+
+
+def analyze(args):
+    tokenizer = load_tokenizer()
+    texts, _ = load_labeled_texts(PATH_CONFIG['train_file'])
+    hf, chars = token_lengths(tokenizer, texts)
+    current = MODEL_CONFIG['max_length']
+
+    print(f"Training texts: {len(texts)}")
+    print(f"{'percentile':<12}{'tokens':>8}{'chars+2':>9}")
+    for p in (50, 90, 95, 99, 99.5, 99.9, 100):
+        print(f"{p:<12}{np.percentile(hf, p):>8.0f}{np.percentile(chars, p):>9.0f}")
+
+    # 两种计数都要覆盖：训练/导出用 HF tokenizer，iOS 端按字符截断
+    recommended = max(
+        recommend(hf, args.percentile, args.round_to, current),
+        recommend(chars, args.percentile, args.round_to, current),
+    )
+    print(f"\nRecommended max_length: {recommended} "
+          f"(covers {(hf <= recommended).mean():.2%} by tokens, {(chars <= recommended).mean():.2%} by chars; "
+          f"current {current})")
+
+    if args.skip_eval:
+        return
+    candidates = sorted(set(args.candidates or []) | {recommended, current})
+    print("\nEvaluating on val.json (fixed padding, as in training)...")
+    results = evaluate_candidates(tokenizer, candidates)
+    baseline = next(r for r in results if r['max_length'] == current)
+    print(f"{'max_length':<12}{'accuracy':>10}{'Δacc':>9}{'truncated':>11}{'texts/s':>10}{'speedup':>9}")
+    for r in results:
+        print(f"{r['max_length']:<12}{r['accuracy']:>10.4f}{r['accuracy'] - baseline['accuracy']:>+9.4f}"
+              f"{r['truncated']:>11.2%}{r['throughput']:>10.1f}{r['throughput'] / baseline['throughput']:>8.2f}x")
+    print(f"\nApply with: python max_length_tuner.py apply {recommended}")
+
+
+def replace_once(path, pattern, replacement):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    new_content, count = re.subn(pattern, replacement, content, count=1)
+    if count != 1:
+        raise ValueError(f"Pattern {pattern!r} not found in {path}")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(new_content)
+
+
+def apply(args):
+    length = args.max_length
+    if length < 8:
+        print("✗ max_length must be at least 8")
+        sys.exit(1)
+    buckets = get_seq_buckets(length)
+
+    # 1. config.py：训练、导出、推理都从这里读取
+    replace_once(CONFIG_FILE, r'("max_length":\s*)\d+', rf'\g<1>{length}')
+    print(f"✓ config.py: max_length = {length}")
+
+    # 2. 设备端配置
+    for path in MODEL_CONFIG_FILES:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            model_config = json.load(f)
+        model_config['max_length'] = length
+        model_config['seq_buckets'] = buckets
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(model_config, f, ensure_ascii=False, indent=2)
+        print(f"✓ {os.path.relpath(path)}: seq_buckets = {buckets}")
+
+    # 3. 二进制 bundle 的头部也记录了 max_length 和分桶，按同目录的 vocab.txt 重新生成
+    for path in MODEL_CONFIG_FILES:
+        bundle_path = os.path.join(os.path.dirname(path), "tokenizer.emtk")
+        if os.path.exists(bundle_path):
+            write_bundle(bundle_path, os.path.join(os.path.dirname(path), "vocab.txt"),
+                         max_length=length, buckets=buckets)
+            print(f"✓ {os.path.relpath(bundle_path)}: max_length = {length}")
+
+    # 4. iOS 端分词的分桶（最大桶即截断长度）
+    for path in SWIFT_FILES:
+        if not os.path.exists(path):
+            continue
+        replace_once(path, r'(private let seqBuckets = )\[[^\]]*\]', rf'\g<1>[{", ".join(map(str, buckets))}]')
+        print(f"✓ {os.path.relpath(path)}: seqBuckets = {buckets}")
+
+    print("\nNext steps:")
+    print("  python train.py           # retrain with the new max_length")
+    print("  python export_coreml.py   # export stages are keyed on max_length and will re-run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Choose max_length from the corpus and propagate it")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = sub.add_parser("analyze", help="length distribution, recommendation and val.json impact")
+    analyze_parser.add_argument("--percentile", type=float, default=MAXLEN_CONFIG['coverage_percentile'])
+    analyze_parser.add_argument("--round-to", type=int, default=MAXLEN_CONFIG['round_to'])
+    analyze_parser.add_argument("--candidates", type=int, nargs="*", help="extra lengths to evaluate")
+    analyze_parser.add_argument("--skip-eval", action="store_true", help="skip the val.json evaluation")
+
+    apply_parser = sub.add_parser("apply", help="write max_length into config and device artifacts")
+    apply_parser.add_argument("max_length", type=int)
+
+    args = parser.parse_args()
+    print("="*60)
+    print(f"max_length tuner: {args.command}")
+    print("="*60)
+    if args.command == "analyze":
+        analyze(args)
+    else:
+        apply(args)
+
+
+if __name__ == "__main__":
+    main()
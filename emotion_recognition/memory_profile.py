@@ -0,0 +1,253 @@
+"""
+按阶段的内存剖析
+在训练、数据处理和导出脚本中用 memory_stage("名称") 标出各阶段；剖析模式关闭时它什么也不做。
+剖析模式下后台线程按固定间隔采样：
+- 进程 RSS（/proc/self/statm），归入当时所有进行中的阶段（支持嵌套和多线程并行的阶段）
+- tracemalloc 的 Python 堆峰值（每次采样后 reset_peak，两次采样之间的峰值也不会漏掉）
+RSS 超过 MEMORY_CONFIG 中的预算时记录违规，超出预算的阶段结束时抛出 MemoryBudgetExceeded；
+如果主线程正处在超出预算的阶段中，还会中断主线程，让它立即在该阶段抛出（而不是等阶段结束）。
+工作线程中的阶段（例如导出流水线中并行的 run_stage）在结束时抛出，经 future.result() 传回主线程。
+进程退出时打印各阶段报告并写入 JSON。
+
+启用（各脚本在 main() 中调用 maybe_enable_memory_profile()，导入本模块本身没有副作用）:
+    python train.py --memory-profile
+    EMOJI_MEMORY_PROFILE=1 EMOJI_MEMORY_BUDGET_MB=6000 python export_coreml.py
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import _thread
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from config import MEMORY_CONFIG
+
+
+MB = 1024 * 1024
+
+
+class MemoryBudgetExceeded(RuntimeError):
+    pass
+
+
+def current_rss():
+    """当前进程 RSS（字节）"""
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    # 非 Linux 没有当前 RSS，退化为历史峰值
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageRecord:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rss_start = None
+        self.rss_end = None
+        self.rss_peak = 0
+        self.py_peak = 0
+        self.exceeded = False
+
+    def to_dict(self, budget_mb):
+        return {
+            "stage": self.name,
+            "calls": self.calls,
+            "seconds": round(self.seconds, 3),
+            "rss_start_mb": round(self.rss_start / MB, 1),
+            "rss_end_mb": round(self.rss_end / MB, 1) if self.rss_end is not None else None,
+            "rss_peak_mb": round(self.rss_peak / MB, 1),
+            "rss_growth_mb": round((self.rss_peak - self.rss_start) / MB, 1),
+            "python_peak_mb": round(self.py_peak / MB, 1),
+            "budget_mb": budget_mb,
+            "exceeded": self.exceeded,
+        }
+
+
+class MemoryProfiler:
+
+    def __init__(self, budget_mb=None, stage_budgets_mb=None, interval=None, trace_python=None):
+        self.budget_mb = budget_mb
+        self.stage_budgets_mb = stage_budgets_mb or {}
+        self.interval = interval or MEMORY_CONFIG['sample_interval']
+        self.trace_python = MEMORY_CONFIG['tracemalloc'] if trace_python is None else trace_python
+
+        self.records = {}  # 名称 → StageRecord（按首次进入的顺序）
+        self.active = []  # 进行中的 (StageRecord, 线程 id)（所有线程）
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.violation = None
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+
+        if self.trace_python and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _stage_budget(self, name):
+        return self.stage_budgets_mb.get(name)
+
+    def _sample(self, interrupt=False):
+        rss = current_rss()
+        py_peak = 0
+        if self.trace_python:
+            py_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+
+        with self.lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for record, _ in self.active:
+                record.rss_peak = max(record.rss_peak, rss)
+                record.py_peak = max(record.py_peak, py_peak)
+            if self.violation is None:
+                self.violation = self._check_budgets(rss)
+                # 只有主线程正处在超出预算的阶段中时才中断它：KeyboardInterrupt 由该阶段的 stage()
+                # 转换为 MemoryBudgetExceeded；否则（例如主线程在等待工作线程）会变成一个像 Ctrl-C 的中断
+                main_ident = threading.main_thread().ident
+                if self.violation and interrupt and any(
+                    record.exceeded and ident == main_ident for record, ident in self.active
+                ):
+                    _thread.interrupt_main()
+
+    def _check_budgets(self, rss):
+        if self.budget_mb and rss > self.budget_mb * MB:
+            for record, _ in self.active:
+                record.exceeded = True
+            return f"RSS {rss / MB:.0f} MB exceeds budget {self.budget_mb} MB"
+        for record, _ in self.active:
+            budget = self._stage_budget(record.name)
+            if budget and rss > budget * MB:
+                record.exceeded = True
+                return f"RSS {rss / MB:.0f} MB exceeds stage '{record.name}' budget {budget} MB"
+        return None
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample(interrupt=True)
+
+    @contextmanager
+    def stage(self, name):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        # 嵌套阶段以 "父阶段/子阶段" 命名
+        full_name = "/".join([s.name for s in stack] + [name])
+
+        with self.lock:
+            record = self.records.setdefault(full_name, StageRecord(full_name))
+            rss = current_rss()
+            if record.rss_start is None:
+                record.rss_start = rss
+            record.rss_peak = max(record.rss_peak, rss)
+            record.calls += 1
+            entry = (record, threading.get_ident())
+            self.active.append(entry)
+        stack.append(record)
+        start = time.perf_counter()
+
+        try:
+            yield record
+        except KeyboardInterrupt:
+            if self.violation:
+                raise MemoryBudgetExceeded(f"[{full_name}] {self.violation}") from None
+            raise
+        finally:
+            self._sample()
+            record.seconds += time.perf_counter() - start
+            record.rss_end = current_rss()
+            stack.pop()
+            with self.lock:
+                self.active.remove(entry)
+
+        if self.violation and record.exceeded:
+            raise MemoryBudgetExceeded(f"[{full_name}] {self.violation}")
+
+    def check(self):
+        """已经超出预算时抛出 MemoryBudgetExceeded（在开始新阶段之前调用）"""
+        if self.violation:
+            raise MemoryBudgetExceeded(self.violation)
+
+    def report(self):
+        return {
+            "budget_mb": self.budget_mb,
+            "peak_rss_mb": round(self.peak_rss / MB, 1),
+            "violation": self.violation,
+            "stages": [r.to_dict(self._stage_budget(r.name)) for r in self.records.values()],
+        }
+
+    def print_report(self):
+        report = self.report()
+        print("\n" + "="*60)
+        print("Memory profile")
+        print("="*60)
+        print(f"{'stage':<32}{'time':>8}{'RSS peak':>11}{'growth':>10}{'py peak':>10}")
+        for s in report["stages"]:
+            mark = " ✗" if s["exceeded"] else ""
+            print(f"{s['stage']:<32}{s['seconds']:>7.1f}s{s['rss_peak_mb']:>9.0f}MB"
+                  f"{s['rss_growth_mb']:>8.0f}MB{s['python_peak_mb']:>8.0f}MB{mark}")
+        print(f"Process peak RSS: {report['peak_rss_mb']:.0f} MB"
+              + (f" (budget {self.budget_mb} MB)" if self.budget_mb else ""))
+        if self.violation:
+            print(f"✗ {self.violation}")
+
+    def finish(self, report_path=None):
+        self.stop_event.set()
+        self._sample()
+        self.print_report()
+        report_path = report_path or MEMORY_CONFIG['report_path']
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        print(f"Memory report saved: {report_path}")
+
+
+PROFILER = None
+
+
+def enable_memory_profile(budget_mb=None):
+    """开启剖析模式（进程内只开启一次），退出时输出报告"""
+    global PROFILER
+    if PROFILER is None:
+        env_budget = os.environ.get("EMOJI_MEMORY_BUDGET_MB")
+        PROFILER = MemoryProfiler(
+            budget_mb=budget_mb or (float(env_budget) if env_budget else MEMORY_CONFIG['budget_mb']),
+            stage_budgets_mb=MEMORY_CONFIG['stage_budgets_mb'],
+        )
+        atexit.register(PROFILER.finish)
+    return PROFILER
+
+
+def maybe_enable_memory_profile(argv=None):
+    """命令行带 --memory-profile 或设置了 EMOJI_MEMORY_PROFILE=1 时开启剖析模式（在脚本的 main() 中调用）"""
+    argv = sys.argv if argv is None else argv
+    if os.environ.get("EMOJI_MEMORY_PROFILE") == "1" or "--memory-profile" in argv:
+        return enable_memory_profile()
+    return None
+
+
+def memory_limited():
+    """剖析模式已开启或配置了内存预算（此时调用方应避免并行叠加内存峰值）"""
+    return (
+        PROFILER is not None
+        or bool(os.environ.get("EMOJI_MEMORY_BUDGET_MB"))
+        or bool(MEMORY_CONFIG['budget_mb'])
+    )
+
+
+def memory_stage(name):
+    """标记一个阶段；剖析模式关闭时不做任何事"""
+    if PROFILER is None:
+        return nullcontext()
+    return PROFILER.stage(name)
+
+
+def check_memory_budget():
+    """剖析模式下已经超出预算时抛出 MemoryBudgetExceeded"""
+    if PROFILER is not None:
+        PROFILER.check()
@@ -0,0 +1,177 @@
+"""
+轻量运行时指标：计数器 / 仪表 / 直方图，以 Prometheus 文本格式从本机 HTTP 端点暴露
+- 只依赖标准库；每次记录只有一次加锁和一次二分查找，可以常开在热路径上
+- 直方图桶固定（METRICS_CONFIG['latency_buckets']），导出时才累加成累计计数
+
+用法:
+    from metrics import PredictorMetrics, start_metrics_server
+    metrics = PredictorMetrics()
+    start_metrics_server()              # http://127.0.0.1:9464/metrics
+    with metrics.forward_seconds.time():
+        ...
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import METRICS_CONFIG
+
+
+class Counter:
+    TYPE = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, "", self.value)]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class Histogram:
+    TYPE = "histogram"
+
+    def __init__(self, name, help_text, buckets=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = sorted(buckets or METRICS_CONFIG['latency_buckets'])
+        # 每个桶单独计数（最后一个是 +Inf），导出时再累加
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        result = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float('inf')], counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(float(bound))
+            result.append((self.name + "_bucket", f'{{le="{le}"}}', cumulative))
+        result.append((self.name + "_sum", "", total))
+        result.append((self.name + "_count", "", cumulative))
+        return result
+
+
+class Registry:
+    """按注册顺序保存指标并生成 Prometheus 文本"""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help_text, **kwargs)
+            metric = self.metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {metric.TYPE}")
+        return metric
+
+    def counter(self, name, help_text):
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._register(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=None):
+        return self._register(Histogram, name, help_text, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class PredictorMetrics:
+    """实时预测器使用的指标"""
+
+    def __init__(self, registry=REGISTRY):
+        self.tokenize_seconds = registry.histogram(
+            "emoji_tokenize_seconds", "Time spent tokenizing input text")
+        self.forward_seconds = registry.histogram(
+            "emoji_forward_seconds", "Time spent in the model forward pass")
+        self.predict_seconds = registry.histogram(
+            "emoji_predict_seconds", "End-to-end prediction latency")
+        self.predictions = registry.counter(
+            "emoji_predictions_total", "Predictions computed by the model")
+        self.skipped_short = registry.counter(
+            "emoji_skipped_short_texts_total", "Texts shorter than 2 characters that were not predicted")
+        self.cache_hits = registry.counter(
+            "emoji_cache_hits_total", "Prediction loop ticks that reused the last result for unchanged text")
+        self.cache_misses = registry.counter(
+            "emoji_cache_misses_total", "Prediction loop ticks whose text changed and needed a new prediction")
+        self.expired_chars = registry.counter(
+            "emoji_expired_chars_total", "Buffered characters dropped after the cache timeout")
+        self.buffer_size = registry.gauge(
+            "emoji_buffer_chars", "Characters currently held in the input buffers of all sessions")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不在终端打印每次抓取
+        pass
+
+
+def start_metrics_server(port=None, host=None, registry=REGISTRY):
+    """在后台线程启动 /metrics 端点，返回 server（server.shutdown() 停止）"""
+    handler = type("Handler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host or METRICS_CONFIG['host'], port or METRICS_CONFIG['port']), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
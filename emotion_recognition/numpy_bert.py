@@ -0,0 +1,240 @@
+"""
+纯 NumPy 的 BERT 推理引擎（不依赖 torch）
+直接加载 save_model() 保存的 model.safetensors（内存映射），实现
+BertForSequenceClassification 的前向计算：
+- 按 batch 和序列维度向量化，Q/K/V 合并为一次矩阵乘法
+- 去掉整列都是 padding 的位置，剩余 padding 用注意力偏置屏蔽
+- 最后一层只计算 [CLS] 位置（分类只用到它）
+- 激活缓冲区按 (batch, seq) 形状预分配并在多次调用间复用
+
+用法:
+    python numpy_bert.py            # 在 val.json 上与 PyTorch 模型比对输出
+"""
+
+import os
+import sys
+import json
+import threading
+import numpy as np
+from config import PATH_CONFIG
+from inference_utils import BucketedTokenizer, softmax
+from safetensors_mmap import find_weights_file, load_numpy_mmap
+
+
+def erf(x):
+    """误差函数的多项式近似（Abramowitz & Stegun 7.1.26，最大误差 1.5e-7）"""
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t
+               + 0.254829592) * t * np.exp(-x * x)
+    return sign * y
+
+
+def gelu(x):
+    """BERT 使用的精确 GELU：x * Φ(x)"""
+    return 0.5 * x * (1.0 + erf(x / np.sqrt(2.0, dtype=np.float32)))
+
+
+def layer_norm(x, weight, bias, eps):
+    mean = x.mean(axis=-1, keepdims=True)
+    var = ((x - mean) ** 2).mean(axis=-1, keepdims=True)
+    return (x - mean) / np.sqrt(var + eps) * weight + bias
+
+
+class NumpyBertModel:
+    """
+    NumPy 版 BertForSequenceClassification
+    与其他推理后端一致的接口：encode(texts) / forward(inputs) / predict_proba(texts)
+    """
+
+    def __init__(self, model_path=None, tokenizer=None):
+        """tokenizer: 提供 encode(texts) 的分词器，默认 BucketedTokenizer；可传入 CharTokenizer 以去掉 tokenizers 依赖"""
+        self.model_path = model_path or PATH_CONFIG['model_save_path']
+        with open(os.path.join(self.model_path, "config.json"), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        self.hidden_size = config['hidden_size']
+        self.num_heads = config['num_attention_heads']
+        self.head_dim = self.hidden_size // self.num_heads
+        self.num_layers = config['num_hidden_layers']
+        self.eps = config.get('layer_norm_eps', 1e-12)
+        if config.get('hidden_act', 'gelu') != 'gelu':
+            raise ValueError(f"Unsupported activation: {config['hidden_act']}")
+
+        weights_file = find_weights_file(self.model_path)
+        if weights_file is None:
+            raise FileNotFoundError(f"model.safetensors not found in {self.model_path}")
+        self._load_weights(load_numpy_mmap(weights_file))
+
+        self.tokenizer = tokenizer or BucketedTokenizer(self.model_path)
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def _load_weights(self, w):
+        """整理权重：线性层转置为 [in, out]（内存映射上的视图，不复制），Q/K/V 合并"""
+        def linear(prefix):
+            return w[prefix + '.weight'].T, w[prefix + '.bias']
+
+        emb = 'bert.embeddings.'
+        self.word_embeddings = w[emb + 'word_embeddings.weight']
+        self.position_embeddings = w[emb + 'position_embeddings.weight']
+        self.token_type_embedding = w[emb + 'token_type_embeddings.weight'][0]
+        self.embedding_ln = (w[emb + 'LayerNorm.weight'], w[emb + 'LayerNorm.bias'])
+
+        self.layers = []
+        for i in range(self.num_layers):
+            p = f'bert.encoder.layer.{i}.'
+            att = p + 'attention.self.'
+            # 合并后的 QKV 权重 [hidden, 3 * hidden]，一次矩阵乘法得到 Q/K/V
+            qkv_weight = np.ascontiguousarray(np.concatenate(
+                [w[att + n + '.weight'] for n in ('query', 'key', 'value')], axis=0
+            ).T)
+            qkv_bias = np.concatenate([w[att + n + '.bias'] for n in ('query', 'key', 'value')])
+            self.layers.append({
+                'qkv': (qkv_weight, qkv_bias),
+                'attn_out': linear(p + 'attention.output.dense'),
+                'attn_ln': (w[p + 'attention.output.LayerNorm.weight'], w[p + 'attention.output.LayerNorm.bias']),
+                'ffn_in': linear(p + 'intermediate.dense'),
+                'ffn_out': linear(p + 'output.dense'),
+                'ffn_ln': (w[p + 'output.LayerNorm.weight'], w[p + 'output.LayerNorm.bias']),
+            })
+
+        self.pooler = linear('bert.pooler.dense')
+        self.classifier = linear('classifier')
+
+    def _get_buffers(self, batch, seq):
+        """按形状缓存的激活缓冲区"""
+        key = (batch, seq)
+        if key not in self._buffers:
+            if len(self._buffers) >= 16:
+                # 形状种类过多时（batch 大小变化频繁）清空，避免缓冲区无限增长
+                self._buffers.clear()
+            h = self.hidden_size
+            intermediate = self.layers[0]['ffn_in'][0].shape[1]
+            self._buffers[key] = {
+                'qkv': np.empty((batch, seq, 3 * h), dtype=np.float32),
+                'scores': np.empty((batch, self.num_heads, seq, seq), dtype=np.float32),
+                'ffn': np.empty((batch, seq, intermediate), dtype=np.float32),
+            }
+        return self._buffers[key]
+
+    def encode(self, texts):
+        return self.tokenizer.encode(texts)
+
+    def forward(self, inputs):
+        """返回 logits [batch, num_labels]"""
+        input_ids = np.asarray(inputs['input_ids'])
+        attention_mask = np.asarray(inputs['attention_mask'])
+
+        # 去掉整列都是 padding 的尾部位置
+        seq = max(int(attention_mask.sum(axis=1).max()), 1)
+        input_ids = input_ids[:, :seq]
+        attention_mask = attention_mask[:, :seq]
+        batch = input_ids.shape[0]
+
+        with self._lock:
+            buf = self._get_buffers(batch, seq)
+            x = (self.word_embeddings[input_ids]
+                 + self.position_embeddings[:seq]
+                 + self.token_type_embedding)
+            x = layer_norm(x, *self.embedding_ln, self.eps)
+
+            # 剩余的 padding 位置用大负数屏蔽 [batch, 1, 1, seq]
+            mask_bias = ((1.0 - attention_mask[:, None, None, :]) * np.finfo(np.float32).min).astype(np.float32)
+            scale = np.float32(1.0 / np.sqrt(self.head_dim))
+
+            for i, layer in enumerate(self.layers):
+                last = i == self.num_layers - 1
+                x = self._layer(x, layer, mask_bias, scale, buf, cls_only=last)
+
+            pooled = np.tanh(x[:, 0] @ self.pooler[0] + self.pooler[1])
+            return (pooled @ self.classifier[0] + self.classifier[1]).astype(np.float32)
+
+    def _layer(self, x, layer, mask_bias, scale, buf, cls_only):
+        batch, seq, h = x.shape
+        nh, dh = self.num_heads, self.head_dim
+
+        qkv = np.matmul(x, layer['qkv'][0], out=buf['qkv'])
+        qkv += layer['qkv'][1]
+        # [batch, seq, 3, heads, head_dim] -> 3 x [batch, heads, seq, head_dim]
+        q, k, v = qkv.reshape(batch, seq, 3, nh, dh).transpose(2, 0, 3, 1, 4)
+
+        if cls_only:
+            # 分类只用到 [CLS]，最后一层只算第一个位置的查询
+            q = q[:, :, :1]
+            x_residual = x[:, :1]
+            scores = np.matmul(q, k.transpose(0, 1, 3, 2))
+        else:
+            x_residual = x
+            scores = np.matmul(q, k.transpose(0, 1, 3, 2), out=buf['scores'])
+
+        scores *= scale
+        scores += mask_bias
+        scores -= scores.max(axis=-1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=-1, keepdims=True)
+
+        context = np.matmul(scores, v).transpose(0, 2, 1, 3).reshape(batch, -1, h)
+        attn = context @ layer['attn_out'][0] + layer['attn_out'][1]
+        x = layer_norm(attn + x_residual, *layer['attn_ln'], self.eps)
+
+        if cls_only:
+            ffn = x @ layer['ffn_in'][0]
+        else:
+            ffn = np.matmul(x, layer['ffn_in'][0], out=buf['ffn'])
+        ffn += layer['ffn_in'][1]
+        ffn = gelu(ffn)
+        out = ffn @ layer['ffn_out'][0] + layer['ffn_out'][1]
+        return layer_norm(out + x, *layer['ffn_ln'], self.eps)
+
+    def predict_proba(self, texts):
+        return softmax(self.forward(self.encode(texts)))
+
+
+def verify_numpy_engine(tolerance=1e-3, batch_size=32):
+    """在 val.json 上与 BertForSequenceClassification 比对 logits"""
+    import time
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    from inference_utils import load_labeled_texts, run_torch_batched
+
+    print("="*60)
+    print("Verifying NumPy BERT engine against PyTorch")
+    print("="*60)
+
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+
+    tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    torch_model = AutoModelForSequenceClassification.from_pretrained(PATH_CONFIG['model_save_path'])
+    start = time.perf_counter()
+    ref_logits = run_torch_batched(torch_model, tokenizer, texts, batch_size)
+    torch_seconds = time.perf_counter() - start
+
+    model = NumpyBertModel()
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    logits = np.zeros_like(ref_logits)
+    start = time.perf_counter()
+    for s in range(0, len(order), batch_size):
+        idx = order[s:s + batch_size]
+        logits[idx] = model.forward(model.encode([texts[i] for i in idx]))
+    numpy_seconds = time.perf_counter() - start
+
+    max_err = float(np.abs(logits - ref_logits).max())
+    agreement = float((logits.argmax(axis=1) == ref_logits.argmax(axis=1)).mean())
+    print(f"Samples: {len(texts)}")
+    print(f"Max logit error: {max_err:.6f} (tolerance {tolerance})")
+    print(f"Top-1 agreement: {agreement:.4f}")
+    print(f"Accuracy: torch {(ref_logits.argmax(1) == labels).mean():.4f}, "
+          f"numpy {(logits.argmax(1) == labels).mean():.4f}")
+    print(f"Throughput: torch {len(texts) / torch_seconds:.1f}/s, numpy {len(texts) / numpy_seconds:.1f}/s")
+
+    if max_err > tolerance:
+        print("✗ NumPy engine output differs from PyTorch")
+        return False
+    print("✓ NumPy engine matches PyTorch")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if verify_numpy_engine() else 1)
@@ -0,0 +1,145 @@
+"""
+ONNX 图优化：使用 ONNX Runtime transformer optimizer 融合
+Attention / LayerNorm / GELU / BiasAdd / EmbedLayerNorm 等算子，可选转换为 fp16，
+并记录优化前后的延迟以及在验证集上的一致性。
+"""
+
+import os
+import json
+import numpy as np
+from transformers import AutoConfig, AutoTokenizer
+from config import MODEL_CONFIG, PATH_CONFIG, EXPORT_CONFIG
+from inference_utils import (
+    create_onnx_session,
+    encode_texts,
+    load_labeled_texts,
+    measure_latency,
+    run_onnx_batched,
+)
+
+
+def resolve_fp16(use_fp16):
+    """解析 fp16 开关："auto" 时仅在 CUDA 可用时启用"""
+    if use_fp16 == "auto":
+        import onnxruntime as ort
+        return 'CUDAExecutionProvider' in ort.get_available_providers()
+    return bool(use_fp16)
+
+
+def optimize_onnx(onnx_path=None, output_path=None, use_fp16=None):
+    """融合 transformer 子图并保存为单独的优化模型"""
+    from onnxruntime.transformers import optimizer
+    from onnxruntime.transformers.fusion_options import FusionOptions
+
+    onnx_path = onnx_path or PATH_CONFIG['onnx_path']
+    output_path = output_path or PATH_CONFIG['onnx_optimized_path']
+    use_fp16 = resolve_fp16(EXPORT_CONFIG['onnx_fp16'] if use_fp16 is None else use_fp16)
+
+    print("\n" + "="*60)
+    print("Optimizing ONNX graph (transformer fusion)")
+    print("="*60)
+
+    # 从训练好的模型配置读取头数和隐藏层大小
+    model_config = AutoConfig.from_pretrained(PATH_CONFIG['model_save_path'])
+
+    fusion_options = FusionOptions('bert')
+    opt_model = optimizer.optimize_model(
+        onnx_path,
+        model_type='bert',
+        num_heads=model_config.num_attention_heads,
+        hidden_size=model_config.hidden_size,
+        optimization_options=fusion_options,
+    )
+
+    fused = opt_model.get_fused_operator_statistics()
+    print("Fused operators:")
+    for op, count in fused.items():
+        if count:
+            print(f"  {op}: {count}")
+
+    if use_fp16:
+        # 输入输出保持 int64 / float32，调用方无需修改
+        opt_model.convert_float_to_float16(keep_io_types=True)
+        print("✓ Converted to FP16")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    opt_model.save_model_to_file(output_path)
+
+    print(f"✓ Optimized model saved: {output_path}")
+    print(f"  Size: {os.path.getsize(onnx_path) / 1e6:.2f} MB -> {os.path.getsize(output_path) / 1e6:.2f} MB")
+
+    return output_path, {k: v for k, v in fused.items() if v}, use_fp16
+
+
+def compare_onnx_models(base_path, optimized_path, batch_size=64):
+    """比较优化前后的单条延迟和验证集一致性"""
+    tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+
+    base_session = create_onnx_session(base_path)
+    opt_session = create_onnx_session(optimized_path)
+
+    # 延迟：典型实时输入（单条、短文本）
+    sample = encode_texts(tokenizer, "哈哈哈笑死我了这也太搞笑了吧", return_tensors='np')
+    feed = {
+        'input_ids': sample['input_ids'].astype(np.int64),
+        'attention_mask': sample['attention_mask'].astype(np.int64)
+    }
+    base_ms = float(np.median(measure_latency(lambda: base_session.run(None, feed))))
+    opt_ms = float(np.median(measure_latency(lambda: opt_session.run(None, feed))))
+
+    # 一致性：整个验证集
+    base_logits = run_onnx_batched(base_session, tokenizer, texts, batch_size)
+    opt_logits = run_onnx_batched(opt_session, tokenizer, texts, batch_size)
+    base_preds = base_logits.argmax(axis=1)
+    opt_preds = opt_logits.argmax(axis=1)
+    abs_err = np.abs(base_logits - opt_logits)
+
+    return {
+        "latency_ms": {"base": base_ms, "optimized": opt_ms, "speedup": base_ms / opt_ms},
+        "parity": {
+            "num_samples": len(texts),
+            "max_logit_error": float(abs_err.max()),
+            "mean_logit_error": float(abs_err.mean()),
+            "top1_agreement": float((base_preds == opt_preds).mean()),
+            "base_accuracy": float((base_preds == labels).mean()),
+            "optimized_accuracy": float((opt_preds == labels).mean()),
+        },
+    }
+
+
+def optimize_and_report(onnx_path=None, use_fp16=None):
+    """优化 ONNX 模型并把延迟/一致性结果写入报告"""
+    onnx_path = onnx_path or PATH_CONFIG['onnx_path']
+    optimized_path, fused, fp16 = optimize_onnx(onnx_path, use_fp16=use_fp16)
+
+    print("\nComparing base vs optimized model...")
+    result = compare_onnx_models(onnx_path, optimized_path)
+
+    latency = result['latency_ms']
+    parity = result['parity']
+    print(f"  Latency (batch=1): {latency['base']:.2f} ms -> {latency['optimized']:.2f} ms "
+          f"({latency['speedup']:.2f}x)")
+    print(f"  Max logit error: {parity['max_logit_error']:.5f}, "
+          f"Mean: {parity['mean_logit_error']:.5f}")
+    print(f"  Top-1 agreement: {parity['top1_agreement']:.4f}")
+    print(f"  Accuracy: {parity['base_accuracy']:.4f} -> {parity['optimized_accuracy']:.4f}")
+
+    report = {
+        "base_model": onnx_path,
+        "optimized_model": optimized_path,
+        "fp16": fp16,
+        "max_length": MODEL_CONFIG['max_length'],
+        "fused_operators": fused,
+        **result,
+    }
+    with open(PATH_CONFIG['onnx_optimize_report'], 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✓ Report saved: {PATH_CONFIG['onnx_optimize_report']}")
+
+    return optimized_path
+
+
+if __name__ == "__main__":
+    optimize_and_report()
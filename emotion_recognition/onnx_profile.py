@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+ONNX 模型的算子级延迟剖析
+- 从 val.json 按分桶挑选真实文本，组成各 batch 大小 x 序列长度的输入
+- 在 ONNX Runtime 剖析模式下运行（每种形状先预热，预热的运行不计入统计）
+- 按算子类型、按编码层（embeddings / layer N / pooler+classifier）汇总耗时，打印排序后的报告
+- 输出 JSON 报告，以及可在 chrome://tracing 或 https://ui.perfetto.dev 中打开的 trace
+- --compare 与之前的报告逐项对比（验证融合、量化、剪枝等优化的效果）
+
+用法:
+    python onnx_profile.py                                   # 剖析 output/emoji_model.onnx
+    python onnx_profile.py --backend onnx_optimized --compare output/onnx_profile/onnx.json
+    python onnx_profile.py --model path/to/model.onnx --batch-sizes 1 16 --threads 4
+"""
+
+import os
+import re
+import json
+import shutil
+import argparse
+from bisect import bisect_right
+from collections import defaultdict
+import numpy as np
+from config import PATH_CONFIG, PROFILE_CONFIG
+from inference_utils import (
+    BucketedTokenizer,
+    backend_model_path,
+    create_onnx_session,
+    load_labeled_texts,
+)
+
+
+ONNX_BACKENDS = ("onnx", "onnx_optimized", "onnx_int8")
+LAYER_RE = re.compile(r'layer[._/]?(\d+)')
+
+
+def layer_of(node_name):
+    """节点所属的编码层（按导出时的节点名）；融合后丢失了层信息的节点归入 other"""
+    match = LAYER_RE.search(node_name)
+    if match:
+        return f"layer {int(match.group(1)):02d}"
+    name = node_name.lower()
+    if 'embedding' in name:
+        return "embeddings"
+    if 'pooler' in name or 'classifier' in name:
+        return "pooler+classifier"
+    return "other"
+
+
+def build_inputs(tokenizer, texts, batch_sizes):
+    """
+    每个分桶挑选真实长度落在该桶内的文本，按 batch 大小组成输入（文本不够时循环使用）
+    返回 [(batch_size, seq_len, feed)]
+    """
+    encoded = tokenizer.tokenizer.encode_batch(texts)
+    by_bucket = defaultdict(list)
+    for text, encoding in zip(texts, encoded):
+        seq_len = next((b for b in tokenizer.buckets if len(encoding.ids) <= b), tokenizer.buckets[-1])
+        by_bucket[seq_len].append(text)
+
+    shapes = []
+    for seq_len in tokenizer.buckets:
+        bucket_texts = by_bucket.get(seq_len)
+        if not bucket_texts:
+            print(f"  (no val.json texts fall into bucket {seq_len}, skipped)")
+            continue
+        for batch_size in batch_sizes:
+            batch = [bucket_texts[i % len(bucket_texts)] for i in range(batch_size)]
+            feed = tokenizer.encode(batch)
+            shapes.append((batch_size, feed['input_ids'].shape[1], {
+                'input_ids': feed['input_ids'].astype(np.int64),
+                'attention_mask': feed['attention_mask'].astype(np.int64),
+            }))
+    return shapes
+
+
+def run_profile(model_path, shapes, warmup, repeats, num_threads, output_dir):
+    """剖析模式下依次运行每种形状，返回 (trace 路径, 每次运行对应的形状序号，预热为 None)"""
+    prefix = os.path.join(output_dir, "ort_profile")
+    session = create_onnx_session(model_path, num_threads=num_threads, profile_prefix=prefix)
+    run_labels = []
+    for index, (batch_size, seq_len, feed) in enumerate(shapes):
+        for i in range(warmup + repeats):
+            session.run(None, feed)
+            run_labels.append(index if i >= warmup else None)
+        print(f"  batch {batch_size:>3} x seq {seq_len:>3}: {repeats} runs")
+    return session.end_profiling(), run_labels
+
+
+def aggregate(trace_path, shapes, run_labels):
+    """把 trace 中的节点事件按所属的 model_run 归到各形状，再按算子类型和编码层汇总"""
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        events = json.load(f)
+
+    runs = sorted((e for e in events if e.get('name') == 'model_run'), key=lambda e: e['ts'])
+    if len(runs) != len(run_labels):
+        raise RuntimeError(f"Expected {len(run_labels)} model_run events in the trace, found {len(runs)}")
+    run_starts = [r['ts'] for r in runs]
+
+    by_op = defaultdict(lambda: {"us": 0.0, "calls": 0})
+    by_layer = defaultdict(float)
+    by_shape = [{"run_us": 0.0, "op_us": defaultdict(float)} for _ in shapes]
+
+    for run, label in zip(runs, run_labels):
+        if label is not None:
+            by_shape[label]["run_us"] += run['dur']
+
+    for e in events:
+        if e.get('cat') != 'Node' or not e.get('name', '').endswith('_kernel_time'):
+            continue
+        i = bisect_right(run_starts, e['ts']) - 1
+        if i < 0 or run_labels[i] is None:
+            continue  # 会话初始化或预热
+        op_type = e.get('args', {}).get('op_name', 'unknown')
+        by_op[op_type]["us"] += e['dur']
+        by_op[op_type]["calls"] += 1
+        by_layer[layer_of(e['name'][:-len('_kernel_time')])] += e['dur']
+        by_shape[run_labels[i]]["op_us"][op_type] += e['dur']
+
+    counted_runs = sum(label is not None for label in run_labels)
+    total_us = sum(v["us"] for v in by_op.values()) or 1.0
+    ops = sorted(by_op.items(), key=lambda kv: -kv[1]["us"])
+    return {
+        "runs": counted_runs,
+        "op_types": [
+            {"op": op, "ms_per_run": v["us"] / counted_runs / 1000, "share": v["us"] / total_us,
+             "calls_per_run": v["calls"] / counted_runs, "us_per_call": v["us"] / v["calls"]}
+            for op, v in ops
+        ],
+        "layers": [
+            {"layer": name, "ms_per_run": us / counted_runs / 1000, "share": us / total_us}
+            for name, us in sorted(by_layer.items())
+        ],
+        "shapes": [
+            {
+                "batch_size": batch_size,
+                "seq_len": seq_len,
+                "mean_ms": stats["run_us"] / (counted_runs / len(shapes)) / 1000,
+                "top_ops": [
+                    {"op": op, "share": us / (sum(stats["op_us"].values()) or 1.0)}
+                    for op, us in sorted(stats["op_us"].items(), key=lambda kv: -kv[1])[:5]
+                ],
+            }
+            for (batch_size, seq_len, _), stats in zip(shapes, by_shape)
+        ],
+    }
+
+
+def print_report(report, baseline=None):
+    base_ops = {o["op"]: o for o in baseline["op_types"]} if baseline else {}
+    base_layers = {l["layer"]: l for l in baseline["layers"]} if baseline else {}
+    base_shapes = {(s["batch_size"], s["seq_len"]): s for s in baseline["shapes"]} if baseline else {}
+
+    def delta(now, before):
+        return f"{now - before:>+10.3f}" if before is not None else f"{'':>10}"
+
+    print("\n" + "="*60)
+    print(f"Per op type ({report['runs']} profiled runs, averaged per run)")
+    print("="*60)
+    print(f"{'op':<24}{'ms/run':>10}{'share':>8}{'calls':>7}{'us/call':>9}" + (f"{'Δms/run':>10}" if baseline else ""))
+    for o in report["op_types"]:
+        before = base_ops.get(o["op"], {}).get("ms_per_run", 0.0) if baseline else None
+        print(f"{o['op']:<24}{o['ms_per_run']:>10.3f}{o['share']:>8.1%}{o['calls_per_run']:>7.0f}"
+              f"{o['us_per_call']:>9.1f}" + (delta(o['ms_per_run'], before) if baseline else ""))
+    if baseline:
+        for op in sorted(set(base_ops) - {o["op"] for o in report["op_types"]}):
+            print(f"{op:<24}{'(gone)':>10}{'':>24}{delta(0.0, base_ops[op]['ms_per_run'])}")
+
+    print("\nPer encoder layer:")
+    for l in report["layers"]:
+        before = base_layers.get(l["layer"], {}).get("ms_per_run", 0.0) if baseline else None
+        print(f"  {l['layer']:<22}{l['ms_per_run']:>10.3f} ms {l['share']:>7.1%}"
+              + (delta(l['ms_per_run'], before) if baseline else ""))
+
+    print("\nPer input shape:")
+    for s in report["shapes"]:
+        top = ", ".join(f"{t['op']} {t['share']:.0%}" for t in s["top_ops"][:3])
+        before = base_shapes.get((s["batch_size"], s["seq_len"]))
+        change = f" (was {before['mean_ms']:.2f} ms)" if before else ""
+        print(f"  batch {s['batch_size']:>3} x seq {s['seq_len']:>3}: {s['mean_ms']:>8.2f} ms{change}  [{top}]")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-operator latency profile of an exported ONNX model")
+    parser.add_argument("--backend", choices=ONNX_BACKENDS, default="onnx")
+    parser.add_argument("--model", help="ONNX file (overrides --backend)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=PROFILE_CONFIG['batch_sizes'])
+    parser.add_argument("--warmup", type=int, default=PROFILE_CONFIG['warmup'])
+    parser.add_argument("--repeats", type=int, default=PROFILE_CONFIG['repeats'])
+    parser.add_argument("--threads", type=int, help="intra-op threads (default: ONNX Runtime's choice)")
+    parser.add_argument("--output-dir", default=PROFILE_CONFIG['output_dir'])
+    parser.add_argument("--compare", help="previous report JSON to diff against")
+    args = parser.parse_args()
+
+    model_path = args.model or backend_model_path(args.backend)
+    name = os.path.splitext(os.path.basename(model_path))[0] if args.model else args.backend
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    print("="*60)
+    print(f"Profiling {model_path}")
+    print("="*60)
+
+    texts, _ = load_labeled_texts(PATH_CONFIG['val_file'])
+    shapes = build_inputs(BucketedTokenizer(), texts, args.batch_sizes)
+    trace_path, run_labels = run_profile(model_path, shapes, args.warmup, args.repeats,
+                                         args.threads, args.output_dir)
+
+    report = aggregate(trace_path, shapes, run_labels)
+    report.update({"model": model_path, "threads": args.threads,
+                   "warmup": args.warmup, "repeats": args.repeats})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"\nComparing against {args.compare} ({baseline['model']})")
+    print_report(report, baseline)
+
+    chrome_trace = os.path.join(args.output_dir, f"{name}_trace.json")
+    shutil.move(trace_path, chrome_trace)
+    report_path = os.path.join(args.output_dir, f"{name}.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✓ Report saved: {report_path}")
+    print(f"✓ Chrome trace: {chrome_trace} (open in chrome://tracing or ui.perfetto.dev)")
+
+
+if __name__ == "__main__":
+    main()
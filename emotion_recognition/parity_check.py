@@ -0,0 +1,175 @@
+"""
+PyTorch 与 ONNX 后端的批量数值一致性检查
+将整个 val.json 分别跑过 PyTorch、fp32 ONNX、优化后 ONNX、INT8 ONNX，
+以 PyTorch 为基准统计 logit 误差、top-1 一致率、各 emoji 准确率变化和吞吐量。
+任一后端超过 PARITY_CONFIG 中的阈值时以非零状态退出，阻止破坏精度的优化被发布。
+缺少任一 ONNX 模型同样视为失败（没检查过的后端不能算通过），除非用 --allow-missing 显式放行。
+
+用法:
+    python parity_check.py [--report output/parity_report.json] [--batch-size 64]
+    python parity_check.py --allow-missing onnx_int8      # 本地还没有量化模型时
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from config import PATH_CONFIG, PARITY_CONFIG, EMOJI_LIST
+from inference_utils import (
+    create_onnx_session,
+    load_labeled_texts,
+    run_onnx_batched,
+    run_torch_batched,
+)
+
+
+ONNX_BACKENDS = {
+    "onnx_fp32": PATH_CONFIG['onnx_path'],
+    "onnx_optimized": PATH_CONFIG['onnx_optimized_path'],
+    "onnx_int8": PATH_CONFIG['onnx_int8_path'],
+}
+
+
+def per_emoji_accuracy(preds, labels):
+    """每个 emoji 的准确率（验证集中没有的 emoji 为 None）"""
+    result = {}
+    for i, emoji in enumerate(EMOJI_LIST):
+        mask = labels == i
+        result[emoji] = float((preds[mask] == i).mean()) if mask.any() else None
+    return result
+
+
+def compare_backend(name, logits, ref_logits, labels, seconds):
+    """以 PyTorch 结果为基准比较一个后端"""
+    preds = logits.argmax(axis=1)
+    ref_preds = ref_logits.argmax(axis=1)
+    abs_err = np.abs(logits - ref_logits)
+
+    ref_per_emoji = per_emoji_accuracy(ref_preds, labels)
+    per_emoji_delta = {
+        emoji: (acc - ref_per_emoji[emoji]) if acc is not None else None
+        for emoji, acc in per_emoji_accuracy(preds, labels).items()
+    }
+
+    return {
+        "backend": name,
+        "max_logit_error": float(abs_err.max()),
+        "mean_logit_error": float(abs_err.mean()),
+        "top1_agreement": float((preds == ref_preds).mean()),
+        "accuracy": float((preds == labels).mean()),
+        "accuracy_delta": float((preds == labels).mean() - (ref_preds == labels).mean()),
+        "per_emoji_accuracy_delta": per_emoji_delta,
+        "throughput": len(labels) / seconds,
+    }
+
+
+def check_tolerance(result):
+    """返回超出阈值的项（空列表表示通过）"""
+    tol = PARITY_CONFIG['tolerances'].get(result['backend'])
+    if tol is None:
+        return []
+
+    failures = []
+    if result['max_logit_error'] > tol['max_logit_error']:
+        failures.append(f"max_logit_error {result['max_logit_error']:.5f} > {tol['max_logit_error']}")
+    if result['top1_agreement'] < tol['min_top1_agreement']:
+        failures.append(f"top1_agreement {result['top1_agreement']:.4f} < {tol['min_top1_agreement']}")
+    if -result['accuracy_delta'] > tol['max_accuracy_drop']:
+        failures.append(f"accuracy drop {-result['accuracy_delta']:.4f} > {tol['max_accuracy_drop']}")
+    return failures
+
+
+def run_parity(batch_size, allow_missing=()):
+    """运行所有 ONNX 后端并比较；allow_missing 中的后端缺少模型时跳过，其余缺少模型即失败"""
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+    print(f"Validation samples: {len(texts)}, batch size: {batch_size}")
+
+    tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    model = AutoModelForSequenceClassification.from_pretrained(PATH_CONFIG['model_save_path'])
+
+    start = time.perf_counter()
+    ref_logits = run_torch_batched(model, tokenizer, texts, batch_size)
+    torch_seconds = time.perf_counter() - start
+    ref_acc = float((ref_logits.argmax(axis=1) == labels).mean())
+    print(f"\n[pytorch] accuracy: {ref_acc:.4f}, throughput: {len(texts) / torch_seconds:.1f} samples/s")
+
+    results = [{
+        "backend": "pytorch",
+        "accuracy": ref_acc,
+        "throughput": len(texts) / torch_seconds,
+    }]
+    failed = False
+
+    for name, onnx_path in ONNX_BACKENDS.items():
+        if not os.path.exists(onnx_path):
+            if name in allow_missing:
+                print(f"\n[{name}] ⚠️ skipped: {onnx_path} not found (allowed by --allow-missing)")
+                results.append({"backend": name, "skipped": True})
+                continue
+            print(f"\n[{name}] ✗ FAIL")
+            print(f"  ✗ model not found: {onnx_path}")
+            results.append({"backend": name, "passed": False, "failures": [f"model not found: {onnx_path}"]})
+            failed = True
+            continue
+
+        session = create_onnx_session(onnx_path)
+        start = time.perf_counter()
+        logits = run_onnx_batched(session, tokenizer, texts, batch_size)
+        seconds = time.perf_counter() - start
+
+        result = compare_backend(name, logits, ref_logits, labels, seconds)
+        failures = check_tolerance(result)
+        result['passed'] = not failures
+        result['failures'] = failures
+        results.append(result)
+
+        print(f"\n[{name}] {'✓ PASS' if not failures else '✗ FAIL'}")
+        print(f"  Max logit error:  {result['max_logit_error']:.5f}")
+        print(f"  Mean logit error: {result['mean_logit_error']:.5f}")
+        print(f"  Top-1 agreement:  {result['top1_agreement']:.4f}")
+        print(f"  Accuracy:         {result['accuracy']:.4f} ({result['accuracy_delta']:+.4f})")
+        print(f"  Throughput:       {result['throughput']:.1f} samples/s")
+        changed = {e: d for e, d in result['per_emoji_accuracy_delta'].items() if d}
+        if changed:
+            print("  Per-emoji accuracy delta: " + ", ".join(f"{e} {d:+.2f}" for e, d in changed.items()))
+        for failure in failures:
+            print(f"  ✗ {failure}")
+        failed = failed or bool(failures)
+
+    return results, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX parity check on val.json")
+    parser.add_argument("--batch-size", type=int, default=PARITY_CONFIG['batch_size'])
+    parser.add_argument("--report", default=os.path.join(PATH_CONFIG['output_dir'], "parity_report.json"))
+    parser.add_argument("--allow-missing", nargs="+", default=[], choices=list(ONNX_BACKENDS), metavar="BACKEND",
+                        help=f"backends that may be absent ({', '.join(ONNX_BACKENDS)}); missing ones fail otherwise")
+    args = parser.parse_args()
+
+    print("="*60)
+    print("PyTorch vs ONNX parity check")
+    print("="*60)
+
+    torch.set_grad_enabled(False)
+    results, failed = run_parity(args.batch_size, args.allow_missing)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump({"results": results, "tolerances": PARITY_CONFIG['tolerances']}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"\nReport saved: {args.report}")
+
+    if failed:
+        print("\n✗ Parity check failed")
+        sys.exit(1)
+    skipped = [r['backend'] for r in results if r.get('skipped')]
+    print("\n✓ All backends within tolerance" + (f" (not checked: {', '.join(skipped)})" if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+本地实时预测服务
+每个 TCP 连接对应一个 RealtimeEmotionPredictor 会话（独立的输入缓存，共享同一个模型），
+协议为按行分隔的 JSON：
+
+    → {"op": "type", "text": "哈", "seq": 1}
+    ← {"seq": 1, "text": "哈哈", "emoji": "😂", "confidence": 0.93, "server_ms": 4.1}
+    → {"op": "clear"}                          清空本会话的缓存
+    → {"op": "stats"}                          服务进程的 CPU / 内存（prefork 模式下含各工作进程的 RSS / PSS）
+    → {"op": "reload", "path": "..."}          热更新模型（path 可省略，默认重新加载当前路径）
+
+--workers N 时为 prefork 模式（见 prefork.py）：父进程加载一次模型后 fork 出 N 个推理进程共享权重，
+请求分发给空闲的进程；此模式下不支持热更新。
+
+用法:
+    python predict_server.py [--port 8765] [--backend onnx] [--watch]
+    python predict_server.py --workers 4 --threads-per-worker 2 [--backend numpy]
+"""
+
+import sys
+import json
+import time
+import argparse
+import socketserver
+from config import SERVER_CONFIG, METRICS_CONFIG
+from inference_utils import BACKENDS, backend_model_path, load_backend, process_stats
+from hot_reload import ReloadableModel
+from metrics import PredictorMetrics, start_metrics_server
+from test_realtime import RealtimeEmotionPredictor
+
+
+class PredictionHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        session = RealtimeEmotionPredictor(
+            model=self.server.model, metrics=self.server.metrics, verbose=False
+        )
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                request = {}
+                try:
+                    request = json.loads(line)
+                    reply = self.dispatch(session, request)
+                except Exception as e:
+                    reply = {"seq": request.get('seq') if isinstance(request, dict) else None, "error": str(e)}
+                self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode('utf-8'))
+                self.wfile.flush()
+        finally:
+            session.close()
+
+    def dispatch(self, session, request):
+        op = request.get('op', 'type')
+        reply = {"seq": request.get('seq')}
+        if op == 'type':
+            start = time.perf_counter()
+            session.add_text(request.get('text', ''))
+            text = session.get_cached_text()
+            emoji, confidence = session.predict(text)
+            reply.update({
+                "text": text,
+                "emoji": emoji,
+                "confidence": confidence,
+                "server_ms": (time.perf_counter() - start) * 1000,
+            })
+        elif op == 'clear':
+            session.clear()
+        elif op == 'stats':
+            reply.update(process_stats())
+            if hasattr(self.server.model, 'memory_stats'):
+                reply['memory'] = self.server.model.memory_stats()
+        elif op == 'reload':
+            if not hasattr(self.server.model, 'reload'):
+                raise ValueError("Model does not support reload")
+            reply.update(self.server.model.reload(request.get('path')))
+        else:
+            raise ValueError(f"Unknown op: {op}")
+        return reply
+
+
+def report_reload(report, error):
+    if error is not None:
+        print(f"✗ Reload failed, keeping current model: {error}")
+    else:
+        print(f"✓ Reloaded generation {report['generation']} from {report['model_path']} "
+              f"(load {report['load_ms']:.0f} ms, warmup {report['warmup_ms']:.0f} ms)")
+
+
+class PredictionServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, model, metrics=None):
+        super().__init__(address, PredictionHandler)
+        self.model = model
+        self.metrics = metrics or PredictorMetrics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local realtime emoji prediction server")
+    parser.add_argument("--host", default=SERVER_CONFIG['host'])
+    parser.add_argument("--port", type=int, default=SERVER_CONFIG['port'])
+    parser.add_argument("--backend", choices=BACKENDS, default=SERVER_CONFIG['backend'])
+    parser.add_argument("--metrics-port", type=int, default=METRICS_CONFIG['port'])
+    parser.add_argument("--no-metrics", action="store_true")
+    parser.add_argument("--model-path", help="model directory (torch/numpy) or .onnx file")
+    parser.add_argument("--watch", action="store_true", help="hot-reload when the model files change")
+    parser.add_argument("--workers", type=int, default=SERVER_CONFIG['workers'],
+                        help="prefork inference processes sharing one copy of the weights (0: single process)")
+    parser.add_argument("--threads-per-worker", type=int, default=SERVER_CONFIG['threads_per_worker'])
+    args = parser.parse_args()
+
+    print("="*60)
+    print(f"Loading backend: {args.backend}")
+    if args.workers:
+        from prefork import PREFORK_BACKENDS, WorkerPool
+
+        if args.backend not in PREFORK_BACKENDS:
+            print(f"✗ --workers requires one of the backends {PREFORK_BACKENDS}")
+            sys.exit(1)
+        if args.watch:
+            print("✗ --watch is not supported with --workers")
+            sys.exit(1)
+        # 在启动任何线程之前 fork
+        model = WorkerPool(
+            load_backend(args.backend, model_path=args.model_path or backend_model_path(args.backend), warmup=False),
+            args.workers, args.threads_per_worker
+        )
+        print(f"✓ {args.workers} workers x {args.threads_per_worker} threads")
+    else:
+        model = ReloadableModel(
+            lambda path: load_backend(args.backend, model_path=path, warmup=False),
+            args.model_path or backend_model_path(args.backend)
+        )
+    if args.watch:
+        model.watch(callback=report_reload)
+        print(f"✓ Watching {model.model_path}")
+
+    server = PredictionServer((args.host, args.port), model)
+    print(f"✓ Serving on {args.host}:{args.port}")
+    if not args.no_metrics:
+        start_metrics_server(args.metrics_port)
+        print(f"✓ Metrics on http://{METRICS_CONFIG['host']}:{args.metrics_port}/metrics")
+    print("="*60)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+        if hasattr(model, 'close'):
+            model.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+prefork 多进程推理
+父进程加载一次模型（torch / numpy 后端的权重是 model.safetensors 的内存映射），然后 fork 出工作进程：
+- 工作进程继承父进程的地址空间，权重页和其余只读内存在所有进程间共享，不会各自复制一份
+- 每个工作进程绑定到自己的一组 CPU 核，并把算子内线程数限制为这组核的数量
+- 父进程只做 I/O 和会话管理，每个请求交给当前空闲的工作进程（按请求负载均衡）
+
+父进程在 fork 之前不能跑推理：torch / OpenMP 的线程池在 fork 之后的子进程中不可用，
+所以模型以 warmup=False 加载，预热在各工作进程中进行。
+
+用法:
+    python predict_server.py --workers 4 --threads-per-worker 2 --backend numpy
+"""
+
+import os
+import gc
+import time
+import queue
+import threading
+import multiprocessing as mp
+import numpy as np
+
+# 权重可以内存映射、fork 后共享的后端；ONNX Runtime 的会话不能跨 fork 使用
+PREFORK_BACKENDS = ("torch", "numpy")
+
+
+def worker_cores(slot, threads):
+    """第 slot 个工作进程使用的 CPU 核（核不够时轮转复用）"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    start = (slot * threads) % len(cores)
+    return cores[start:start + threads] or cores
+
+
+def limit_threads(model, threads):
+    """在工作进程中限制算子内线程数"""
+    torch = getattr(model, 'torch', None)
+    if torch is not None:
+        torch.set_num_threads(threads)
+        return
+    # numpy 的 BLAS 线程池在导入时已按环境变量创建，只能用 threadpoolctl 调整
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        print(f"⚠️ [worker {os.getpid()}] threadpoolctl not installed, BLAS threads not limited "
+              f"(set OMP_NUM_THREADS={threads} before starting the server)")
+
+
+def warmup(model):
+    from inference_utils import get_seq_buckets
+
+    start = time.perf_counter()
+    for bucket in get_seq_buckets():
+        model.predict_proba(["好" * max(1, bucket - 2)])
+    return (time.perf_counter() - start) * 1000
+
+
+def _worker_main(model, conn, cores, threads):
+    """工作进程：收到文本列表，返回概率；连接关闭时退出"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    limit_threads(model, threads)
+    conn.send(("ready", warmup(model)))
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send(("ok", model.predict_proba(texts)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def memory_of(pid):
+    """进程的 RSS 和 PSS（MB）；PSS 按共享进程数分摊共享页，各进程的 PSS 之和即实际占用"""
+    stats = {"pid": pid, "rss_mb": None, "pss_mb": None}
+    path = f"/proc/{pid}/smaps_rollup"
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.startswith("Rss:"):
+                    stats["rss_mb"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("Pss:"):
+                    stats["pss_mb"] = round(int(line.split()[1]) / 1024, 1)
+    return stats
+
+
+class WorkerPool:
+    """
+    与推理后端一致的 predict_proba 接口，请求交给空闲的工作进程
+    工作进程意外退出时在下一次分派到它时重新 fork
+    """
+
+    def __init__(self, model, workers, threads_per_worker=1):
+        self.model = model
+        self.threads = threads_per_worker
+        self.ctx = mp.get_context('fork')
+        self.processes = [None] * workers
+        self.conns = [None] * workers
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.restarts = 0
+
+        # 把父进程已有的对象移出 GC 跟踪，避免子进程中的垃圾回收写这些页、触发写时复制
+        gc.freeze()
+        for slot in range(workers):
+            self._start(slot)
+        for slot in range(workers):
+            status, warmup_ms = self.conns[slot].recv()
+            print(f"  worker {slot} (pid {self.processes[slot].pid}) ready, "
+                  f"cores {worker_cores(slot, self.threads)}, warmup {warmup_ms:.0f} ms")
+            self.idle.put(slot)
+
+    def _start(self, slot):
+        parent_conn, child_conn = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(self.model, child_conn, worker_cores(slot, self.threads), self.threads),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.processes[slot] = process
+        self.conns[slot] = parent_conn
+
+    def _restart(self, slot):
+        with self.lock:
+            self.conns[slot].close()
+            self.processes[slot].join(timeout=1)
+            self._start(slot)
+            self.restarts += 1
+            self.conns[slot].recv()  # 等待预热完成
+
+    def predict_proba(self, texts):
+        slot = self.idle.get()
+        try:
+            self.conns[slot].send(texts)
+            status, payload = self.conns[slot].recv()
+        except (EOFError, OSError) as e:
+            print(f"⚠️ Worker {slot} died ({e}), restarting")
+            self._restart(slot)
+            raise RuntimeError(f"Worker {slot} died while handling the request") from None
+        finally:
+            self.idle.put(slot)
+        if status == "error":
+            raise RuntimeError(payload)
+        return np.asarray(payload)
+
+    def memory_stats(self):
+        """父进程和各工作进程的内存；total_pss_mb 是整个服务的实际内存占用"""
+        processes = [memory_of(os.getpid())] + [memory_of(p.pid) for p in self.processes]
+        pss = [p["pss_mb"] for p in processes if p["pss_mb"] is not None]
+        return {
+            "workers": len(self.processes),
+            "restarts": self.restarts,
+            "processes": processes,
+            "total_rss_mb": round(sum(p["rss_mb"] or 0 for p in processes), 1),
+            "total_pss_mb": round(sum(pss), 1) if pss else None,
+        }
+
+    def close(self):
+        for conn in self.conns:
+            conn.close()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
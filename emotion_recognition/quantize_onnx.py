@@ -0,0 +1,284 @@
+"""
+ONNX 静态 INT8 量化（逐通道、QDQ 格式）
+从 dataset/train.json 中按固定随机种子抽样作为校准数据，
+并在 val.json 上对比 fp32 与 int8 的准确率。
+
+与 CoreML 的权重量化不同，这条路径可以在 x86 Linux CI 上完整复现：
+- 校准样本由固定种子抽样、顺序固定
+- 激活和权重都使用 S8S8（QDQ 格式），避免 x86 非 VNNI 指令集上 U8S8 的饱和问题
+- 推理时开启确定性计算，报告中记录量化模型的 sha256
+- 复现性检查：把整个量化流程再跑一遍输出到另一个文件，要求 sha256 相同、验证集 logits 逐位一致
+"""
+
+import os
+import sys
+import json
+import random
+import hashlib
+import numpy as np
+from onnxruntime.quantization import CalibrationDataReader
+from transformers import AutoTokenizer
+from config import PATH_CONFIG, QUANT_CONFIG
+from inference_utils import (
+    create_onnx_session,
+    encode_texts,
+    get_seq_buckets,
+    load_labeled_texts,
+    run_onnx_batched,
+)
+
+
+class EmojiCalibrationDataReader(CalibrationDataReader):
+    """
+    流式校准数据读取器
+    每次 get_next() 只对一个 batch 分词，避免一次性把全部校准数据放进内存
+    """
+
+    def __init__(self, tokenizer, texts, batch_size):
+        self.tokenizer = tokenizer
+        self.texts = texts
+        self.batch_size = batch_size
+        self._batches = self._iter_batches()
+
+    def _iter_batches(self):
+        for start in range(0, len(self.texts), self.batch_size):
+            # 校准时统一补齐到最大桶，保证各层的激活范围覆盖所有序列长度
+            inputs = encode_texts(
+                self.tokenizer,
+                self.texts[start:start + self.batch_size],
+                return_tensors='np',
+                buckets=get_seq_buckets()[-1:]
+            )
+            yield {
+                'input_ids': inputs['input_ids'].astype(np.int64),
+                'attention_mask': inputs['attention_mask'].astype(np.int64)
+            }
+
+    def get_next(self):
+        return next(self._batches, None)
+
+    def rewind(self):
+        self._batches = self._iter_batches()
+
+
+def sample_calibration_texts(num_samples=None, seed=None):
+    """按固定种子从训练集抽样校准文本"""
+    num_samples = num_samples or QUANT_CONFIG['calibration_samples']
+    seed = QUANT_CONFIG['seed'] if seed is None else seed
+
+    texts, _ = load_labeled_texts(PATH_CONFIG['train_file'])
+    rng = random.Random(seed)
+    if num_samples < len(texts):
+        texts = rng.sample(texts, num_samples)
+    return texts
+
+
+def file_sha256(path):
+    """计算文件 sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def preprocess_for_quantization(onnx_path, preprocessed_path, skip_symbolic_shape=None):
+    """
+    量化前预处理：形状推断 + 图优化，返回实际使用的 skip_symbolic_shape
+    None 为自动：先做符号形状推断，失败时（如 onnxruntime 1.31 上的 BERT 报
+    "Incomplete symbolic shape inference"）跳过符号推断重试
+    """
+    from functools import partial
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # 权重统一写到固定文件名的外部数据中：导出的 fp32 模型带 .onnx.data 时，
+    # 跳过符号推断后 ORT 优化器输出的模型才能找到权重，文件名固定也便于清理
+    pre_process = partial(
+        quant_pre_process,
+        onnx_path,
+        preprocessed_path,
+        save_as_external_data=True,
+        all_tensors_to_one_file=True,
+        external_data_location=os.path.basename(preprocessed_path) + '.data',
+    )
+
+    if skip_symbolic_shape is None:
+        try:
+            pre_process(skip_symbolic_shape=False)
+            return False
+        except Exception as e:  # symbolic_shape_infer 直接抛出 Exception
+            print(f"⚠️  Symbolic shape inference failed ({e}), retrying with skip_symbolic_shape=True")
+            skip_symbolic_shape = True
+
+    pre_process(skip_symbolic_shape=skip_symbolic_shape)
+    return skip_symbolic_shape
+
+
+def quantize_onnx_static(onnx_path=None, output_path=None, skip_symbolic_shape=None):
+    """
+    静态量化 fp32 ONNX 模型为 INT8（QDQ）
+    返回 (输出路径, 实际使用的 skip_symbolic_shape)；重跑时传入同一取值才能得到相同的模型
+    """
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+
+    if skip_symbolic_shape is None:
+        skip_symbolic_shape = QUANT_CONFIG['skip_symbolic_shape']
+    onnx_path = onnx_path or PATH_CONFIG['onnx_path']
+    output_path = output_path or PATH_CONFIG['onnx_int8_path']
+
+    print("\n" + "="*60)
+    print("Static INT8 quantization (ONNX, QDQ, per-channel)")
+    print("="*60)
+
+    # 预处理：符号形状推断 + 图优化，量化前推荐步骤
+    preprocessed_path = output_path.replace('.onnx', '_preprocessed.onnx')
+    try:
+        skip_symbolic_shape = preprocess_for_quantization(
+            onnx_path, preprocessed_path, skip_symbolic_shape
+        )
+
+        tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+        calib_texts = sample_calibration_texts()
+        print(f"Calibration samples: {len(calib_texts)} (seed={QUANT_CONFIG['seed']})")
+
+        reader = EmojiCalibrationDataReader(
+            tokenizer, calib_texts, QUANT_CONFIG['calibration_batch_size']
+        )
+
+        quantize_static(
+            preprocessed_path,
+            output_path,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=QUANT_CONFIG['per_channel'],
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=getattr(CalibrationMethod, QUANT_CONFIG['calibration_method']),
+        )
+    finally:
+        # 量化失败时也不留下预处理的中间模型
+        for path in (preprocessed_path, preprocessed_path + '.data'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f"✓ INT8 model saved: {output_path}")
+    print(f"  Size: {os.path.getsize(onnx_path) / 1e6:.2f} MB -> {os.path.getsize(output_path) / 1e6:.2f} MB")
+
+    return output_path, skip_symbolic_shape
+
+
+def create_deterministic_session(onnx_path):
+    """CPU 单线程 + 确定性计算，保证 CI 上的结果可以逐位复现"""
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    options.use_deterministic_compute = True
+    return ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+def evaluate_int8(fp32_path=None, int8_path=None):
+    """在验证集上对比 fp32 与 int8 模型"""
+    fp32_path = fp32_path or PATH_CONFIG['onnx_path']
+    int8_path = int8_path or PATH_CONFIG['onnx_int8_path']
+
+    tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+    texts, labels = load_labeled_texts(PATH_CONFIG['val_file'])
+    labels = np.array(labels)
+
+    fp32_logits = run_onnx_batched(create_onnx_session(fp32_path), tokenizer, texts)
+    int8_logits = run_onnx_batched(create_deterministic_session(int8_path), tokenizer, texts)
+
+    fp32_preds = fp32_logits.argmax(axis=1)
+    int8_preds = int8_logits.argmax(axis=1)
+    fp32_acc = float((fp32_preds == labels).mean())
+    int8_acc = float((int8_preds == labels).mean())
+
+    return {
+        "num_samples": len(texts),
+        "fp32_accuracy": fp32_acc,
+        "int8_accuracy": int8_acc,
+        "accuracy_delta": int8_acc - fp32_acc,
+        "top1_agreement": float((fp32_preds == int8_preds).mean()),
+        "max_logit_error": float(np.abs(fp32_logits - int8_logits).max()),
+    }
+
+
+def check_reproducibility(fp32_path, int8_path, skip_symbolic_shape):
+    """
+    重新量化一次（预处理、校准抽样、quantize_static 全部重跑）输出到另一个文件，
+    与 int8_path 比较 sha256 和验证集 logits；相当于 CI 上重新构建的结果
+    skip_symbolic_shape 使用首次量化实际采用的取值，保证两次走同一条预处理路径
+    """
+    rerun_path = int8_path.replace('.onnx', '_rerun.onnx')
+    try:
+        quantize_onnx_static(fp32_path, rerun_path, skip_symbolic_shape)
+
+        tokenizer = AutoTokenizer.from_pretrained(PATH_CONFIG['model_save_path'])
+        texts, _ = load_labeled_texts(PATH_CONFIG['val_file'])
+        logits = run_onnx_batched(create_deterministic_session(int8_path), tokenizer, texts)
+        rerun_logits = run_onnx_batched(create_deterministic_session(rerun_path), tokenizer, texts)
+
+        rerun_sha256 = file_sha256(rerun_path)
+    finally:
+        if os.path.exists(rerun_path):
+            os.remove(rerun_path)
+
+    same_file = rerun_sha256 == file_sha256(int8_path)
+    same_logits = bool(np.array_equal(logits, rerun_logits))
+    return {
+        "rerun_sha256": rerun_sha256,
+        "sha256_match": same_file,
+        "logits_match": same_logits,
+        "rerun_max_logit_diff": float(np.abs(logits - rerun_logits).max()),
+        "deterministic": same_file and same_logits,
+    }
+
+
+def main():
+    """量化并生成报告"""
+    fp32_path = sys.argv[1] if len(sys.argv) > 1 else PATH_CONFIG['onnx_path']
+    if not os.path.exists(fp32_path):
+        print(f"Error: ONNX file not found: {fp32_path}")
+        print("Please run export_onnx.py first.")
+        sys.exit(1)
+
+    int8_path, skip_symbolic_shape = quantize_onnx_static(fp32_path)
+
+    print("\nEvaluating fp32 vs int8 on validation set...")
+    result = evaluate_int8(fp32_path, int8_path)
+    print(f"  FP32 accuracy: {result['fp32_accuracy']:.4f}")
+    print(f"  INT8 accuracy: {result['int8_accuracy']:.4f} ({result['accuracy_delta']:+.4f})")
+    print(f"  Top-1 agreement: {result['top1_agreement']:.4f}")
+
+    print("\nRe-running quantization to check reproducibility...")
+    result.update(check_reproducibility(fp32_path, int8_path, skip_symbolic_shape))
+    print(f"  {'✓' if result['sha256_match'] else '✗'} Same sha256 on re-quantization")
+    print(f"  {'✓' if result['logits_match'] else '✗'} Bit-identical validation logits "
+          f"(max diff {result['rerun_max_logit_diff']:.2e})")
+
+    report = {
+        "fp32_model": fp32_path,
+        "int8_model": int8_path,
+        "int8_sha256": file_sha256(int8_path),
+        "quant_config": QUANT_CONFIG,
+        "skip_symbolic_shape": skip_symbolic_shape,
+        **result,
+    }
+    with open(PATH_CONFIG['onnx_quantize_report'], 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✓ Report saved: {PATH_CONFIG['onnx_quantize_report']}")
+
+    if not result['deterministic']:
+        print("✗ INT8 quantization is not reproducible")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
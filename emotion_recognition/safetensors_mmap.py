@@ -0,0 +1,75 @@
+"""
+safetensors 文件的零拷贝读取
+直接解析 safetensors 头部，用内存映射把权重文件映射进来，
+张量只是映射区域上的视图：启动时不读取、不复制权重，访问时由操作系统按页加载。
+
+格式：8 字节小端 u64 头部长度 N | N 字节 JSON 头部 | 原始数据
+头部：{name: {"dtype": "F32", "shape": [...], "data_offsets": [begin, end]}, "__metadata__": {...}}
+"""
+
+import os
+import json
+import struct
+
+
+def find_weights_file(model_path):
+    """模型目录中的 safetensors 权重文件（不存在时返回 None）"""
+    path = os.path.join(model_path, "model.safetensors")
+    return path if os.path.exists(path) else None
+
+
+def read_header(path):
+    """读取 safetensors 头部，返回 (张量描述字典, 数据区起始偏移)"""
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header, 8 + header_size
+
+
+def load_torch_mmap(path):
+    """以内存映射方式加载为 torch 张量字典（写时复制映射，不修改文件）"""
+    import torch
+
+    dtypes = {
+        "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+        "I64": torch.int64, "I32": torch.int32, "U8": torch.uint8, "BOOL": torch.bool,
+    }
+
+    header, data_start = read_header(path)
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    raw = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    tensors = {}
+    for name, info in header.items():
+        dtype = dtypes[info["dtype"]]
+        begin, end = info["data_offsets"]
+        chunk = raw[data_start + begin:data_start + end]
+        itemsize = torch.empty(0, dtype=dtype).element_size()
+        if (data_start + begin) % itemsize:
+            # 未对齐时无法直接重解释类型，只能复制这一个张量
+            chunk = chunk.clone()
+        tensors[name] = chunk.view(dtype).view(info["shape"])
+    return tensors
+
+
+def load_numpy_mmap(path):
+    """以只读内存映射方式加载为 numpy 数组字典（多进程间共享同一份物理页）"""
+    import numpy as np
+
+    dtypes = {"F32": np.float32, "F16": np.float16, "I64": np.int64, "I32": np.int32, "U8": np.uint8}
+
+    header, data_start = read_header(path)
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+
+    arrays = {}
+    for name, info in header.items():
+        if info["dtype"] not in dtypes:
+            raise ValueError(f"Unsupported dtype for numpy: {info['dtype']} ({name})")
+        begin, end = info["data_offsets"]
+        chunk = raw[data_start + begin:data_start + end]
+        dtype = np.dtype(dtypes[info["dtype"]])
+        if (data_start + begin) % dtype.itemsize:
+            chunk = chunk.copy()
+        arrays[name] = chunk.view(dtype).reshape(info["shape"])
+    return arrays
@@ -4,15 +4,24 @@
 - 缓存10秒内的输入
 - 最多保留20个字
 - 实时预测情绪并显示对应emoji
+- 运行指标（分词/前向/端到端耗时、缓存命中等）以 Prometheus 格式暴露；
+  缓存命中指预测循环发现缓存文本未变化、直接沿用上一次结果
+
+- 支持模型热更新：输入 reload 重新加载，或 --watch 监视模型目录自动加载
+
+用法:
+    python test_realtime.py               # 指标端点 http://127.0.0.1:9464/metrics
+    python test_realtime.py --no-metrics  # 不启动指标端点
+    python test_realtime.py --watch       # 模型目录变化后自动热更新
 """
 
-import torch
 import json
 import time
 import threading
 import sys
 from collections import deque
-from transformers import BertTokenizer, BertForSequenceClassification
+from inference_utils import encode_texts, softmax
+from metrics import PredictorMetrics, start_metrics_server
 
 # 配置
 MODEL_PATH = "./output/emoji_model"
@@ -22,17 +31,47 @@ CACHE_TIMEOUT = 10  # 缓存超时时间（秒）
 PREDICTION_INTERVAL = 0.5  # 预测间隔（秒）
 
 
-class RealtimeEmotionPredictor:
-    def __init__(self):
-        print("加载模型中...")
+class TorchEmotionModel:
+    """默认推理后端：transformers + PyTorch（torch 在这里才导入）"""
+    
+    def __init__(self, model_path=MODEL_PATH):
+        import torch
+        from transformers import BertTokenizer, BertForSequenceClassification
+        
+        self.torch = torch
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"使用设备: {self.device}")
         
         # 加载模型和tokenizer
-        self.tokenizer = BertTokenizer.from_pretrained(MODEL_PATH)
-        self.model = BertForSequenceClassification.from_pretrained(MODEL_PATH)
+        self.tokenizer = BertTokenizer.from_pretrained(model_path)
+        self.model = BertForSequenceClassification.from_pretrained(model_path)
         self.model.to(self.device)
         self.model.eval()
+    
+    def encode(self, texts):
+        # 补齐到能容纳文本的最小分桶长度，而不是固定的128
+        return encode_texts(self.tokenizer, texts, return_tensors='pt')
+    
+    def forward(self, inputs):
+        with self.torch.no_grad():
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            return self.model(**inputs).logits.cpu().numpy()
+    
+    def predict_proba(self, texts):
+        return softmax(self.forward(self.encode(texts)))
+
+
+class RealtimeEmotionPredictor:
+    def __init__(self, model=None, metrics=None, verbose=True):
+        """
+        model: 任意提供 encode/forward/predict_proba 的推理后端，默认使用 PyTorch
+        metrics: PredictorMetrics，默认注册到全局 REGISTRY
+        verbose: 为 False 时不打印加载信息（服务端/压测中每个会话一个实例）
+        """
+        if verbose:
+            print("加载模型中...")
+        self.model = model or TorchEmotionModel()
+        self.metrics = metrics or PredictorMetrics()
         
         # 加载emoji映射 (格式: {"0": "😂", "1": "😄", ...})
         with open(EMOJI_MAP_PATH, 'r', encoding='utf-8') as f:
@@ -43,15 +82,18 @@ class RealtimeEmotionPredictor:
         # 输入缓存：存储 (字符, 时间戳) 元组
         self.char_buffer = deque()
         self.lock = threading.Lock()
+        # 本会话计入 buffer_size 的字数（多个会话共享同一个仪表，按增量累加）
+        self.reported_size = 0
         
         # 控制标志
         self.running = True
         self.last_prediction = ""
         self.last_text = ""
         
-        print(f"模型加载完成！支持的emoji: {list(self.emoji_map.keys())}")
-        print(f"缓存设置: 最多{MAX_CHARS}字, {CACHE_TIMEOUT}秒超时")
-        print("-" * 50)
+        if verbose:
+            print(f"模型加载完成！支持的emoji: {list(self.emoji_map.keys())}")
+            print(f"缓存设置: 最多{MAX_CHARS}字, {CACHE_TIMEOUT}秒超时")
+            print("-" * 50)
     
     def add_text(self, text):
         """添加文本到缓存"""
@@ -64,14 +106,37 @@ class RealtimeEmotionPredictor:
             # 限制最大字数
             while len(self.char_buffer) > MAX_CHARS:
                 self.char_buffer.popleft()
+            self._report_buffer_size()
+    
+    def _report_buffer_size(self):
+        """把本会话缓存字数的变化累加到 buffer_size（调用方持有 self.lock）"""
+        size = len(self.char_buffer)
+        self.metrics.buffer_size.inc(size - self.reported_size)
+        self.reported_size = size
+    
+    def clear(self):
+        """清空输入缓存"""
+        with self.lock:
+            self.char_buffer.clear()
+            self._report_buffer_size()
+    
+    def close(self):
+        """会话结束：停止预测循环，并从 buffer_size 中扣除本会话的字数"""
+        self.running = False
+        self.clear()
     
     def get_cached_text(self):
         """获取有效缓存文本（清除超时字符）"""
         current_time = time.time()
         with self.lock:
             # 移除超时的字符
+            expired = 0
             while self.char_buffer and (current_time - self.char_buffer[0][1]) > CACHE_TIMEOUT:
                 self.char_buffer.popleft()
+                expired += 1
+            if expired:
+                self.metrics.expired_chars.inc(expired)
+            self._report_buffer_size()
             
             # 组合成文本
             return ''.join(char for char, _ in self.char_buffer)
@@ -79,32 +144,37 @@ class RealtimeEmotionPredictor:
     def predict(self, text):
         """预测情绪"""
         if not text or len(text) < 2:
+            self.metrics.skipped_short.inc()
             return None, 0.0
         
-        with torch.no_grad():
-            inputs = self.tokenizer(
-                text,
-                max_length=128,
-                padding='max_length',
-                truncation=True,
-                return_tensors='pt'
-            )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            outputs = self.model(**inputs)
-            probs = torch.softmax(outputs.logits, dim=-1)
-            pred_id = torch.argmax(probs, dim=-1).item()
-            confidence = probs[0][pred_id].item()
-            
-            emoji = self.id_to_emoji.get(pred_id, "❓")
-            return emoji, confidence
+        start = time.perf_counter()
+        if hasattr(self.model, 'encode'):
+            with self.metrics.tokenize_seconds.time():
+                inputs = self.model.encode(text)
+            with self.metrics.forward_seconds.time():
+                logits = self.model.forward(inputs)
+            probs = softmax(logits)[0]
+        else:
+            # 没有分词/前向拆分的后端（如级联预测器）只记录端到端耗时
+            probs = self.model.predict_proba(text)[0]
+        pred_id = int(probs.argmax())
+        confidence = float(probs[pred_id])
+        
+        emoji = self.id_to_emoji.get(pred_id, "❓")
+        self.metrics.predictions.inc()
+        self.metrics.predict_seconds.observe(time.perf_counter() - start)
+        return emoji, confidence
     
     def prediction_loop(self):
         """后台预测循环"""
         while self.running:
             text = self.get_cached_text()
             
-            if text and text != self.last_text:
+            if text and text == self.last_text:
+                # 文本没有变化，沿用上一次的预测结果
+                self.metrics.cache_hits.inc()
+            elif text:
+                self.metrics.cache_misses.inc()
                 emoji, confidence = self.predict(text)
                 if emoji:
                     self.last_prediction = f"{emoji} ({confidence*100:.1f}%)"
@@ -129,6 +199,15 @@ class RealtimeEmotionPredictor:
         print(f"🎭 预测: {self.last_prediction}")
         print(f"\n请输入文字 (输入 'quit' 退出): ", end="", flush=True)
     
+    def on_reload(self, report, error):
+        """热更新结束的回调"""
+        if error is not None:
+            print(f"\n❌ 模型热更新失败，继续使用当前模型: {error}")
+        else:
+            print(f"\n✅ 已切换到第 {report['generation']} 版模型 "
+                  f"(加载 {report['load_ms']:.0f}ms, 预热 {report['warmup_ms']:.0f}ms)")
+        print("请输入文字 (输入 'quit' 退出): ", end="", flush=True)
+    
     def run(self):
         """运行交互式测试"""
         print("\n" + "=" * 50)
@@ -141,6 +220,8 @@ class RealtimeEmotionPredictor:
         print("  - 最多保留20个字")
         print("  - 输入 'quit' 或 'q' 退出")
         print("  - 输入 'clear' 或 'c' 清空缓存")
+        if hasattr(self.model, 'reload_async'):
+            print("  - 输入 'reload' 热更新模型（不中断预测）")
         print("=" * 50 + "\n")
         
         # 启动后台预测线程
@@ -159,12 +240,15 @@ class RealtimeEmotionPredictor:
                         self.running = False
                         break
                     elif user_input.lower() in ['clear', 'c']:
-                        with self.lock:
-                            self.char_buffer.clear()
+                        self.clear()
                         self.last_text = ""
                         self.last_prediction = ""
                         print("🗑️ 缓存已清空")
                         print("请输入文字 (输入 'quit' 退出): ", end="", flush=True)
+                    elif user_input.lower() == 'reload' and hasattr(self.model, 'reload_async'):
+                        print("🔄 后台加载新模型...")
+                        self.model.reload_async(callback=self.on_reload)
+                        print("请输入文字 (输入 'quit' 退出): ", end="", flush=True)
                     elif user_input.strip():
                         self.add_text(user_input)
                         # 立即触发一次预测
@@ -187,7 +271,17 @@ class RealtimeEmotionPredictor:
 
 
 def main():
-    predictor = RealtimeEmotionPredictor()
+    from hot_reload import ReloadableModel
+    
+    model = ReloadableModel(TorchEmotionModel, MODEL_PATH)
+    predictor = RealtimeEmotionPredictor(model=model)
+    if "--watch" in sys.argv:
+        model.watch(callback=predictor.on_reload)
+        print(f"👀 监视模型目录: {MODEL_PATH}")
+    if "--no-metrics" not in sys.argv:
+        server = start_metrics_server()
+        host, port = server.server_address[:2]
+        print(f"📈 指标端点: http://{host}:{port}/metrics")
     predictor.run()
 
 
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+分词器 / 标签的二进制 bundle（tokenizer.emtk）
+代替 vocab.txt + emoji_map.json + model_config.json 中设备端需要的部分：
+文件可以直接内存映射，查表就是在有序数组上二分查找，启动时不需要解析。
+
+格式（版本 1，所有整数均为小端）:
+
+    偏移  大小  字段
+    0     4     magic "EMTK"
+    4     2     version (u16) = 1
+    6     2     header_size (u16) = 64
+    8     4     checksum (u32)：CRC-32（zlib / IEEE）覆盖第 12 字节到文件末尾
+    12    4     max_length (u32)
+    16    4     vocab_size (u32)：vocab.txt 的行数
+    20    4     num_entries (u32)：码位表条目数
+    24    4     num_labels (u32)
+    28    4     num_buckets (u32)
+    32    16    cls_id, sep_id, unk_id, pad_id (u32 x 4)
+    48    4     table_offset (u32)
+    52    4     buckets_offset (u32)
+    56    4     labels_offset (u32)
+    60    4     保留，为 0
+
+    table_offset:   num_entries 个 (code_point u32, token_id u32)，按 code_point 严格递增
+    buckets_offset: num_buckets 个 u32，递增，最后一个等于 max_length
+    labels_offset:  (num_labels + 1) 个 u32 字符串偏移（相对于偏移数组之后的字符串区），
+                    随后是各标签的 UTF-8 字节；第 i 个标签为 [offsets[i], offsets[i + 1])
+
+码位表只包含恰好一个码位的 token，与 Swift 的 String(char) 查 vocab 一致
+（同一 token 出现多次时取最后一行）；查不到的字符，以及多码位字素簇，都是 unk_id。
+读取方只需检查 magic、version 和 checksum；header_size 之后的各段位置一律以偏移为准，
+以后的版本可以在头部和各段之间追加字段。
+
+Swift 端的实现见 ios_integration/TokenizerBundle.swift。
+
+用法:
+    python tokenizer_bundle.py                          # 校验 output/tokenizer.emtk（与 vocab.txt 逐项比对）
+    python tokenizer_bundle.py build [--vocab output/vocab.txt] [--output output/tokenizer.emtk]
+"""
+
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+import argparse
+from bisect import bisect_left
+from config import MODEL_CONFIG, PATH_CONFIG, EMOJI_LIST
+
+
+MAGIC = b"EMTK"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIIIIIIIIIIIII")
+HEADER_SIZE = 64
+CHECKSUM_START = 12
+
+
+class BundleError(ValueError):
+    pass
+
+
+def load_vocab(vocab_path):
+    """与 Swift loadVocab() 相同：按行号编号，跳过空行，后出现的覆盖前面的"""
+    vocab = {}
+    with open(vocab_path, 'r', encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    for index, token in enumerate(lines):
+        if token:
+            vocab[token] = index
+    return vocab, len(lines)
+
+
+def build_bundle(vocab, vocab_size, labels, max_length, buckets):
+    """生成 bundle 的字节内容"""
+    entries = sorted((ord(token), index) for token, index in vocab.items() if len(token) == 1)
+    label_bytes = [label.encode('utf-8') for label in labels]
+    label_offsets = [0]
+    for data in label_bytes:
+        label_offsets.append(label_offsets[-1] + len(data))
+
+    table_offset = HEADER_SIZE
+    buckets_offset = table_offset + 8 * len(entries)
+    labels_offset = buckets_offset + 4 * len(buckets)
+
+    body = bytearray()
+    for code_point, index in entries:
+        body += struct.pack("<II", code_point, index)
+    body += struct.pack(f"<{len(buckets)}I", *buckets)
+    body += struct.pack(f"<{len(label_offsets)}I", *label_offsets)
+    body += b"".join(label_bytes)
+    body += b"\0" * (-len(body) % 4)
+
+    header = HEADER.pack(
+        MAGIC, VERSION, HEADER_SIZE, 0,
+        max_length, vocab_size, len(entries), len(labels), len(buckets),
+        vocab.get('[CLS]', 101), vocab.get('[SEP]', 102), vocab.get('[UNK]', 100), vocab.get('[PAD]', 0),
+        table_offset, buckets_offset, labels_offset, 0,
+    )
+    data = bytearray(header) + body
+    struct.pack_into("<I", data, 8, zlib.crc32(data[CHECKSUM_START:]))
+    return bytes(data)
+
+
+def write_bundle(output_path, vocab_path=None, labels=None, max_length=None, buckets=None):
+    """从 vocab.txt 生成 bundle（先写临时文件再替换，正在映射旧文件的进程不受影响）"""
+    max_length = max_length or MODEL_CONFIG['max_length']
+    if buckets is None:
+        from inference_utils import get_seq_buckets
+        buckets = get_seq_buckets(max_length)
+    vocab, vocab_size = load_vocab(vocab_path or PATH_CONFIG['vocab_path'])
+    data = build_bundle(vocab, vocab_size, labels or EMOJI_LIST, max_length, buckets)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return len(data)
+
+
+class TokenizerBundle:
+    """内存映射读取 bundle；构造时只读取 64 字节头部和校验"""
+
+    def __init__(self, path=None, verify=True):
+        self.path = path or PATH_CONFIG['tokenizer_bundle_path']
+        with open(self.path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < HEADER_SIZE:
+            raise BundleError(f"{self.path}: file too small")
+
+        (magic, version, header_size, checksum, self.max_length, self.vocab_size, self.num_entries,
+         self.num_labels, num_buckets, self.cls_id, self.sep_id, self.unk_id, self.pad_id,
+         table_offset, buckets_offset, labels_offset, _) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise BundleError(f"{self.path}: not a tokenizer bundle")
+        if version != VERSION:
+            raise BundleError(f"{self.path}: unsupported version {version}")
+        if verify and zlib.crc32(self.buffer[CHECKSUM_START:]) != checksum:
+            raise BundleError(f"{self.path}: checksum mismatch")
+
+        view = memoryview(self.buffer)
+        little = sys.byteorder == 'little'
+        self._table = view[table_offset:table_offset + 8 * self.num_entries]
+        self._code_points = self._table.cast('I')[0::2] if little else None
+        self.buckets = list(struct.unpack_from(f"<{num_buckets}I", self.buffer, buckets_offset))
+        self._label_offsets = labels_offset
+        self._strings = labels_offset + 4 * (self.num_labels + 1)
+
+    def token_id(self, char):
+        """单个字符（Swift Character）的 id；多码位字素簇为 unk_id"""
+        if len(char) != 1:
+            return self.unk_id
+        code_point = ord(char)
+        if self._code_points is not None:
+            i = bisect_left(self._code_points, code_point)
+        else:
+            lo, hi = 0, self.num_entries
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if struct.unpack_from("<I", self._table, 8 * mid)[0] < code_point:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            i = lo
+        if i < self.num_entries:
+            found, token_id = struct.unpack_from("<II", self._table, 8 * i)
+            if found == code_point:
+                return token_id
+        return self.unk_id
+
+    def label(self, index):
+        start, end = struct.unpack_from("<II", self.buffer, self._label_offsets + 4 * index)
+        return self.buffer[self._strings + start:self._strings + end].decode('utf-8')
+
+    @property
+    def labels(self):
+        return [self.label(i) for i in range(self.num_labels)]
+
+    def table_arrays(self):
+        """码位表的 numpy 视图 (code_points, token_ids)，不复制"""
+        import numpy as np
+
+        table = np.frombuffer(self._table, dtype='<u4').reshape(-1, 2)
+        return table[:, 0], table[:, 1]
+
+
+def verify_tokenizer_bundle(path=None, vocab_path=None):
+    """与 vocab.txt / EMOJI_LIST 逐项比对，并检查损坏检测"""
+    path = path or PATH_CONFIG['tokenizer_bundle_path']
+    vocab_path = vocab_path or PATH_CONFIG['vocab_path']
+
+    print("="*60)
+    print(f"Verifying {path}")
+    print("="*60)
+    ok = True
+
+    start = time.perf_counter()
+    vocab, vocab_size = load_vocab(vocab_path)
+    vocab_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    bundle = TokenizerBundle(path)
+    bundle_ms = (time.perf_counter() - start) * 1000
+    print(f"Load: vocab.txt {vocab_ms:.1f} ms, bundle {bundle_ms:.2f} ms (including checksum)")
+
+    checks = [
+        ("vocab_size", bundle.vocab_size, vocab_size),
+        ("max_length", bundle.max_length, MODEL_CONFIG['max_length']),
+        ("labels", bundle.labels, EMOJI_LIST),
+        ("special ids", (bundle.cls_id, bundle.sep_id, bundle.unk_id, bundle.pad_id),
+         (vocab.get('[CLS]', 101), vocab.get('[SEP]', 102), vocab.get('[UNK]', 100), vocab.get('[PAD]', 0))),
+    ]
+    for name, got, expected in checks:
+        same = got == expected
+        ok &= same
+        print(f"{'✓' if same else '✗'} {name}: {got if same else f'{got} != {expected}'}")
+
+    # 与 Swift 的 vocab[String(char)] 逐字符比对：词表中所有单字 token，以及一些不在词表中的字符
+    chars = [t for t in vocab if len(t) == 1] + ["\U0001FAE0", "‍", "\U0010FFFF", "é", "👍🏻", "🇨🇳"]
+    mismatch = [c for c in chars if bundle.token_id(c) != (vocab.get(c, bundle.unk_id) if len(c) == 1 else bundle.unk_id)]
+    ok &= not mismatch
+    print(f"{'✓' if not mismatch else '✗'} Lookups: {len(chars) - len(mismatch)}/{len(chars)} identical")
+
+    # 任意一个字节损坏都应被检测到
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[len(data) // 2] ^= 0xFF
+    corrupt_path = path + ".corrupt"
+    with open(corrupt_path, 'wb') as f:
+        f.write(data)
+    try:
+        TokenizerBundle(corrupt_path)
+        detected = False
+    except BundleError:
+        detected = True
+    finally:
+        os.remove(corrupt_path)
+    ok &= detected
+    print(f"{'✓' if detected else '✗'} Corruption detected")
+
+    print("✓ Tokenizer bundle verified" if ok else "✗ Tokenizer bundle mismatch")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the binary tokenizer/label bundle")
+    parser.add_argument("command", nargs="?", choices=["verify", "build"], default="verify")
+    parser.add_argument("--vocab", default=PATH_CONFIG['vocab_path'])
+    parser.add_argument("--output", default=PATH_CONFIG['tokenizer_bundle_path'])
+    args = parser.parse_args()
+
+    if args.command == "build":
+        size = write_bundle(args.output, args.vocab)
+        print(f"✓ Bundle saved: {args.output} ({size / 1024:.1f} KB)")
+        return True
+    return verify_tokenizer_bundle(args.output, args.vocab)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
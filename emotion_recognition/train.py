@@ -4,6 +4,8 @@
 """
 
 import os
+import time
+import shutil
 import torch
 import torch.nn as nn
 from torch.optim import AdamW
@@ -18,6 +20,7 @@ import numpy as np
 
 from config import MODEL_CONFIG, TRAINING_CONFIG, PATH_CONFIG, EMOJI_LIST, ID_TO_EMOJI
 from data_processing import load_and_process_data, create_dataloaders
+from memory_profile import maybe_enable_memory_profile, memory_stage
 
 
 def setup_device():
@@ -32,7 +35,7 @@ def setup_device():
     return device
 
 
-def load_model():
+def load_model(gradient_checkpointing=None):
     """加载预训练模型 - 全参数微调"""
     print(f"\nLoading model: {MODEL_CONFIG['model_name']}")
     
@@ -42,6 +45,13 @@ def load_model():
         num_labels=MODEL_CONFIG['num_labels'],
     )
     
+    # 梯度检查点：反向时重算激活值，省下的内存可以换更大的 batch
+    if gradient_checkpointing is None:
+        gradient_checkpointing = TRAINING_CONFIG.get('gradient_checkpointing', False)
+    if gradient_checkpointing:
+        model.gradient_checkpointing_enable()
+        print("Gradient checkpointing enabled")
+    
     # 统计参数
     total_params = sum(p.numel() for p in model.parameters())
     trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
@@ -61,12 +71,13 @@ def train_epoch(model, train_loader, optimizer, scheduler, device, criterion=Non
     all_labels = []
     
     progress_bar = tqdm(train_loader, desc="Training")
+    epoch_start = time.perf_counter()
     
     for batch in progress_bar:
-        # 移动数据到设备
-        input_ids = batch['input_ids'].to(device)
-        attention_mask = batch['attention_mask'].to(device)
-        labels = batch['labels'].to(device)
+        # 移动数据到设备（batch 已在后台 pin 住时异步拷贝）
+        input_ids = batch['input_ids'].to(device, non_blocking=True)
+        attention_mask = batch['attention_mask'].to(device, non_blocking=True)
+        labels = batch['labels'].to(device, non_blocking=True)
         
         # 前向传播
         optimizer.zero_grad()
@@ -100,6 +111,11 @@ def train_epoch(model, train_loader, optimizer, scheduler, device, criterion=Non
     avg_loss = total_loss / len(train_loader)
     accuracy = accuracy_score(all_labels, all_preds)
     
+    # 训练线程等待数据的时间：预取跟得上时应接近 0
+    if hasattr(train_loader, 'wait_seconds'):
+        elapsed = time.perf_counter() - epoch_start
+        print(f"Data wait: {train_loader.wait_seconds:.2f}s ({train_loader.wait_seconds / elapsed:.1%} of epoch)")
+    
     return avg_loss, accuracy
 
 
@@ -117,9 +133,9 @@ def evaluate(model, data_loader, device, desc="Evaluating"):
         progress_bar = tqdm(data_loader, desc=desc)
         
         for batch in progress_bar:
-            input_ids = batch['input_ids'].to(device)
-            attention_mask = batch['attention_mask'].to(device)
-            labels = batch['labels'].to(device)
+            input_ids = batch['input_ids'].to(device, non_blocking=True)
+            attention_mask = batch['attention_mask'].to(device, non_blocking=True)
+            labels = batch['labels'].to(device, non_blocking=True)
             
             outputs = model(
                 input_ids=input_ids,
@@ -182,6 +198,9 @@ def train(model, train_loader, val_loader, device, class_weights=None):
     print(f"Total steps: {total_steps}, Warmup steps: {warmup_steps}")
     print(f"{'='*60}")
     
+    if TRAINING_CONFIG.get('async_eval', False):
+        return train_with_async_eval(model, train_loader, optimizer, scheduler, device, criterion, patience)
+    
     for epoch in range(TRAINING_CONFIG['num_epochs']):
         print(f"\n--- Epoch {epoch + 1}/{TRAINING_CONFIG['num_epochs']} ---")
         
@@ -217,16 +236,62 @@ def train(model, train_loader, val_loader, device, class_weights=None):
     return model
 
 
+def train_with_async_eval(model, train_loader, optimizer, scheduler, device, criterion, patience):
+    """验证在独立进程中进行（见 async_eval.py），训练循环只读取已经出来的结果，从不等待"""
+    from async_eval import AsyncValidation
+    
+    validation = AsyncValidation()
+    try:
+        for epoch in range(TRAINING_CONFIG['num_epochs']):
+            print(f"\n--- Epoch {epoch + 1}/{TRAINING_CONFIG['num_epochs']} ---")
+            
+            train_loss, train_acc = train_epoch(
+                model, train_loader, optimizer, scheduler, device, criterion
+            )
+            print(f"Train Loss: {train_loss:.4f}, Train Accuracy: {train_acc:.4f}")
+            
+            validation.submit(model, epoch + 1)
+            validation.poll()
+            
+            # 早停按已评估的 epoch 计算（验证结果可能落后几个 epoch）
+            if validation.epochs_without_improvement() >= patience:
+                print(f"\nEarly stopping at epoch {epoch + 1} "
+                      f"(no improvement since epoch {validation.best_epoch})")
+                break
+        
+        validation.finish()
+    finally:
+        validation.close()
+    
+    print(f"\nBest validation accuracy: {validation.best_accuracy:.4f}")
+    print(f"Best validation F1: {validation.best_f1:.4f} (epoch {validation.best_epoch})")
+    
+    return model
+
+
 def save_model(model, save_path):
     """保存模型"""
-    os.makedirs(save_path, exist_ok=True)
-    model.save_pretrained(save_path)
+    # 先写到临时目录，再逐个文件 os.replace 到目标目录：
+    # 正在运行的预测器以内存映射方式读取 model.safetensors，原地覆盖写会破坏它，
+    # 替换文件则让旧映射继续指向旧文件，热更新（hot_reload.py）看到的也总是完整的文件
+    tmp_path = save_path.rstrip('/') + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    model.save_pretrained(tmp_path)
+    install_model_dir(tmp_path, save_path)
     
+    print(f"Model saved to {save_path}")
+
+
+def install_model_dir(src_path, save_path):
+    """把 src_path 中的模型文件加上 tokenizer，逐个文件替换到 save_path（src_path 随后删除）"""
     # 同时保存tokenizer
     tokenizer = AutoTokenizer.from_pretrained(MODEL_CONFIG['model_name'])
-    tokenizer.save_pretrained(save_path)
+    tokenizer.save_pretrained(src_path)
     
-    print(f"Model saved to {save_path}")
+    os.makedirs(save_path, exist_ok=True)
+    for name in os.listdir(src_path):
+        os.replace(os.path.join(src_path, name), os.path.join(save_path, name))
+    os.rmdir(src_path)
 
 
 def show_predictions(model, val_loader, device, tokenizer, num_samples=10):
@@ -268,6 +333,14 @@ def main():
     import sys
     sys.stdout.flush()
     
+    if "--async-eval" in sys.argv:
+        TRAINING_CONFIG['async_eval'] = True
+    if "--gradient-checkpointing" in sys.argv:
+        TRAINING_CONFIG['gradient_checkpointing'] = True
+    if "--auto-batch-size" in sys.argv:
+        TRAINING_CONFIG['auto_batch_size'] = True
+    maybe_enable_memory_profile()
+    
     # 创建输出目录
     os.makedirs(PATH_CONFIG['output_dir'], exist_ok=True)
     print("[DEBUG] Output directory created")
@@ -281,23 +354,32 @@ def main():
     # 加载数据
     print("[DEBUG] Starting to load data...")
     sys.stdout.flush()
-    train_dataset, val_dataset, class_weights, tokenizer = load_and_process_data()
+    with memory_stage("load_data"):
+        train_dataset, val_dataset, class_weights, tokenizer = load_and_process_data()
     print(f"[DEBUG] Data loaded: train={len(train_dataset)}, val={len(val_dataset)}")
     sys.stdout.flush()
     
-    train_loader, val_loader = create_dataloaders(train_dataset, val_dataset)
+    if TRAINING_CONFIG.get('auto_batch_size'):
+        from batch_size_finder import resolve_batch_size
+        with memory_stage("batch_size_probe"):
+            TRAINING_CONFIG['batch_size'] = resolve_batch_size(device)
+        print(f"Training batch size: {TRAINING_CONFIG['batch_size']}")
+    
+    train_loader, val_loader = create_dataloaders(train_dataset, val_dataset, device)
     print(f"[DEBUG] DataLoaders created")
     sys.stdout.flush()
     
     # 加载模型
     print("[DEBUG] Starting to load model...")
     sys.stdout.flush()
-    model = load_model()
+    with memory_stage("load_model"):
+        model = load_model()
     print("[DEBUG] Model loaded successfully")
     sys.stdout.flush()
     
-    # 训练
-    model = train(model, train_loader, val_loader, device, class_weights)
+    # 训练（包含 AdamW 的优化器状态）
+    with memory_stage("train"):
+        model = train(model, train_loader, val_loader, device, class_weights)
     
     # 加载最佳模型进行最终评估
     print(f"\n{'='*60}")
@@ -310,9 +392,10 @@ def main():
     model.to(device)
     
     # 最终评估
-    val_loss, val_acc, val_f1, val_preds, val_labels, val_probs = evaluate(
-        model, val_loader, device, "Final Evaluation"
-    )
+    with memory_stage("final_evaluation"):
+        val_loss, val_acc, val_f1, val_preds, val_labels, val_probs = evaluate(
+            model, val_loader, device, "Final Evaluation"
+        )
     
     print(f"\n{'='*60}")
     print("Final Results")